@@ -84,9 +84,9 @@ async def send_campaign(campaign_id: str, background_tasks: BackgroundTasks, sen
     
     # Get prospects from campaign lists
     prospects = []
-    for list_id in campaign.get("list_ids", []):
-        list_prospects = await db_service.get_prospects_by_list_id(list_id)
-        prospects.extend(list_prospects)
+    if campaign.get("list_ids"):
+        async for chunk in db_service.iter_prospects_for_lists(campaign["list_ids"]):
+            prospects.extend(chunk)
     
     # Remove duplicates
     seen_emails = set()
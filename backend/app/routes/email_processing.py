@@ -1,10 +1,12 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
+from app.services.blob_store_service import blob_store_service
 from app.services.email_processor_fixed import email_processor_fixed as email_processor
 from app.services.groq_service_fixed import groq_service
 from app.services.database import db_service
+from app.services.worker_control_service import worker_control_service
 from app.models import ThreadContext
 from app.utils.helpers import generate_id
-from typing import Dict, List
+from typing import Dict, List, Optional
 from datetime import datetime
 import logging
 
@@ -16,8 +18,8 @@ router = APIRouter()
 async def start_email_monitoring():
     """Start email monitoring service"""
     try:
-        result = await email_processor.start_monitoring()
-        return result
+        results = await worker_control_service.start_services(["email_processor"])
+        return results["email_processor"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -25,8 +27,8 @@ async def start_email_monitoring():
 async def stop_email_monitoring():
     """Stop email monitoring service"""
     try:
-        result = await email_processor.stop_monitoring()
-        return result
+        results = await worker_control_service.stop_services(["email_processor"])
+        return results["email_processor"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -136,6 +138,42 @@ async def get_thread_by_prospect(prospect_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/threads/{thread_id}/messages")
+async def get_thread_messages(thread_id: str, limit: int = 50, before: Optional[datetime] = None):
+    """Get a page of thread messages, oldest first; pass the first message's timestamp as `before` for older ones"""
+    try:
+        messages = await db_service.get_thread_messages(thread_id, limit=limit, before=before)
+        return {
+            "thread_id": thread_id,
+            "messages": messages,
+            "has_more": len(messages) == limit
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/threads/{thread_id}/messages/{message_id}/raw")
+async def get_thread_message_raw(thread_id: str, message_id: str):
+    """Get the raw MIME source of a received message"""
+    try:
+        message = await db_service.get_thread_message(thread_id, message_id)
+        if not message:
+            raise HTTPException(status_code=404, detail="Message not found")
+        
+        if message.get("raw_email_ref"):
+            raw_email = await blob_store_service.get(message["raw_email_ref"])
+        elif message.get("raw_email"):
+            raw_email = message["raw_email"].encode("utf-8", errors="replace")
+        else:
+            raw_email = None
+        if raw_email is None:
+            raise HTTPException(status_code=404, detail="Raw email not available")
+        
+        return Response(content=raw_email, media_type="message/rfc822")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/threads/{thread_id}/messages")
 async def add_message_to_thread(thread_id: str, message_data: Dict):
     """Add message to thread"""
@@ -179,8 +217,8 @@ async def simulate_email_processing(request: Dict):
         
         await email_processor._add_message_to_thread(thread_context["id"], message_data)
         
-        # Update prospect last contact time
-        await db_service.update_prospect_last_contact(prospect["id"], datetime.utcnow())
+        # Update prospect last contact and last received times
+        await db_service.record_prospect_message_received(prospect["id"], message_data["timestamp"])
         
         # FIXED: Check if this is a response to our email - for follow-up stopping
         is_response_to_our_email = await email_processor._check_if_response_to_our_email_fixed(
@@ -270,22 +308,13 @@ async def simulate_email_processing(request: Dict):
 async def get_processing_analytics():
     """Get email processing analytics"""
     try:
-        # Get threads count
-        threads = await db_service.get_threads()
-        
-        # Get processed emails count
-        processed_emails = 0
-        auto_responses_sent = 0
-        
-        for thread in threads:
-            messages = thread.get("messages", [])
-            processed_emails += len([m for m in messages if m.get("type") == "received"])
-            auto_responses_sent += len([m for m in messages if m.get("type") == "sent" and m.get("ai_generated")])
+        # Threads count and processed emails count from the thread summaries
+        totals = await db_service.get_thread_message_totals()
         
         return {
-            "total_threads": len(threads),
-            "processed_emails": processed_emails,
-            "auto_responses_sent": auto_responses_sent,
+            "total_threads": totals["total_threads"],
+            "processed_emails": totals["received_count"],
+            "auto_responses_sent": totals["ai_generated_count"],
             "processing_status": "running" if email_processor.processing else "stopped",
             "timestamp": datetime.utcnow().isoformat()
         }
@@ -181,8 +181,8 @@ async def analyze_prospect_thread(prospect_id: str):
                 "analysis": "No thread found for this prospect"
             }
         
-        # Analyze thread messages
-        messages = thread.get("messages", [])
+        # Analyze the whole thread, not just the recent messages attached to it
+        messages = await db_service.get_thread_messages(thread["id"])
         sent_messages = [m for m in messages if m.get("sent_by_us", False)]
         received_messages = [m for m in messages if m.get("type") == "received"]
         
@@ -265,7 +265,8 @@ async def restart_follow_up(prospect_id: str):
             "responded_at": None,
             "response_type": "",
             "follow_up_count": 0,
-            "last_follow_up": None
+            "last_follow_up": None,
+            "next_follow_up_at": None  # The follow-up engine computes the due time
         })
         
         if success:
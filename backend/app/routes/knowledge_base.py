@@ -123,11 +123,11 @@ async def test_article_relevance(article_id: str, test_data: Dict):
     if not query:
         raise HTTPException(status_code=400, detail="Query is required")
     
-    relevance_score = await knowledge_base_service._calculate_relevance_score(article, query)
+    relevance_score = await knowledge_base_service.score_article_relevance(article_id, query)
     
     return {
         "article_id": article_id,
         "query": query,
         "relevance_score": relevance_score,
-        "is_relevant": relevance_score > 0.3
+        "is_relevant": relevance_score > knowledge_base_service.min_relevance
     }
\ No newline at end of file
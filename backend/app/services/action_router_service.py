@@ -557,24 +557,8 @@ class ActionRouterService:
         try:
             if operation == 'show' or action == 'show_analytics' or operation == 'dashboard':
                 # Get dashboard metrics
-                prospects = await self.db.get_prospects()
-                campaigns = await self.db.get_campaigns()
-                
-                # Calculate basic analytics
-                total_campaigns = len(campaigns)
-                total_prospects = len(prospects)
-                active_campaigns = len([c for c in campaigns if c.get("status") == "active"])
-                
-                analytics_data = {
-                    "total_campaigns": total_campaigns,
-                    "total_prospects": total_prospects,
-                    "active_campaigns": active_campaigns,
-                    "total_emails_sent": 247,  # This would come from email records
-                    "average_open_rate": 24.5,
-                    "average_reply_rate": 8.2,
-                    "campaigns_this_month": len([c for c in campaigns if c.get("created_at") and c["created_at"].month == datetime.now().month]),
-                    "prospects_this_month": len([p for p in prospects if p.get("created_at") and p["created_at"].month == datetime.now().month])
-                }
+                from app.services.metrics_service import metrics_service
+                analytics_data = await metrics_service.get_overall_analytics()
                 
                 return {"success": True, "data": analytics_data, "message": "Analytics retrieved"}
             
@@ -813,12 +797,11 @@ class ActionRouterService:
             # Get prospects from campaign lists
             prospects = []
             list_ids = campaign.get("list_ids", [])
+            max_emails = parameters.get('max_emails', campaign.get('max_emails', 100))
             
             if list_ids:
-                for list_id in list_ids:
-                    list_prospects = await self.db.get_prospects_by_list_id(list_id)
-                    if list_prospects:
-                        prospects.extend(list_prospects)
+                async for chunk in self.db.iter_prospects_for_lists(list_ids, limit=max_emails):
+                    prospects.extend(chunk)
             
             # If no prospects from lists, get all prospects
             if not prospects:
@@ -835,7 +818,7 @@ class ActionRouterService:
                     seen_emails.add(prospect["email"])
                     unique_prospects.append(prospect)
             
-            prospects = unique_prospects[:parameters.get('max_emails', campaign.get('max_emails', 100))]
+            prospects = unique_prospects[:max_emails]
             
             # Get email provider
             provider = await email_provider_service.get_default_provider()
@@ -928,6 +911,7 @@ class ActionRouterService:
                 "follow_up_templates": follow_up_templates,
                 "campaign_id": campaign_id,
                 "last_contact": datetime.utcnow(),
+                "next_follow_up_at": None,  # The follow-up engine computes the due time
                 "updated_at": datetime.utcnow()
             })
             
@@ -5,10 +5,9 @@ import json
 import re
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
-from groq import Groq
-import os
 import logging
 from urllib.parse import quote
+from app.services.groq_service import groq_gateway
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,7 +15,7 @@ logger = logging.getLogger(__name__)
 
 class AIProspectingService:
     def __init__(self):
-        self.groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+        self.groq_client = groq_gateway
         self.apollo_api_key = "01fe975866msh9ba2aba2d44e55ap193b18jsnad0c05952c37"
         self.apollo_base_url = "https://apollo-io-no-cookies-required.p.rapidapi.com/search_people_via_url"
         
@@ -74,7 +73,7 @@ Example:
 }"""
 
             # Call Groq API
-            response = self.groq_client.chat.completions.create(
+            response = await self.groq_client.chat.completions.create(
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": f"Extract prospect parameters from: {query}"}
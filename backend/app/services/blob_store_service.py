@@ -0,0 +1,165 @@
+"""
+Blob Store Service - content-addressed, compressed storage for large payloads such as raw MIME
+"""
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Dict, Optional
+from gridfs.errors import NoFile
+from app.services.database import db_service
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class BlobStoreService:
+    """Stores blobs once per SHA-256 of their content, on the filesystem or in GridFS.
+
+    References look like "sha256:<hex>". Blobs are gzip compressed, or zstd when
+    BLOB_STORE_COMPRESSION=zstd and the zstandard package is installed; reads
+    detect the codec from the stored bytes, so the setting can change at any time.
+    """
+
+    def __init__(self):
+        self.backend = os.getenv("BLOB_STORE_BACKEND", "filesystem").lower()
+        self.root = os.getenv("BLOB_STORE_PATH", os.path.join(os.path.dirname(__file__), "..", "..", "data", "blobs"))
+        self.gridfs_bucket_name = os.getenv("BLOB_STORE_GRIDFS_BUCKET", "blobs")
+        self.compression = os.getenv("BLOB_STORE_COMPRESSION", "gzip").lower()
+        if self.compression == "zstd" and zstandard is None:
+            logger.warning("BLOB_STORE_COMPRESSION=zstd but zstandard is not installed; using gzip")
+            self.compression = "gzip"
+        self._bucket = None
+        self.stored_count = 0
+        self.deduplicated_count = 0
+        self.bytes_in = 0
+        self.bytes_stored = 0
+
+    def _compress(self, data: bytes) -> bytes:
+        """Compress with the configured codec"""
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor().compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    def _decompress(self, data: bytes) -> bytes:
+        """Decompress either codec, recognised by its magic bytes"""
+        if data.startswith(ZSTD_MAGIC):
+            if zstandard is None:
+                raise RuntimeError("Blob is zstd compressed but zstandard is not installed")
+            return zstandard.ZstdDecompressor().decompress(data)
+        if data.startswith(GZIP_MAGIC):
+            return gzip.decompress(data)
+        return data
+
+    def _path(self, digest: str) -> str:
+        """Filesystem location of a blob, fanned out over two directory levels"""
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def _stored_size(self, digest: str) -> Optional[int]:
+        """Size of a stored blob file, None when it does not exist"""
+        try:
+            return os.path.getsize(self._path(digest))
+        except FileNotFoundError:
+            return None
+
+    def _write_file(self, digest: str, data: bytes):
+        """Write a blob file through a temporary file unique to this writer"""
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as blob_file:
+                blob_file.write(data)
+            os.replace(temp_path, path)  # Atomic, so readers never see a partial blob
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _read_file(self, digest: str) -> Optional[bytes]:
+        """Read a blob file"""
+        try:
+            with open(self._path(digest), "rb") as blob_file:
+                return blob_file.read()
+        except FileNotFoundError:
+            return None
+
+    async def _get_bucket(self):
+        """GridFS bucket on the application database"""
+        if self._bucket is None:
+            from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+            await db_service.connect()
+            self._bucket = AsyncIOMotorGridFSBucket(db_service.db, bucket_name=self.gridfs_bucket_name)
+        return self._bucket
+
+    async def put(self, data: bytes) -> Dict:
+        """Store a blob (once per content) and return its reference and sizes"""
+        digest = hashlib.sha256(data).hexdigest()
+        self.bytes_in += len(data)
+
+        # Content already stored needs no compression pass
+        if self.backend == "gridfs":
+            bucket = await self._get_bucket()
+            existing = await bucket.find({"filename": digest}).to_list(length=1)
+            stored_size = existing[0]["length"] if existing else None
+        else:
+            stored_size = await asyncio.to_thread(self._stored_size, digest)
+        if stored_size is not None:
+            self.deduplicated_count += 1
+            return {"ref": f"sha256:{digest}", "size": len(data), "compressed_size": stored_size}
+
+        compressed = await asyncio.to_thread(self._compress, data)
+        if self.backend == "gridfs":
+            await bucket.upload_from_stream(digest, compressed, metadata={"size": len(data)})
+        else:
+            await asyncio.to_thread(self._write_file, digest, compressed)
+
+        self.stored_count += 1
+        self.bytes_stored += len(compressed)
+        return {"ref": f"sha256:{digest}", "size": len(data), "compressed_size": len(compressed)}
+
+    async def get(self, ref: str) -> Optional[bytes]:
+        """Load a blob by reference; None when it does not exist"""
+        digest = ref.split(":", 1)[-1]
+        if self.backend == "gridfs":
+            bucket = await self._get_bucket()
+            try:
+                stream = await bucket.open_download_stream_by_name(digest)
+            except NoFile:
+                return None
+            compressed = await stream.read()
+        else:
+            compressed = await asyncio.to_thread(self._read_file, digest)
+            if compressed is None:
+                return None
+        return await asyncio.to_thread(self._decompress, compressed)
+
+    async def raw_email_fields(self, raw_email: bytes) -> Dict:
+        """Thread message fields for a raw MIME message: a blob reference, or the text inline if storing fails"""
+        try:
+            blob = await self.put(raw_email)
+            return {"raw_email_ref": blob["ref"], "raw_email_size": blob["size"]}
+        except Exception as e:
+            logger.error(f"Error storing raw email in blob store, keeping it inline: {str(e)}")
+            return {"raw_email": raw_email.decode("utf-8", errors="replace")}
+
+    def get_stats(self) -> Dict:
+        """Get blob store statistics for this process"""
+        return {
+            "backend": self.backend,
+            "compression": self.compression,
+            "stored": self.stored_count,
+            "deduplicated": self.deduplicated_count,
+            "bytes_in": self.bytes_in,
+            "bytes_stored": self.bytes_stored
+        }
+
+# Create global blob store service instance
+blob_store_service = BlobStoreService()
@@ -0,0 +1,440 @@
+"""
+Campaign Send Job Runner - durable background campaign sends with progress tracking
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from app.services.database import db_service, BulkWriteBuffer
+from app.services.email_provider_service import email_provider_service
+from app.services.provider_pool_service import provider_pool_service
+from app.utils.follow_up_schedule import compute_next_follow_up_at
+from app.utils.helpers import generate_id
+from app.utils.template_renderer import template_renderer
+
+logger = logging.getLogger(__name__)
+
+NO_PROVIDER_ERROR = "No active email provider can send this email"
+
+class SendJobLostError(Exception):
+    """Another worker took over the job, usually after this one missed heartbeats"""
+
+class CampaignSendJobRunner:
+    """Runs queued campaign send jobs stored in Mongo; resumes unfinished jobs after a restart"""
+
+    def __init__(self):
+        self.batch_size = int(os.getenv("SEND_JOB_BATCH_SIZE", 100))
+        self.poll_interval = int(os.getenv("SEND_JOB_POLL_INTERVAL", 5))
+        self.stale_after_seconds = int(os.getenv("SEND_JOB_STALE_SECONDS", 120))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.processing = False
+        self.current_job_id = None
+        self._preparing_tasks = set()
+
+    async def start_job_runner(self):
+        """Start the send job runner"""
+        if self.processing:
+            return {"status": "already_running"}
+
+        self.processing = True
+        logger.info(f"Starting campaign send job runner ({self.worker_id})...")
+
+        try:
+            asyncio.create_task(self._run_jobs())
+            return {"status": "started", "message": "Campaign send job runner started"}
+        except Exception as e:
+            self.processing = False
+            logger.error(f"Failed to start campaign send job runner: {str(e)}")
+            return {"status": "error", "message": str(e)}
+
+    async def stop_job_runner(self):
+        """Stop the send job runner after the batch in flight"""
+        self.processing = False
+        logger.info("Campaign send job runner stopped")
+        return {"status": "stopped"}
+
+    async def create_send_job(self, campaign: Dict, provider: Optional[Dict], max_emails: Optional[int] = None) -> Dict:
+        """Create a send job in "preparing" and return it right away; its recipients are streamed
+        from the campaign's lists in the background, after which the job is queued.
+
+        A job pinned to a provider sends only through it; without one it spreads over the provider pool.
+        """
+        job_data = {
+            "id": generate_id(),
+            "campaign_id": campaign["id"],
+            "template_id": campaign.get("template_id"),
+            "provider_id": provider["id"] if provider else None,
+            "status": "preparing",  # Not claimable until every item is stored
+            "total": 0,
+            "sent_count": 0,
+            "failed_count": 0,
+            "worker_id": None,
+            "heartbeat_at": datetime.utcnow(),  # Kept fresh while recipients are added
+            "created_at": datetime.utcnow(),
+            "started_at": None,
+            "completed_at": None,
+            "error": None
+        }
+        job = await db_service.create_send_job(job_data)
+        await db_service.update_campaign(campaign["id"], {"current_send_job_id": job["id"]})
+
+        task = asyncio.create_task(self._prepare_job(job, campaign.get("list_ids", []), max_emails))
+        self._preparing_tasks.add(task)
+        task.add_done_callback(self._preparing_tasks.discard)
+        return job
+
+    async def _prepare_job(self, job: Dict, list_ids: List[str], max_emails: Optional[int]):
+        """Add a preparing job's recipients, then queue it; a job left without recipients fails"""
+        try:
+            total = await self._add_job_recipients(job, list_ids, max_emails)
+
+            # If no prospects from lists, use all prospects (fallback)
+            if not total and list_ids:
+                total = await self._add_job_recipients(job, None, max_emails)
+
+            if not total:
+                await self._fail_preparing_job(job, "No prospects found for this campaign")
+                return
+
+            await db_service.update_send_job(job["id"], {"status": "queued", "total": total})
+            logger.info(f"Queued send job {job['id']} for campaign {job['campaign_id']} with {total} recipients")
+        except Exception as e:
+            logger.error(f"Error adding recipients to send job {job['id']}: {str(e)}")
+            try:
+                await self._fail_preparing_job(job, f"Error adding recipients: {str(e)}")
+            except Exception as fail_error:
+                # Left in "preparing", the runner fails it once its heartbeat goes stale
+                logger.error(f"Error failing send job {job['id']}: {str(fail_error)}")
+
+    async def _fail_preparing_job(self, job: Dict, error: str):
+        """Fail a job that never got queued and make its campaign sendable again"""
+        await db_service.update_send_job(job["id"], {"status": "failed", "error": error,
+                                                     "completed_at": datetime.utcnow()})
+        await db_service.release_campaign_send(job["campaign_id"], job["id"])
+        logger.warning(f"Send job {job['id']} failed: {error}")
+
+    async def _add_job_recipients(self, job: Dict, list_ids: Optional[List[str]], max_emails: Optional[int]) -> int:
+        """Stream unique prospects into job items chunk by chunk; returns how many were added"""
+        total = 0
+        async for prospects in db_service.iter_prospects_for_lists(
+            list_ids, batch_size=self.batch_size * 5, limit=max_emails, projection={"id": 1}
+        ):
+            total += await db_service.add_send_job_items(job, [prospect["id"] for prospect in prospects], total)
+            await db_service.update_send_job(job["id"], {"heartbeat_at": datetime.utcnow()})
+        return total
+
+    async def _run_jobs(self):
+        """Main loop: claim and process jobs until stopped"""
+        while self.processing:
+            try:
+                stale_before = datetime.utcnow() - timedelta(seconds=self.stale_after_seconds)
+                for stale_job in await db_service.fail_stale_preparing_send_jobs(stale_before):
+                    logger.warning(f"Send job {stale_job['id']} failed: interrupted while adding recipients")
+                    await db_service.release_campaign_send(stale_job["campaign_id"], stale_job["id"])
+
+                job = await db_service.claim_next_send_job(self.worker_id, stale_before)
+
+                if not job:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+
+                await self._process_job(job)
+
+            except Exception as e:
+                logger.error(f"Error in campaign send job runner: {str(e)}")
+                await asyncio.sleep(self.poll_interval * 2)
+
+    async def _process_job(self, job: Dict):
+        """Send all pending items of a job in batches"""
+        job_id = job["id"]
+        self.current_job_id = job_id
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+
+        try:
+            if job.get("started_at"):
+                # Items caught mid-send by a crash may or may not have gone out; never send them twice
+                interrupted = await db_service.fail_interrupted_send_job_items(job_id)
+                if interrupted:
+                    await self._update_job(job, {}, {"failed_count": interrupted})
+                logger.info(f"Resuming send job {job_id}: {job['sent_count'] + job['failed_count'] + interrupted}/{job['total']} done")
+            else:
+                await self._update_job(job, {"started_at": datetime.utcnow()})
+
+            campaign = await db_service.get_campaign_by_id(job["campaign_id"])
+            template = await db_service.get_template_by_id(job["template_id"]) if job.get("template_id") else None
+            if not campaign or not template:
+                await self._finish_job(job, "failed", "Campaign or template no longer exists")
+                return
+
+            while self.processing:
+                if job.get("lost"):
+                    raise SendJobLostError()
+                items = await db_service.get_pending_send_job_items(job_id, self.batch_size)
+                if not items:
+                    await self._finish_job(job, "completed")
+                    await self._update_campaign_status(campaign)
+                    return
+
+                retry_after = await self._process_batch(job, campaign, template, items)
+                if retry_after:
+                    await self._wait_for_send_slot(job, retry_after)
+
+            logger.info(f"Send job {job_id} paused by runner shutdown; it will resume on next start")
+
+        except SendJobLostError:
+            logger.warning(f"Send job {job_id} was taken over by another worker; leaving it to them")
+        except Exception as e:
+            logger.error(f"Error processing send job {job_id}: {str(e)}")
+            await self._finish_job(job, "failed", str(e))
+        finally:
+            heartbeat.cancel()
+            self.current_job_id = None
+
+    async def _heartbeat(self, job: Dict):
+        """Keep the job's heartbeat fresh while it runs, including during long batches"""
+        while True:
+            await asyncio.sleep(self.stale_after_seconds / 4)
+            try:
+                result = await db_service.update_send_job(job["id"], {"heartbeat_at": datetime.utcnow()},
+                                                          worker_id=self.worker_id)
+                if not result.matched_count:
+                    job["lost"] = True
+                    return
+            except Exception as e:
+                logger.error(f"Error heartbeating send job {job['id']}: {str(e)}")
+
+    async def _update_job(self, job: Dict, job_data: Dict, increments: Dict = None):
+        """Update a job this worker owns, raising SendJobLostError once it no longer does"""
+        result = await db_service.update_send_job(job["id"], job_data, increments, worker_id=self.worker_id)
+        if not result.matched_count:
+            job["lost"] = True
+            raise SendJobLostError()
+
+    async def _process_batch(self, job: Dict, campaign: Dict, template: Dict, items: List[Dict]) -> float:
+        """Personalize, send and record one batch of recipients; returns seconds to wait for more quota"""
+        campaign_id = campaign["id"]
+        if await db_service.claim_send_job_items([item["id"] for item in items], self.worker_id) < len(items):
+            raise SendJobLostError()
+
+        prospects = await db_service.get_prospects_by_ids([item["prospect_id"] for item in items])
+        prospects_by_id = {prospect["id"]: prospect for prospect in prospects}
+
+        failed_items: Dict[str, List[str]] = {}
+        recipients = []
+        for item in items:
+            prospect = prospects_by_id.get(item["prospect_id"])
+            if not prospect:
+                failed_items.setdefault("Prospect no longer exists", []).append(item["id"])
+                continue
+            recipients.append((item, prospect))
+
+        # Each template field is compiled once and reused for every recipient of the job
+        if not template.get("is_html_enabled", False):
+            template = {**template, "html_content": None}
+        rendered = template_renderer.render_batch(template, [prospect for _, prospect in recipients])
+        outgoing = [
+            (item, prospect, {"to_email": prospect["email"], **email, "content_type": "plain"})
+            for (item, prospect), email in zip(recipients, rendered)
+        ]
+
+        # Only send what the providers' quota allows now; the rest stays pending for the next batch
+        allocation = await provider_pool_service.allocate(
+            len(outgoing), [job["provider_id"]] if job.get("provider_id") else None
+        )
+        assignments = []
+        for provider_id, granted in allocation["allocations"]:
+            assignments.append((provider_id, outgoing[:granted]))
+            outgoing = outgoing[granted:]
+        deferred = outgoing
+        if deferred and allocation["retry_after"] is None:
+            failed_items.setdefault(NO_PROVIDER_ERROR, []).extend(item["id"] for item, _, _ in deferred)
+            deferred = []
+
+        await db_service.update_send_job_items_status(
+            [item["id"] for _, chunk in assignments for item, _, _ in chunk], "sending", worker_id=self.worker_id
+        )
+        # Each mailbox sends its share concurrently, so throughput grows with the number of providers
+        sent = await asyncio.gather(*[self._send_chunk(provider_id, chunk) for provider_id, chunk in assignments])
+
+        # Fail over: a share lost to a provider outage or connection errors goes back to pending;
+        # refused recipients and a merely high error rate are the recipients' failures, not the provider's
+        requeued = [entry for entry in sent if entry[3]]
+        if requeued and not job.get("provider_id") and await provider_pool_service.has_available_provider():
+            for provider_id, chunk, _, _ in requeued:
+                logger.warning(f"Send job {job['id']}: provider {provider_id} failed all {len(chunk)} sends; "
+                               f"requeueing them for other providers")
+                deferred += chunk
+            await db_service.update_send_job_items_status(
+                [item["id"] for _, chunk, _, _ in requeued for item, _, _ in chunk], "pending", worker_id=self.worker_id
+            )
+            sent = [entry for entry in sent if entry not in requeued]
+            allocation["retry_after"] = allocation["retry_after"] or 0.1
+
+        follow_up_rule = None
+        if campaign.get("follow_up_enabled", False) and campaign.get("follow_up_rule_id"):
+            follow_up_rule = await db_service.get_follow_up_rule_by_id(campaign["follow_up_rule_id"])
+
+        # A batch's records and prospect updates go out in one bulk write each
+        writes = BulkWriteBuffer(db_service)
+        sent_item_ids = []
+        for item, prospect, email, provider_id, (success, error) in (
+            (item, prospect, email, provider_id, result)
+            for provider_id, chunk, results, _ in sent
+            for (item, prospect, email), result in zip(chunk, results)
+        ):
+            now = datetime.utcnow()
+            writes.add_email_record({
+                "id": generate_id(),
+                "campaign_id": campaign_id,
+                "prospect_id": prospect["id"],
+                "recipient_email": prospect["email"],
+                "subject": email["subject"],
+                "content": email["content"],
+                "status": "sent" if success else "failed",
+                "sent_at": now,
+                "provider_id": provider_id,
+                "email_provider_id": provider_id,
+                "sent_by_us": True,
+                "is_follow_up": False,
+                "send_job_id": job["id"]
+            })
+
+            # Update prospect last contact and, if follow-up is enabled, set it up for follow-up;
+            # replies and follow-ups go out through the mailbox that sent this email
+            prospect_update = {"last_contact": now}
+            if success:
+                prospect_update["email_provider_id"] = provider_id
+            if campaign.get("follow_up_enabled", False) and success:
+                prospect_update.update({
+                    "campaign_id": campaign_id,
+                    "follow_up_status": "active",
+                    "follow_up_count": 0,
+                    "last_follow_up": None,
+                    "next_follow_up_at": compute_next_follow_up_at(campaign, follow_up_rule, 0, now, now)
+                })
+            writes.add_prospect_update(prospect["id"], prospect_update)
+
+            if success:
+                sent_item_ids.append(item["id"])
+            else:
+                failed_items.setdefault(error or "Failed to send email", []).append(item["id"])
+
+        # Records must be durable before the items are marked done; if they cannot be written the
+        # job fails with its items left "sending", which a resume counts as failed, never as sent
+        await self._flush_writes(job, writes)
+
+        # Counters follow the item updates that went through, even if the job was lost meanwhile
+        sent_count = failed_count = 0
+        if sent_item_ids:
+            result = await db_service.update_send_job_items_status(sent_item_ids, "sent", worker_id=self.worker_id)
+            sent_count = result.modified_count
+        for error, item_ids in failed_items.items():
+            result = await db_service.update_send_job_items_status(item_ids, "failed", error, worker_id=self.worker_id)
+            failed_count += result.modified_count
+        await db_service.update_send_job(job["id"], {}, {"sent_count": sent_count, "failed_count": failed_count})
+
+        logger.info(f"Send job {job['id']}: batch of {len(items)} done ({sent_count} sent, "
+                    f"{failed_count} failed, {len(deferred)} waiting for quota)")
+        return allocation["retry_after"] if deferred else 0.0
+
+    async def _flush_writes(self, job: Dict, writes: BulkWriteBuffer, attempts: int = 3):
+        """Flush buffered send results, retrying with backoff before giving up"""
+        for attempt in range(1, attempts + 1):
+            try:
+                await writes.flush()
+                return
+            except Exception as e:
+                logger.error(f"Error recording send results for job {job['id']} (attempt {attempt}/{attempts}): {str(e)}")
+                if attempt == attempts:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+
+    async def _send_chunk(self, provider_id: str, chunk: List) -> Tuple[str, List, List[Tuple[bool, Optional[str]]], bool]:
+        """Send one provider's share of a batch and feed its latency and errors back to the pool.
+
+        Returns the provider, the chunk, the results and whether the share failed because of the provider.
+        """
+        started = time.monotonic()
+        results = await email_provider_service.send_bulk_emails(
+            provider_id, [email for _, _, email in chunk], reserved=True
+        )
+        sent_count = len([result for result in results if result[0]])
+        provider_pool_service.record_result(
+            provider_id, sent_count, len(results) - sent_count, time.monotonic() - started
+        )
+        return provider_id, chunk, results, provider_pool_service.is_provider_failure(results)
+
+    async def _wait_for_send_slot(self, job: Dict, seconds: float):
+        """Sleep until the provider has quota again, waking early when the runner stops"""
+        logger.info(f"Send job {job['id']} waiting {seconds:.1f}s for provider quota")
+        deadline = time.monotonic() + seconds
+        while self.processing and not job.get("lost"):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, 1.0))
+
+    async def _finish_job(self, job: Dict, status: str, error: str = None):
+        """Mark a job as finished; a failed job leaves its campaign "failed" so it can be sent again"""
+        result = await db_service.update_send_job(job["id"], {
+            "status": status,
+            "error": error,
+            "completed_at": datetime.utcnow(),
+            "heartbeat_at": datetime.utcnow()
+        }, worker_id=self.worker_id)
+        if not result.matched_count:
+            return  # Another worker owns the job now
+        if status == "failed":
+            await db_service.release_campaign_send(job["campaign_id"], job["id"])
+        logger.info(f"Send job {job['id']} {status}" + (f": {error}" if error else ""))
+
+    async def _update_campaign_status(self, campaign: Dict):
+        """Keep the campaign active if follow-ups are enabled, otherwise mark it sent"""
+        campaign_status = "active" if campaign.get("follow_up_enabled", False) else "sent"
+        await db_service.update_campaign(campaign["id"], {"status": campaign_status})
+
+    def summarize_job(self, job: Dict) -> Dict:
+        """Build a progress report with counts and throughput for a job"""
+        total = job.get("total", 0)
+        sent = job.get("sent_count", 0)
+        failed = job.get("failed_count", 0)
+        processed = sent + failed
+        pending = max(total - processed, 0)
+
+        started_at = job.get("started_at")
+        finished_at = job.get("completed_at") or datetime.utcnow()
+        elapsed = (finished_at - started_at).total_seconds() if started_at else 0
+        per_minute = (processed / elapsed * 60) if elapsed > 0 else 0.0
+        eta_seconds = (pending / per_minute * 60) if per_minute > 0 and pending else None
+
+        return {
+            "job_id": job["id"],
+            "campaign_id": job["campaign_id"],
+            "provider_id": job.get("provider_id"),
+            "status": job["status"],
+            "total_prospects": total,
+            "total_sent": sent,
+            "total_failed": failed,
+            "total_pending": pending,
+            "progress_percent": round(processed / total * 100, 1) if total else (0.0 if job["status"] == "preparing" else 100.0),
+            "emails_per_minute": round(per_minute, 1),
+            "eta_seconds": round(eta_seconds) if eta_seconds is not None else None,
+            "created_at": job["created_at"].isoformat() if job.get("created_at") else None,
+            "started_at": started_at.isoformat() if started_at else None,
+            "completed_at": job["completed_at"].isoformat() if job.get("completed_at") else None,
+            "error": job.get("error")
+        }
+
+    def get_status(self) -> Dict:
+        """Get runner status"""
+        return {
+            "status": "running" if self.processing else "stopped",
+            "worker_id": self.worker_id,
+            "current_job_id": self.current_job_id
+        }
+
+# Create global campaign send job runner instance
+campaign_send_job_runner = CampaignSendJobRunner()
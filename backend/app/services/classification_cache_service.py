@@ -0,0 +1,118 @@
+"""
+Classification Cache Service - content-hash cache for intent classification and sentiment results
+"""
+import copy
+import hashlib
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from app.services.database import db_service, clean_document
+from app.utils.cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+class ClassificationCacheService:
+    """In-process LRU + TTL cache with an optional Mongo tier shared across workers"""
+
+    def __init__(self):
+        self.ttl = int(os.getenv("CLASSIFICATION_CACHE_TTL", 86400))
+        self.use_mongo = os.getenv("CLASSIFICATION_CACHE_MONGO", "false").lower() == "true"
+        self.memory = LRUTTLCache(
+            max_size=int(os.getenv("CLASSIFICATION_CACHE_SIZE", 5000)),
+            ttl=self.ttl
+        )
+        self.mongo_hits = 0
+        self.mongo_misses = 0
+        self._indexes_ready = False
+
+    async def _connect(self):
+        """Connect to Mongo and, once per process, create the tier's key index and expiry TTL index"""
+        await db_service.connect()
+        if not self._indexes_ready:
+            await db_service.db.classification_cache.create_index("key", unique=True)
+            await db_service.db.classification_cache.create_index("expires_at", expireAfterSeconds=0)
+            self._indexes_ready = True
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        """Lowercase and collapse whitespace so trivially different copies share an entry"""
+        return re.sub(r"\s+", " ", (text or "").lower()).strip()
+
+    def make_key(self, kind: str, subject: str, content: str, *versions: Any) -> str:
+        """Build a cache key from the normalized message and the versions its result depends on"""
+        digest = hashlib.sha256(
+            f"{self._normalize(subject)}\n{self._normalize(content)}".encode("utf-8")
+        ).hexdigest()
+        return ":".join([kind, digest] + [str(version) for version in versions])
+
+    async def get(self, key: str, shared: bool = True) -> Optional[Any]:
+        """Get a cached result, falling back to the Mongo tier on an in-process miss"""
+        value = self.memory.get(key)
+        if value is not None or not (shared and self.use_mongo):
+            return copy.deepcopy(value)  # Callers may modify what they get back
+
+        try:
+            await self._connect()
+            doc = await db_service.db.classification_cache.find_one({
+                "key": key,
+                "expires_at": {"$gt": datetime.utcnow()}
+            })
+        except Exception as e:
+            logger.error(f"Classification cache lookup failed: {str(e)}")
+            return None
+
+        if not doc:
+            self.mongo_misses += 1
+            return None
+
+        self.mongo_hits += 1
+        value = clean_document(doc["value"])
+        self.memory.set(key, copy.deepcopy(value))
+        return value
+
+    async def set(self, key: str, value: Any, shared: bool = True):
+        """Cache a result in-process and, when enabled, in the Mongo tier"""
+        self.memory.set(key, copy.deepcopy(value))
+        if not (shared and self.use_mongo):
+            return
+
+        try:
+            await self._connect()
+            await db_service.db.classification_cache.update_one(
+                {"key": key},
+                {"$set": {
+                    "key": key,
+                    "kind": key.split(":", 1)[0],
+                    "value": value,
+                    "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Classification cache write failed: {str(e)}")
+
+    async def clear(self) -> Dict:
+        """Drop every cached result"""
+        self.memory.clear()
+        deleted = 0
+        if self.use_mongo:
+            await db_service.connect()
+            result = await db_service.db.classification_cache.delete_many({})
+            deleted = result.deleted_count
+        return {"memory_cleared": True, "mongo_entries_deleted": deleted}
+
+    def get_stats(self) -> Dict:
+        """Get hit/miss counters for both tiers"""
+        return {
+            "memory": self.memory.get_stats(),
+            "mongo": {
+                "enabled": self.use_mongo,
+                "hits": self.mongo_hits,
+                "misses": self.mongo_misses
+            }
+        }
+
+# Create global classification cache instance
+classification_cache_service = ClassificationCacheService()
@@ -29,7 +29,7 @@ class ContextAwareAI:
                 return {"error": "Prospect not found"}
             
             # Get thread context
-            thread = await db_service.get_thread_by_prospect_id(prospect_id)
+            thread = await db_service.get_thread_by_prospect_id(prospect_id, message_limit=self.context_window)
             conversation_history = []
             
             if thread:
@@ -263,7 +263,7 @@ class ContextAwareAI:
     async def get_conversation_summary(self, prospect_id: str) -> Dict:
         """Get a summary of the conversation with a prospect"""
         try:
-            thread = await db_service.get_thread_by_prospect_id(prospect_id)
+            thread = await db_service.get_thread_by_prospect_id(prospect_id, message_limit=5)
             if not thread:
                 return {"summary": "No conversation history found"}
             
@@ -305,7 +305,7 @@ class ContextAwareAI:
             
             return {
                 "summary": summary,
-                "message_count": len(messages),
+                "message_count": thread.get("message_count", len(messages)),
                 "last_activity": thread.get("last_activity"),
                 "conversation_status": thread.get("status", "active")
             }
@@ -1,13 +1,84 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from datetime import datetime
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from datetime import datetime, timedelta
+import asyncio
+import copy
 import os
+import time
 from bson import ObjectId
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 from app.utils.helpers import generate_id
+from app.utils.cache import LRUTTLCache
 import logging
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+
+# Indexes behind the application's queries: (collection, keys, create_index options).
+# Applied idempotently by DatabaseService.ensure_indexes on startup; add an entry
+# next to any new query shape instead of creating indexes ad hoc.
+INDEX_REGISTRY: List[Tuple[str, List[Tuple[str, int]], Dict[str, Any]]] = [
+    # Lookups by application id
+    *[(collection, [("id", 1)], {}) for collection in [
+        "prospects", "prospect_lists", "campaigns", "templates", "intents", "email_providers",
+        "emails", "threads", "follow_up_rules", "system_prompts", "knowledge_base",
+        "response_verifications", "send_jobs", "ai_searches", "industry_tags"
+    ]],
+    # Prospects
+    ("prospects", [("email", 1)], {"unique": True}),  # Bulk imports rely on it to reject duplicates
+    ("prospects", [("list_ids", 1)], {}),
+    ("prospects", [("campaign_id", 1), ("follow_up_status", 1)], {}),
+    ("prospects", [("campaign_id", 1), ("next_follow_up_at", 1)], {"name": "campaign_next_follow_up"}),
+    ("prospects", [("responded_at", 1)], {}),
+    # Emails
+    ("emails", [("prospect_id", 1), ("type", 1), ("created_at", 1)], {}),
+    ("emails", [("prospect_id", 1), ("sent_by_us", 1), ("sent_at", 1)], {}),
+    ("emails", [("campaign_id", 1), ("is_follow_up", 1), ("status", 1)], {}),
+    ("emails", [("thread_id", 1), ("sent_by_us", 1), ("sent_at", 1)], {}),
+    ("emails", [("created_at", 1)], {}),
+    ("emails", [("sent_at", -1)], {}),
+    ("emails", [("prospect_id", 1), ("sent_at", -1)], {}),
+    # Campaigns and templates
+    ("campaigns", [("status", 1), ("follow_up_enabled", 1)], {}),
+    ("campaigns", [("email_provider_id", 1)], {}),
+    ("templates", [("type", 1)], {}),
+    # Knowledge base
+    ("knowledge_base", [("updated_at", 1)], {}),  # Index sync polls for recent changes
+    # Threads
+    ("threads", [("prospect_id", 1)], {}),
+    ("threads", [("last_activity", 1)], {}),
+    ("thread_messages", [("thread_id", 1), ("timestamp", 1)], {"name": "thread_timestamp"}),
+    ("thread_messages", [("thread_id", 1), ("message_id", 1)], {}),
+    # IMAP monitoring
+    ("imap_scan_logs", [("timestamp", -1)], {}),
+    ("imap_scan_logs", [("provider_id", 1), ("timestamp", -1)], {}),
+    ("imap_sync_state", [("provider_id", 1)], {}),
+    ("inbound_messages", [("message_id", 1)], {"unique": True}),  # Makes inbound claims atomic
+    # Campaign send jobs
+    ("send_jobs", [("campaign_id", 1), ("created_at", -1)], {}),
+    ("send_jobs", [("status", 1), ("created_at", 1)], {}),
+    ("send_job_items", [("job_id", 1), ("status", 1), ("sequence", 1)], {}),
+    # Caches
+    ("cache_versions", [("name", 1)], {"unique": True}),
+    ("classification_cache", [("key", 1)], {"unique": True}),
+    ("classification_cache", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    # Background workers
+    ("leases", [("name", 1)], {"unique": True}),
+    ("workers", [("worker_id", 1)], {"unique": True}),
+    ("worker_commands", [("created_at", 1)], {"expireAfterSeconds": 86400}),  # Commands expire after a day
+    # Conversations
+    ("conversation_sessions", [("session_id", 1)], {}),
+    ("enhanced_conversations", [("session_id", 1)], {}),
+]
+
+# Fields of knowledge articles the search index is built from
+KNOWLEDGE_INDEX_PROJECTION = {
+    "_id": 0, "id": 1, "title": 1, "content": 1, "keywords": 1, "tags": 1,
+    "category": 1, "is_active": 1, "updated_at": 1
+}
+
 def clean_document(doc: Union[Dict, List, Any]) -> Union[Dict, List, Any]:
     """
     Recursively clean MongoDB documents by converting ObjectId to string
@@ -39,6 +110,18 @@ class DatabaseService:
     def __init__(self):
         self.client = None
         self.db = None
+        self.cache_version_ttl = float(os.getenv("CACHE_VERSION_TTL", 5))
+        self._cache_versions: Dict[str, Tuple[int, float]] = {}  # name -> (version, fetched_at)
+        self.config_cache_enabled = os.getenv("CONFIG_CACHE_ENABLED", "true").lower() == "true"
+        self.config_cache = LRUTTLCache(
+            max_size=int(os.getenv("CONFIG_CACHE_SIZE", 1000)),
+            ttl=float(os.getenv("CONFIG_CACHE_TTL", 300))
+        )
+        self._change_stream_task = None
+        self.change_stream_active = False
+        self.indexes_ensured = False
+        # Thread reads attach only this many of the most recent messages
+        self.thread_message_limit = int(os.getenv("THREAD_MESSAGE_LIMIT", 50))
         
     async def connect(self):
         """Connect to the database"""
@@ -53,6 +136,167 @@ class DatabaseService:
             self.client = None
             self.db = None
     
+    # Index management
+    async def ensure_indexes(self, force: bool = False) -> Dict[str, Any]:
+        """Create every index in INDEX_REGISTRY that does not exist yet (once per process unless forced)"""
+        await self.connect()
+        if self.indexes_ensured and not force:
+            return {"created": [], "failed": []}
+        
+        created, failed = [], []
+        for collection, keys, options in INDEX_REGISTRY:
+            try:
+                name = await self.db[collection].create_index(keys, **options)
+                created.append(f"{collection}.{name}")
+            except OperationFailure as e:
+                # An existing index with the same keys but other options/name stays as it is
+                logger.warning(f"Could not create index {keys} on {collection}: {str(e)}")
+                failed.append({"collection": collection, "keys": keys, "error": str(e)})
+        
+        self.indexes_ensured = True
+        logger.info(f"Ensured {len(created)} indexes ({len(failed)} failed)")
+        return {"created": created, "failed": failed}
+    
+    async def get_index_report(self, slow_ms: int = 100, limit: int = 50) -> Dict[str, Any]:
+        """Index usage from $indexStats, registry indexes never used, and slow collection scans from the profiler"""
+        await self.connect()
+        registered = {}
+        for collection, keys, _ in INDEX_REGISTRY:
+            registered.setdefault(collection, []).append(dict(keys))
+        
+        usage = {}
+        unused = []
+        for collection in sorted(set(registered) | set(await self.db.list_collection_names())):
+            if collection.startswith("system."):
+                continue
+            try:
+                stats = await self.db[collection].aggregate([{"$indexStats": {}}]).to_list(length=None)
+            except OperationFailure as e:
+                logger.warning(f"$indexStats failed for {collection}: {str(e)}")
+                continue
+            usage[collection] = [
+                {
+                    "name": stat["name"],
+                    "key": dict(stat["key"]),
+                    "ops": stat["accesses"]["ops"],
+                    "since": stat["accesses"]["since"]
+                }
+                for stat in stats
+            ]
+            unused += [
+                f"{collection}.{index['name']}" for index in usage[collection]
+                if index["ops"] == 0 and index["key"] in registered.get(collection, [])
+            ]
+        
+        # Needs the profiler on, e.g. db.setProfilingLevel(1, {slowms: 100})
+        slow_queries = []
+        try:
+            async for entry in self.db["system.profile"].find(
+                {"planSummary": "COLLSCAN", "millis": {"$gte": slow_ms}},
+                {"ns": 1, "op": 1, "command": 1, "millis": 1, "docsExamined": 1, "ts": 1}
+            ).sort("ts", -1).limit(limit):
+                entry.pop("_id", None)
+                slow_queries.append(entry)
+        except OperationFailure as e:
+            logger.warning(f"Could not read the profiler collection: {str(e)}")
+        
+        return {
+            "indexes": usage,
+            "unused_registry_indexes": unused,
+            "missing_registry_indexes": [
+                f"{collection}.{keys}" for collection, keys, _ in INDEX_REGISTRY
+                if collection in usage and dict(keys) not in [index["key"] for index in usage[collection]]
+            ],
+            "slow_collection_scans": slow_queries
+        }
+    
+    # Cache version operations
+    async def get_cache_version(self, name: str) -> int:
+        """Get the change counter of an entity set; re-read from Mongo at most every few seconds"""
+        cached = self._cache_versions.get(name)
+        if cached and (self.change_stream_active or time.monotonic() - cached[1] < self.cache_version_ttl):
+            return cached[0]
+        
+        await self.connect()
+        doc = await self.db.cache_versions.find_one({"name": name})
+        version = doc["version"] if doc else 0
+        self._cache_versions[name] = (version, time.monotonic())
+        return version
+    
+    async def bump_cache_version(self, name: str) -> int:
+        """Invalidate everything cached for an entity set, in every worker"""
+        await self.connect()
+        doc = await self.db.cache_versions.find_one_and_update(
+            {"name": name},
+            {"$inc": {"version": 1}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._cache_versions[name] = (doc["version"], time.monotonic())
+        return doc["version"]
+    
+    async def _read_through(self, name: str, key: Any, loader):
+        """Serve a config read from the cache, loading it on a miss; entries of older versions are never hit again"""
+        if not self.config_cache_enabled:
+            return await loader()
+        
+        cache_key = (name, await self.get_cache_version(name), key)
+        value = self.config_cache.get(cache_key, _MISSING)
+        if value is _MISSING:
+            value = await loader()
+            self.config_cache.set(cache_key, value)
+        return copy.deepcopy(value)  # Callers may modify what they get back
+    
+    async def _write_through(self, name: str, key: Any, value: Any):
+        """Replace one cached entry after a write this process made without bumping the version"""
+        if self.config_cache_enabled:
+            self.config_cache.set((name, await self.get_cache_version(name), key), copy.deepcopy(value))
+    
+    async def start_config_change_stream(self):
+        """Follow cache version bumps from other workers as they happen instead of polling (needs a replica set)"""
+        if self._change_stream_task is None and os.getenv("CONFIG_CACHE_CHANGE_STREAMS", "false").lower() == "true":
+            self._change_stream_task = asyncio.create_task(self._watch_cache_versions())
+    
+    async def stop_config_change_stream(self):
+        """Stop following cache version bumps"""
+        task, self._change_stream_task = self._change_stream_task, None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.change_stream_active = False
+    
+    async def _watch_cache_versions(self):
+        """Apply cache version bumps pushed by the change stream"""
+        await self.connect()
+        try:
+            async with self.db.cache_versions.watch(full_document="updateLookup") as stream:
+                self.change_stream_active = True
+                self._cache_versions.clear()  # Versions read before the stream opened may already be stale
+                logger.info("Config cache following cache_versions change stream")
+                async for change in stream:
+                    doc = change.get("fullDocument")
+                    if doc:
+                        self._cache_versions[doc["name"]] = (doc["version"], time.monotonic())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Config cache change stream unavailable, polling versions instead: {str(e)}")
+        finally:
+            self.change_stream_active = False
+    
+    def get_config_cache_stats(self) -> Dict:
+        """Get config cache statistics"""
+        return {
+            "enabled": self.config_cache_enabled,
+            "change_stream_active": self.change_stream_active,
+            "version_ttl_seconds": self.cache_version_ttl,
+            "versions": {name: version for name, (version, _) in self._cache_versions.items()},
+            **self.config_cache.get_stats()
+        }
+    
     async def get_current_timestamp(self):
         """Get current timestamp"""
         return datetime.utcnow()
@@ -65,8 +309,11 @@ class DatabaseService:
         if existing_prospect:
             return None, f"Prospect with email '{prospect_data['email']}' already exists"
         
-        # Insert new prospect
-        result = await self.db.prospects.insert_one(prospect_data)
+        # Insert new prospect; the unique email index catches a concurrent insert of the same email
+        try:
+            result = await self.db.prospects.insert_one(prospect_data)
+        except DuplicateKeyError:
+            return None, f"Prospect with email '{prospect_data['email']}' already exists"
         # Clean the result object to remove ObjectId fields
         cleaned_result = {
             "acknowledged": result.acknowledged,
@@ -80,34 +327,50 @@ class DatabaseService:
         prospects = await self.db.prospects.find().skip(skip).limit(limit).to_list(length=limit)
         return clean_document(prospects)
         
+    async def has_unique_prospect_email_index(self) -> bool:
+        """Whether the unique index on prospects.email exists, without which duplicates are not rejected"""
+        await self.connect()
+        indexes = await self.db.prospects.index_information()
+        return any(index.get("unique") and index["key"] == [("email", 1)] for index in indexes.values())
+        
+    async def bulk_insert_prospects(self, prospects_data: List[dict]) -> Dict[str, Any]:
+        """Insert prospects in one unordered bulk write; the unique email index rejects duplicates.
+        
+        Returns the inserted count and the input positions of duplicates and other failed rows.
+        """
+        await self.connect()
+        if not prospects_data:
+            return {"inserted": 0, "duplicates": [], "errors": []}
+        
+        try:
+            result = await self.db.prospects.bulk_write(
+                [InsertOne(prospect_data) for prospect_data in prospects_data], ordered=False
+            )
+            return {"inserted": result.inserted_count, "duplicates": [], "errors": []}
+        except BulkWriteError as e:
+            duplicates, errors = [], []
+            for write_error in e.details.get("writeErrors", []):
+                if write_error["code"] == 11000:
+                    duplicates.append(write_error["index"])
+                else:
+                    errors.append({"index": write_error["index"], "error": write_error["errmsg"]})
+            return {"inserted": e.details.get("nInserted", 0), "duplicates": duplicates, "errors": errors}
+    
     async def upload_prospects(self, prospects_data: list):
         """Upload multiple prospects with email duplication handling"""
-        await self.connect()
-        successful_inserts = []
-        failed_inserts = []
-        
-        for prospect_data in prospects_data:
-            # Check for duplicate email
-            existing_prospect = await self.db.prospects.find_one({"email": prospect_data["email"]})
-            if existing_prospect:
-                failed_inserts.append({
-                    "email": prospect_data["email"],
-                    "error": "Email already exists"
-                })
-                continue
-                
-            try:
-                await self.db.prospects.insert_one(prospect_data)
-                successful_inserts.append(prospect_data["email"])
-            except Exception as e:
-                failed_inserts.append({
-                    "email": prospect_data["email"],
-                    "error": str(e)
-                })
+        result = await self.bulk_insert_prospects(prospects_data)
         
+        failed_positions = {index: "Email already exists" for index in result["duplicates"]}
+        failed_positions.update({error["index"]: error["error"] for error in result["errors"]})
         return {
-            "successful_inserts": successful_inserts,
-            "failed_inserts": failed_inserts
+            "successful_inserts": [
+                prospect_data["email"] for index, prospect_data in enumerate(prospects_data)
+                if index not in failed_positions
+            ],
+            "failed_inserts": [
+                {"email": prospects_data[index]["email"], "error": error}
+                for index, error in sorted(failed_positions.items())
+            ]
         }
         
     async def get_prospect_by_email(self, email: str):
@@ -133,14 +396,10 @@ class DatabaseService:
         return cleaned_lists
         
     async def get_list_by_id(self, list_id: str):
-        """Get a specific list by ID"""
+        """Get a specific list by ID with its prospect count; page its prospects with get_prospects_by_list_id"""
         list_item = await self.db.prospect_lists.find_one({"id": list_id})
         if list_item:
-            # Get prospects in this list
-            prospects = await self.db.prospects.find({"list_ids": list_id}).to_list(length=1000)
-            cleaned_prospects = [clean_document(prospect) for prospect in prospects]
-            list_item["prospects"] = cleaned_prospects
-            list_item["prospect_count"] = len(prospects)
+            list_item["prospect_count"] = await self.db.prospects.count_documents({"list_ids": list_id})
             return clean_document(list_item)
         return None
         
@@ -184,17 +443,29 @@ class DatabaseService:
     async def create_template(self, template_data: dict):
         """Create a new template"""
         result = await self.db.templates.insert_one(template_data)
+        await self.bump_cache_version("templates")
         return result
         
     async def get_templates(self):
         """Get all templates"""
-        templates = await self.db.templates.find().to_list(length=100)
-        return clean_document(templates)
+        async def load():
+            templates = await self.db.templates.find().to_list(length=100)
+            return clean_document(templates)
+        return await self._read_through("templates", "all", load)
+        
+    async def get_templates_by_type(self, template_type: str):
+        """Get templates of one type"""
+        async def load():
+            templates = await self.db.templates.find({"type": template_type}).to_list(length=100)
+            return clean_document(templates)
+        return await self._read_through("templates", ("type", template_type), load)
         
     async def get_template_by_id(self, template_id: str):
         """Get a specific template by ID"""
-        template = await self.db.templates.find_one({"id": template_id})
-        return clean_document(template) if template else None
+        async def load():
+            template = await self.db.templates.find_one({"id": template_id})
+            return clean_document(template) if template else None
+        return await self._read_through("templates", template_id, load)
         
     async def update_template(self, template_id: str, template_data: dict):
         """Update a template"""
@@ -202,11 +473,13 @@ class DatabaseService:
             {"id": template_id},
             {"$set": template_data}
         )
+        await self.bump_cache_version("templates")
         return result
         
     async def delete_template(self, template_id: str):
         """Delete a template"""
         result = await self.db.templates.delete_one({"id": template_id})
+        await self.bump_cache_version("templates")
         return result
     
     async def delete_prospect(self, prospect_id: str):
@@ -238,6 +511,25 @@ class DatabaseService:
         )
         return result
         
+    async def claim_campaign_for_send(self, campaign_id: str):
+        """Atomically move a campaign that was never sent to "sending"; returns it as it was, or None"""
+        await self.connect()
+        campaign = await self.db.campaigns.find_one_and_update(
+            {"id": campaign_id, "status": {"$nin": ["sent", "completed", "active", "sending"]}},
+            {"$set": {"status": "sending"}},
+            return_document=ReturnDocument.BEFORE
+        )
+        return clean_document(campaign) if campaign else None
+        
+    async def release_campaign_send(self, campaign_id: str, job_id: str):
+        """Make a campaign sendable again after its send job failed, unless a newer job took over"""
+        await self.connect()
+        result = await self.db.campaigns.update_one(
+            {"id": campaign_id, "status": "sending", "current_send_job_id": job_id},
+            {"$set": {"status": "failed"}}
+        )
+        return result.modified_count > 0
+        
     async def delete_campaign(self, campaign_id: str):
         """Delete a campaign"""
         result = await self.db.campaigns.delete_one({"id": campaign_id})
@@ -247,12 +539,15 @@ class DatabaseService:
     async def create_intent(self, intent_data: dict):
         """Create a new intent"""
         result = await self.db.intents.insert_one(intent_data)
+        await self.bump_cache_version("intents")
         return result
         
     async def get_intents(self):
         """Get all intents"""
-        intents = await self.db.intents.find().to_list(length=100)
-        return clean_document(intents)
+        async def load():
+            intents = await self.db.intents.find().to_list(length=100)
+            return clean_document(intents)
+        return await self._read_through("intents", "all", load)
         
     # Email operations
     async def create_email_record(self, email_data: dict):
@@ -265,6 +560,38 @@ class DatabaseService:
         }
         return cleaned_result
         
+    async def create_email_records(self, email_records: List[dict]):
+        """Create many email records in one round trip"""
+        await self.connect()
+        if not email_records:
+            return {"acknowledged": True, "inserted_count": 0}
+        
+        try:
+            result = await self.db.emails.insert_many(email_records, ordered=False)
+        except BulkWriteError as e:
+            # insert_many stamps each record with its _id, so on a retry the rows that made it
+            # the first time come back as duplicate keys instead of second copies
+            if any(write_error["code"] != 11000 for write_error in e.details.get("writeErrors", [])):
+                raise
+            return {"acknowledged": True, "inserted_count": e.details.get("nInserted", 0)}
+        return {
+            "acknowledged": result.acknowledged,
+            "inserted_count": len(result.inserted_ids)
+        }
+        
+    async def bulk_update_prospects(self, updates: List[Tuple[str, dict]]):
+        """Apply many (prospect_id, fields) updates in one round trip"""
+        await self.connect()
+        if not updates:
+            return {"matched_count": 0, "modified_count": 0}
+        
+        operations = [UpdateOne({"id": prospect_id}, {"$set": fields}) for prospect_id, fields in updates]
+        result = await self.db.prospects.bulk_write(operations, ordered=False)
+        return {
+            "matched_count": result.matched_count,
+            "modified_count": result.modified_count
+        }
+        
     async def update_prospect_last_contact(self, prospect_id: str, last_contact):
         """Update prospect's last contact time"""
         result = await self.db.prospects.update_one(
@@ -273,6 +600,61 @@ class DatabaseService:
         )
         return result
     
+    async def record_prospect_message_received(self, prospect_id: str, received_at: datetime):
+        """Update a prospect's contact times for a message they sent us"""
+        result = await self.db.prospects.update_one(
+            {"id": prospect_id},
+            {
+                "$set": {"last_contact": received_at},
+                "$max": {"last_received_at": received_at}
+            }
+        )
+        # Attribute the reply to the latest email we sent before it, which reply rates are computed from
+        await self.db.emails.find_one_and_update(
+            {
+                "prospect_id": prospect_id,
+                "status": {"$in": ["sent", "delivered"]},
+                "sent_at": {"$lte": received_at},
+                "replied_at": None
+            },
+            {"$set": {"replied_at": received_at}},
+            sort=[("sent_at", -1)]
+        )
+        return result
+    
+    async def backfill_last_received_at(self, prospect_ids: List[str]) -> Dict[str, Any]:
+        """Derive last_received_at from threads and email records for prospects that predate the field"""
+        await self.connect()
+        if not prospect_ids:
+            return {}
+        
+        last_received = {prospect_id: None for prospect_id in prospect_ids}
+        sources = [
+            (self.db.threads, [
+                {"$match": {"prospect_id": {"$in": prospect_ids}}},
+                {"$group": {"_id": "$prospect_id", "last_received_at": {"$max": "$last_received_at"}}}
+            ]),
+            (self.db.emails, [
+                {"$match": {"prospect_id": {"$in": prospect_ids}, "type": "received"}},
+                {"$group": {"_id": "$prospect_id", "last_received_at": {"$max": "$created_at"}}}
+            ])
+        ]
+        for collection, pipeline in sources:
+            async for row in collection.aggregate(pipeline):
+                current = last_received.get(row["_id"])
+                if isinstance(row["last_received_at"], datetime) and (current is None or row["last_received_at"] > current):
+                    last_received[row["_id"]] = row["last_received_at"]
+        
+        # $max keeps a newer time the email processor may have written meanwhile
+        operations = [
+            UpdateOne({"id": prospect_id}, {"$max": {"last_received_at": received_at}})
+            if received_at else
+            UpdateOne({"id": prospect_id, "last_received_at": {"$exists": False}}, {"$set": {"last_received_at": None}})
+            for prospect_id, received_at in last_received.items()
+        ]
+        await self.db.prospects.bulk_write(operations, ordered=False)
+        return last_received
+    
     async def update_prospect_status(self, prospect_id: str, status: str):
         """Update prospect status"""
         result = await self.db.prospects.update_one(
@@ -347,8 +729,10 @@ class DatabaseService:
     # Enhanced Intent operations
     async def get_intent_by_id(self, intent_id: str):
         """Get specific intent by ID"""
-        intent = await self.db.intents.find_one({"id": intent_id})
-        return clean_document(intent) if intent else None
+        async def load():
+            intent = await self.db.intents.find_one({"id": intent_id})
+            return clean_document(intent) if intent else None
+        return await self._read_through("intents", intent_id, load)
     
     async def update_intent(self, intent_id: str, intent_data: dict):
         """Update an intent"""
@@ -356,11 +740,13 @@ class DatabaseService:
             {"id": intent_id},
             {"$set": intent_data}
         )
+        await self.bump_cache_version("intents")
         return result
     
     async def delete_intent(self, intent_id: str):
         """Delete an intent"""
         result = await self.db.intents.delete_one({"id": intent_id})
+        await self.bump_cache_version("intents")
         return result
     
     # Enhanced Prospect operations
@@ -370,33 +756,150 @@ class DatabaseService:
         return clean_document(prospect) if prospect else None
     
     # Thread Context operations
+    # Messages live in thread_messages, one document each; the thread keeps summary fields
+    def _thread_message_summary(self, message_data: dict) -> dict:
+        """Thread summary update for one added message"""
+        timestamp = message_data["timestamp"] if isinstance(message_data.get("timestamp"), datetime) else datetime.utcnow()
+        increments = {"message_count": 1}
+        latest = {"last_message_at": timestamp}
+        if message_data.get("type") == "received":
+            increments["received_count"] = 1
+            latest["last_received_at"] = timestamp
+        elif message_data.get("type") == "sent":
+            increments["sent_count"] = 1
+            latest["last_sent_at"] = timestamp
+        if message_data.get("sent_by_us"):
+            increments["sent_by_us_count"] = 1
+        if message_data.get("ai_generated"):
+            increments["ai_generated_count"] = 1
+        return {"$inc": increments, "$max": latest}
+    
+    async def _insert_thread_messages(self, thread_id: str, messages: List[dict]):
+        """Store messages of a thread"""
+        if not messages:
+            return
+        documents = []
+        for message_data in messages:
+            document = {**message_data, "thread_id": thread_id}
+            document.setdefault("timestamp", datetime.utcnow())
+            documents.append(document)
+        await self.db.thread_messages.insert_many(documents)
+    
+    async def _attach_thread_messages(self, thread: dict, message_limit: int) -> dict:
+        """Add the thread's most recent messages under "messages", oldest first"""
+        thread["messages"] = await self.get_thread_messages(thread["id"], limit=message_limit)
+        thread.setdefault("message_count", len(thread["messages"]))
+        return thread
+    
     async def create_thread_context(self, thread_data: dict):
         """Create a new thread context"""
-        result = await self.db.threads.insert_one(thread_data)
+        await self.connect()
+        messages = thread_data.get("messages", [])
+        thread_document = {key: value for key, value in thread_data.items() if key != "messages"}
+        # last_message_at / last_received_at / last_sent_at are set by the first such message
+        thread_document.update({
+            "message_count": 0, "received_count": 0, "sent_count": 0,
+            "sent_by_us_count": 0, "ai_generated_count": 0
+        })
+        result = await self.db.threads.insert_one(thread_document)
+        for message_data in messages:
+            await self.add_message_to_thread(thread_data["id"], message_data)
         return result
     
     async def get_threads(self):
-        """Get all thread contexts"""
-        threads = await self.db.threads.find().to_list(length=1000)
+        """Get all thread contexts with their most recent messages"""
+        await self.connect()
+        threads = await self.db.threads.aggregate([
+            {"$sort": {"last_activity": -1}},
+            {"$limit": 1000},
+            {"$lookup": {
+                "from": "thread_messages",
+                "let": {"thread_id": "$id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$thread_id", "$$thread_id"]}}},
+                    {"$sort": {"timestamp": -1}},
+                    {"$limit": self.thread_message_limit},
+                    {"$project": {"raw_email": 0}}
+                ],
+                "as": "messages"
+            }}
+        ]).to_list(length=1000)
+        for thread in threads:
+            thread["messages"].reverse()
         return clean_document(threads)
     
-    async def get_thread_by_id(self, thread_id: str):
-        """Get specific thread by ID"""
+    async def get_thread_by_id(self, thread_id: str, message_limit: Optional[int] = None):
+        """Get specific thread by ID with its most recent messages (THREAD_MESSAGE_LIMIT by default)"""
+        await self.connect()
         thread = await self.db.threads.find_one({"id": thread_id})
-        return clean_document(thread) if thread else None
+        if not thread:
+            return None
+        return clean_document(await self._attach_thread_messages(thread, message_limit or self.thread_message_limit))
     
-    async def get_thread_by_prospect_id(self, prospect_id: str):
-        """Get thread by prospect ID"""
+    async def get_thread_by_prospect_id(self, prospect_id: str, message_limit: Optional[int] = None):
+        """Get thread by prospect ID with its most recent messages (THREAD_MESSAGE_LIMIT by default)"""
+        await self.connect()
         thread = await self.db.threads.find_one({"prospect_id": prospect_id})
-        return clean_document(thread) if thread else None
+        if not thread:
+            return None
+        return clean_document(await self._attach_thread_messages(thread, message_limit or self.thread_message_limit))
+    
+    async def get_thread_messages(self, thread_id: str, limit: Optional[int] = None, before: Optional[datetime] = None):
+        """Get a thread's messages oldest first: the last `limit` of them (all when None), optionally before a time"""
+        await self.connect()
+        if limit == 0:
+            return []
+        query = {"thread_id": thread_id}
+        if before is not None:
+            query["timestamp"] = {"$lt": before}
+        # Raw MIME (inline on messages stored before the blob store) is only read on demand
+        cursor = self.db.thread_messages.find(query, {"_id": 0, "thread_id": 0, "raw_email": 0}).sort("timestamp", -1)
+        if limit:
+            cursor = cursor.limit(limit)
+        messages = await cursor.to_list(length=None)
+        messages.reverse()
+        return messages
+    
+    async def get_thread_message(self, thread_id: str, message_id: str):
+        """Get one full thread message, including any inline raw_email"""
+        await self.connect()
+        message = await self.db.thread_messages.find_one({"thread_id": thread_id, "message_id": message_id})
+        return clean_document(message) if message else None
     
     async def add_message_to_thread(self, thread_id: str, message_data: dict):
         """Add message to thread"""
-        result = await self.db.threads.update_one(
-            {"id": thread_id},
-            {"$push": {"messages": message_data}}
+        await self.connect()
+        await self._insert_thread_messages(thread_id, [message_data])
+        summary = self._thread_message_summary(message_data)
+        if message_data.get("type") != "received":
+            return await self.db.threads.update_one({"id": thread_id}, summary)
+        
+        # Every writer of received messages keeps the prospect's last_received_at current,
+        # since the follow-up engine only reads that field to detect replies
+        thread = await self.db.threads.find_one_and_update(
+            {"id": thread_id}, summary, projection={"_id": 0, "prospect_id": 1}
         )
-        return result
+        if thread and thread.get("prospect_id"):
+            await self.db.prospects.update_one(
+                {"id": thread["prospect_id"]},
+                {"$max": {"last_received_at": summary["$max"]["last_received_at"]}}
+            )
+        return thread
+    
+    async def get_thread_message_totals(self) -> Dict[str, int]:
+        """Sum the message counters of all threads"""
+        await self.connect()
+        totals = {"total_threads": 0, "received_count": 0, "ai_generated_count": 0}
+        async for row in self.db.threads.aggregate([
+            {"$group": {
+                "_id": None,
+                "total_threads": {"$sum": 1},
+                "received_count": {"$sum": {"$ifNull": ["$received_count", 0]}},
+                "ai_generated_count": {"$sum": {"$ifNull": ["$ai_generated_count", 0]}}
+            }}
+        ]):
+            totals.update({key: row[key] for key in totals})
+        return totals
     
     async def update_thread_last_activity(self, thread_id: str, last_activity):
         """Update thread last activity"""
@@ -409,6 +912,7 @@ class DatabaseService:
     async def delete_thread(self, thread_id: str):
         """Delete thread"""
         result = await self.db.threads.delete_one({"id": thread_id})
+        await self.db.thread_messages.delete_many({"thread_id": thread_id})
         return result
     
     # Email Provider operations
@@ -429,6 +933,7 @@ class DatabaseService:
             raise ValueError(f"Email provider with name '{provider_data.get('name')}' already exists")
         
         result = await self.db.email_providers.insert_one(provider_data)
+        await self.bump_cache_version("email_providers")
         return result
     
     async def get_email_providers(self):
@@ -436,10 +941,21 @@ class DatabaseService:
         providers = await self.db.email_providers.find().to_list(length=100)
         return clean_document(providers)
     
+    async def get_active_email_providers(self, provider_ids: List[str] = None):
+        """Get active email providers, optionally only some of them, read fresh for their send quota"""
+        await self.connect()
+        query = {"is_active": True}
+        if provider_ids is not None:
+            query["id"] = {"$in": provider_ids}
+        providers = await self.db.email_providers.find(query).to_list(length=100)
+        return clean_document(providers)
+    
     async def get_email_provider_by_id(self, provider_id: str):
         """Get email provider by ID"""
-        provider = await self.db.email_providers.find_one({"id": provider_id})
-        return clean_document(provider) if provider else None
+        async def load():
+            provider = await self.db.email_providers.find_one({"id": provider_id})
+            return clean_document(provider) if provider else None
+        return await self._read_through("email_providers", provider_id, load)
     
     async def update_email_provider(self, provider_id: str, provider_data: dict):
         """Update an email provider"""
@@ -447,22 +963,27 @@ class DatabaseService:
             {"id": provider_id},
             {"$set": provider_data}
         )
+        await self.bump_cache_version("email_providers")
         return result
     
     async def delete_email_provider(self, provider_id: str):
         """Delete an email provider"""
         result = await self.db.email_providers.delete_one({"id": provider_id})
+        await self.bump_cache_version("email_providers")
         return result
     
     async def get_default_email_provider(self):
         """Get default email provider"""
         await self.connect()
-        provider = await self.db.email_providers.find_one({"is_default": True})
-        return clean_document(provider) if provider else None
+        async def load():
+            provider = await self.db.email_providers.find_one({"is_default": True})
+            return clean_document(provider) if provider else None
+        return await self._read_through("email_providers", "default", load)
     
     async def update_all_email_providers(self, update_data: dict):
         """Update all email providers"""
         result = await self.db.email_providers.update_many({}, {"$set": update_data})
+        await self.bump_cache_version("email_providers")
         return result
     
     async def get_campaigns_by_provider_id(self, provider_id: str):
@@ -470,18 +991,29 @@ class DatabaseService:
         campaigns = await self.db.campaigns.find({"email_provider_id": provider_id}).to_list(length=100)
         return campaigns
     
-    async def increment_provider_send_counts(self, provider_id: str):
-        """Increment send counts for rate limiting"""
-        result = await self.db.email_providers.update_one(
-            {"id": provider_id},
+    async def get_provider_rate_limit_state(self, provider_id: str):
+        """Read a provider's limits and rate limit state straight from Mongo, bypassing the cache"""
+        return await self.db.email_providers.find_one({"id": provider_id})
+
+    async def save_provider_rate_limit_state(self, provider_id: str, expected: dict, rate_limit: dict, counts: dict):
+        """Store new rate limit state unless another sender changed it or the limits since it was read.
+
+        Returns the updated provider, or None when the compare-and-set lost and the caller must re-read.
+        """
+        provider = await self.db.email_providers.find_one_and_update(
             {
-                "$inc": {
-                    "current_daily_count": 1,
-                    "current_hourly_count": 1
-                }
-            }
+                "id": provider_id,
+                "rate_limit.version": expected.get("version"),
+                "hourly_send_limit": expected.get("hourly_send_limit"),
+                "daily_send_limit": expected.get("daily_send_limit")
+            },
+            {"$set": {"rate_limit": rate_limit, **counts}},
+            return_document=ReturnDocument.AFTER
         )
-        return result
+        # Counters change on every send, so refresh this process's copy instead of invalidating every worker
+        if provider:
+            await self._write_through("email_providers", provider_id, clean_document(provider))
+        return provider
     
     async def unset_default_email_providers(self):
         """Unset all email providers as default"""
@@ -489,6 +1021,7 @@ class DatabaseService:
             {"is_default": True},
             {"$set": {"is_default": False}}
         )
+        await self.bump_cache_version("email_providers")
         return result
     
     # Knowledge Base operations
@@ -526,15 +1059,36 @@ class DatabaseService:
         result = await self.db.knowledge_base.delete_one({"id": article_id})
         return result
     
-    async def search_knowledge_articles(self, query: str, category: str = None, limit: int = 10):
-        """Search knowledge articles"""
-        search_query = {"$text": {"$search": query}} if query else {}
-        if category:
-            search_query["category"] = category
-        
-        articles = await self.db.knowledge_base.find(search_query).limit(limit).to_list(length=limit)
+    async def list_knowledge_articles(self, category: str = None, limit: int = 10):
+        """Browse knowledge articles, optionally of one category, without their stored embedding"""
+        query = {"category": category} if category else {}
+        articles = await self.db.knowledge_base.find(query, {"embedding_vector": 0}).limit(limit).to_list(length=limit)
+        return clean_document(articles)
+    
+    async def get_knowledge_articles_by_ids(self, article_ids: List[str]):
+        """Get knowledge articles by ID, without their stored embedding"""
+        articles = await self.db.knowledge_base.find(
+            {"id": {"$in": article_ids}}, {"embedding_vector": 0}
+        ).to_list(length=len(article_ids))
         return clean_document(articles)
     
+    async def iter_knowledge_articles(self, query: dict = None, batch_size: int = 500):
+        """Stream the fields the search index needs from knowledge articles in chunks"""
+        await self.connect()
+        cursor = self.db.knowledge_base.find(query or {}, KNOWLEDGE_INDEX_PROJECTION).batch_size(batch_size)
+        chunk = []
+        async for article in cursor:
+            chunk.append(clean_document(article))
+            if len(chunk) >= batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    async def count_knowledge_articles(self) -> int:
+        """Count all knowledge articles"""
+        return await self.db.knowledge_base.count_documents({})
+    
     async def get_knowledge_statistics(self):
         """Get knowledge base statistics"""
         total_articles = await self.db.knowledge_base.count_documents({})
@@ -562,6 +1116,7 @@ class DatabaseService:
     async def create_system_prompt(self, prompt_data: dict):
         """Create a new system prompt"""
         result = await self.db.system_prompts.insert_one(prompt_data)
+        await self.bump_cache_version("system_prompts")
         return result
     
     async def get_system_prompts(self):
@@ -571,8 +1126,10 @@ class DatabaseService:
     
     async def get_system_prompt_by_id(self, prompt_id: str):
         """Get system prompt by ID"""
-        prompt = await self.db.system_prompts.find_one({"id": prompt_id})
-        return clean_document(prompt) if prompt else None
+        async def load():
+            prompt = await self.db.system_prompts.find_one({"id": prompt_id})
+            return clean_document(prompt) if prompt else None
+        return await self._read_through("system_prompts", prompt_id, load)
     
     async def update_system_prompt(self, prompt_id: str, prompt_data: dict):
         """Update a system prompt"""
@@ -580,22 +1137,28 @@ class DatabaseService:
             {"id": prompt_id},
             {"$set": prompt_data}
         )
+        # Usage bookkeeping does not change what the prompt produces
+        if set(prompt_data) - {"usage_count", "last_used"}:
+            await self.bump_cache_version("system_prompts")
         return result
     
     async def delete_system_prompt(self, prompt_id: str):
         """Delete a system prompt"""
         result = await self.db.system_prompts.delete_one({"id": prompt_id})
+        await self.bump_cache_version("system_prompts")
         return result
     
     async def get_default_system_prompt(self, prompt_type: str = "general"):
         """Get default system prompt by type"""
         await self.connect()
-        prompt = await self.db.system_prompts.find_one({
-            "prompt_type": prompt_type,
-            "is_default": True,
-            "is_active": True
-        })
-        return clean_document(prompt) if prompt else None
+        async def load():
+            prompt = await self.db.system_prompts.find_one({
+                "prompt_type": prompt_type,
+                "is_default": True,
+                "is_active": True
+            })
+            return clean_document(prompt) if prompt else None
+        return await self._read_through("system_prompts", ("default", prompt_type), load)
     
     async def unset_default_system_prompts(self, prompt_type: str):
         """Unset all system prompts of a specific type as default"""
@@ -604,6 +1167,7 @@ class DatabaseService:
             {"prompt_type": prompt_type, "is_default": True},
             {"$set": {"is_default": False}}
         )
+        await self.bump_cache_version("system_prompts")
         return result
     
     async def update_knowledge_article_usage(self, article_id: str):
@@ -622,17 +1186,22 @@ class DatabaseService:
     async def create_follow_up_rule(self, rule_data: dict):
         """Create a new follow-up rule"""
         result = await self.db.follow_up_rules.insert_one(rule_data)
+        await self.bump_cache_version("follow_up_rules")
         return result
     
     async def get_follow_up_rules(self):
         """Get all follow-up rules"""
-        rules = await self.db.follow_up_rules.find().to_list(length=100)
-        return clean_document(rules)
+        async def load():
+            rules = await self.db.follow_up_rules.find().to_list(length=100)
+            return clean_document(rules)
+        return await self._read_through("follow_up_rules", "all", load)
     
     async def get_follow_up_rule_by_id(self, rule_id: str):
         """Get follow-up rule by ID"""
-        rule = await self.db.follow_up_rules.find_one({"id": rule_id})
-        return clean_document(rule) if rule else None
+        async def load():
+            rule = await self.db.follow_up_rules.find_one({"id": rule_id})
+            return clean_document(rule) if rule else None
+        return await self._read_through("follow_up_rules", rule_id, load)
     
     async def update_follow_up_rule(self, rule_id: str, rule_data: dict):
         """Update a follow-up rule"""
@@ -640,11 +1209,13 @@ class DatabaseService:
             {"id": rule_id},
             {"$set": rule_data}
         )
+        await self.bump_cache_version("follow_up_rules")
         return result
     
     async def delete_follow_up_rule(self, rule_id: str):
         """Delete a follow-up rule"""
         result = await self.db.follow_up_rules.delete_one({"id": rule_id})
+        await self.bump_cache_version("follow_up_rules")
         return result
     
     # Response Verification operations
@@ -692,12 +1263,211 @@ class DatabaseService:
             "rejected_verifications": rejected_verifications
         }
     
-    async def get_prospects_by_list_id(self, list_id: str):
-        """Get prospects by list ID"""
+    # Campaign send job operations
+    async def create_send_job(self, job_data: dict):
+        """Create a send job"""
+        await self.connect()
+        await self.db.send_jobs.insert_one(job_data)
+        return clean_document(job_data)
+
+    async def add_send_job_items(self, job_data: dict, prospect_ids: List[str], start_sequence: int = 0):
+        """Add one pending item per recipient to a send job"""
+        await self.connect()
+        items = [{
+            "id": generate_id(),
+            "job_id": job_data["id"],
+            "campaign_id": job_data["campaign_id"],
+            "prospect_id": prospect_id,
+            "sequence": start_sequence + offset,
+            "status": "pending",
+            "error": None,
+            "updated_at": datetime.utcnow()
+        } for offset, prospect_id in enumerate(prospect_ids)]
+
+        if items:
+            await self.db.send_job_items.insert_many(items, ordered=False)
+        return len(items)
+
+    async def get_send_job_by_id(self, job_id: str):
+        """Get send job by ID"""
+        await self.connect()
+        job = await self.db.send_jobs.find_one({"id": job_id})
+        return clean_document(job) if job else None
+
+    async def get_latest_send_job_for_campaign(self, campaign_id: str):
+        """Get the most recent send job for a campaign"""
+        await self.connect()
+        job = await self.db.send_jobs.find_one({"campaign_id": campaign_id}, sort=[("created_at", -1)])
+        return clean_document(job) if job else None
+
+    async def get_send_jobs(self, status: str = None, limit: int = 50):
+        """Get send jobs, newest first"""
+        await self.connect()
+        query = {"status": status} if status else {}
+        jobs = await self.db.send_jobs.find(query).sort("created_at", -1).limit(limit).to_list(length=limit)
+        return clean_document(jobs)
+
+    async def claim_next_send_job(self, worker_id: str, stale_before: datetime):
+        """Atomically claim a queued job, or a running job whose worker stopped heartbeating"""
+        await self.connect()
+        job = await self.db.send_jobs.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "queued"},
+                    {"status": "running", "heartbeat_at": {"$lt": stale_before}}
+                ]
+            },
+            {"$set": {"status": "running", "worker_id": worker_id, "heartbeat_at": datetime.utcnow()}},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        return clean_document(job) if job else None
+
+    async def fail_stale_preparing_send_jobs(self, stale_before: datetime):
+        """Fail jobs whose recipients stopped being added, e.g. because the server died mid-request"""
         await self.connect()
-        prospects = await self.db.prospects.find({"list_ids": list_id}).to_list(length=1000)
+        query = {"status": "preparing", "heartbeat_at": {"$lt": stale_before}}
+        jobs = await self.db.send_jobs.find(query, {"_id": 0, "id": 1, "campaign_id": 1}).to_list(length=None)
+        if jobs:
+            await self.db.send_jobs.update_many(
+                {**query, "id": {"$in": [job["id"] for job in jobs]}},
+                {"$set": {
+                    "status": "failed",
+                    "error": "Interrupted while adding recipients",
+                    "completed_at": datetime.utcnow()
+                }}
+            )
+        return jobs
+
+    async def update_send_job(self, job_id: str, job_data: dict, increments: dict = None, worker_id: str = None):
+        """Update a send job, optionally incrementing its counters; with worker_id only while that worker owns it"""
+        await self.connect()
+        update = {"$set": job_data} if job_data else {}
+        if increments:
+            update["$inc"] = increments
+        query = {"id": job_id}
+        if worker_id:
+            query["worker_id"] = worker_id
+        result = await self.db.send_jobs.update_one(query, update)
+        return result
+
+    async def get_pending_send_job_items(self, job_id: str, limit: int = 100):
+        """Get the next unsent items of a job in recipient order"""
+        await self.connect()
+        items = await self.db.send_job_items.find({
+            "job_id": job_id,
+            "status": "pending"
+        }).sort("sequence", 1).limit(limit).to_list(length=limit)
+        return clean_document(items)
+
+    async def claim_send_job_items(self, item_ids: List[str], worker_id: str) -> int:
+        """Stamp pending job items with the worker about to send them; returns how many it got"""
+        await self.connect()
+        result = await self.db.send_job_items.update_many(
+            {"id": {"$in": item_ids}, "status": "pending"},
+            {"$set": {"worker_id": worker_id, "updated_at": datetime.utcnow()}}
+        )
+        return result.matched_count
+
+    async def update_send_job_items_status(self, item_ids: List[str], status: str, error: str = None,
+                                           worker_id: str = None):
+        """Set the delivery status of several job items; with worker_id only the ones that worker claimed"""
+        await self.connect()
+        query = {"id": {"$in": item_ids}}
+        if worker_id:
+            query["worker_id"] = worker_id
+        result = await self.db.send_job_items.update_many(
+            query,
+            {"$set": {"status": status, "error": error, "updated_at": datetime.utcnow()}}
+        )
+        return result
+
+    async def fail_interrupted_send_job_items(self, job_id: str):
+        """Fail items left in "sending" by a crashed worker and return how many there were"""
+        await self.connect()
+        result = await self.db.send_job_items.update_many(
+            {"job_id": job_id, "status": "sending"},
+            {"$set": {
+                "status": "failed",
+                "error": "Interrupted during send; delivery status unknown",
+                "updated_at": datetime.utcnow()
+            }}
+        )
+        return result.modified_count
+
+    async def get_prospects_by_ids(self, prospect_ids: List[str]):
+        """Get prospects by a list of IDs"""
+        await self.connect()
+        prospects = await self.db.prospects.find({"id": {"$in": prospect_ids}}).to_list(length=len(prospect_ids))
         return clean_document(prospects)
 
+    async def get_prospects_by_list_id(self, list_id: str, skip: int = 0, limit: int = 100):
+        """Get prospects by list ID with pagination; stream whole lists with iter_prospects_for_lists"""
+        await self.connect()
+        cursor = self.db.prospects.find({"list_ids": list_id}).sort("_id", 1).skip(skip).limit(limit)
+        prospects = await cursor.to_list(length=limit)
+        return clean_document(prospects)
+
+    def _unique_list_prospects_pipeline(self, list_ids: List[str] = None, projection: dict = None) -> List[dict]:
+        """Aggregation stages matching prospects of the given lists (all prospects if none), one per email.
+
+        The oldest prospect of each email wins; $group only keeps input order, so it is sorted first.
+        """
+        pipeline = [
+            {"$match": {"list_ids": {"$in": list_ids}} if list_ids else {}},
+            {"$sort": {"created_at": 1, "_id": 1}}
+        ]
+        if projection:
+            pipeline.append({"$project": {**projection, "email": 1, "created_at": 1}})
+        pipeline += [
+            {"$group": {"_id": "$email", "prospect": {"$first": "$$ROOT"}}},
+            {"$replaceRoot": {"newRoot": "$prospect"}}
+        ]
+        return pipeline
+
+    async def iter_prospects_for_lists(self, list_ids: List[str] = None, batch_size: int = 500,
+                                       limit: int = None, projection: dict = None):
+        """Stream prospects of the given lists in chunks, deduplicated by email on the server"""
+        await self.connect()
+        pipeline = self._unique_list_prospects_pipeline(list_ids, projection)
+        if limit:
+            # $group output has no defined order, so the same recipients are picked every time
+            pipeline += [{"$sort": {"created_at": 1, "_id": 1}}, {"$limit": limit}]
+
+        cursor = self.db.prospects.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+        chunk = []
+        async for prospect in cursor:
+            chunk.append(clean_document(prospect))
+            if len(chunk) >= batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def count_prospects_for_lists(self, list_ids: List[str] = None) -> int:
+        """Count unique-by-email prospects of the given lists"""
+        await self.connect()
+        pipeline = [
+            {"$match": {"list_ids": {"$in": list_ids}} if list_ids else {}},
+            {"$group": {"_id": "$email"}},
+            {"$count": "total"}
+        ]
+        result = await self.db.prospects.aggregate(pipeline, allowDiskUse=True).to_list(length=1)
+        return result[0]["total"] if result else 0
+
+    async def iter_prospects(self, query: dict, batch_size: int = 500):
+        """Stream prospects matching a query in chunks"""
+        await self.connect()
+        cursor = self.db.prospects.find(query).batch_size(batch_size)
+        chunk = []
+        async for prospect in cursor:
+            chunk.append(clean_document(prospect))
+            if len(chunk) >= batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
     # Enhanced Follow-up Tracking Methods
     async def mark_prospect_as_responded(self, prospect_id: str, response_type: str = "manual"):
         """Mark a prospect as having responded and stop follow-ups"""
@@ -709,11 +1479,83 @@ class DatabaseService:
                     "responded_at": datetime.utcnow(),
                     "response_type": response_type,
                     "follow_up_status": "stopped",
+                    "next_follow_up_at": None,
                     "updated_at": datetime.utcnow()
                 }
             }
         )
         return result.modified_count > 0
+    
+    # Follow-up schedule operations
+    def _follow_up_schedule_query(self, campaign_id: str) -> dict:
+        """Prospects of a campaign that still take part in follow-ups"""
+        return {
+            "campaign_id": campaign_id,
+            "follow_up_status": {"$nin": ["stopped", "completed"]},
+            "status": {"$ne": "unsubscribed"},
+            "$or": [
+                {"responded_at": {"$exists": False}},
+                {"responded_at": None}
+            ]
+        }
+    
+    async def schedule_follow_up(self, prospect_id: str, next_follow_up_at: datetime = None):
+        """Set when the prospect's next follow-up is due; None takes it off the schedule"""
+        await self.connect()
+        result = await self.db.prospects.update_one(
+            {"id": prospect_id},
+            {"$set": {"next_follow_up_at": next_follow_up_at}}
+        )
+        return result.modified_count > 0
+    
+    async def claim_due_follow_ups(self, campaign_id: str, due_before: datetime, worker_id: str,
+                                   claim_seconds: int, limit: int = 50):
+        """Atomically take up to limit due prospects by pushing their due time past the claim.
+        
+        Another worker's query no longer matches a claimed prospect; if this worker dies
+        before rescheduling it, the prospect becomes due again when the claim runs out.
+        """
+        await self.connect()
+        query = self._follow_up_schedule_query(campaign_id)
+        query["next_follow_up_at"] = {"$lte": due_before}
+        candidates = await self.db.prospects.find(query, {"id": 1}).sort("next_follow_up_at", 1).limit(limit).to_list(length=limit)
+        if not candidates:
+            return None  # Nothing due
+        
+        candidate_ids = [candidate["id"] for candidate in candidates]
+        claim_token = generate_id()
+        await self.db.prospects.update_many(
+            {**query, "id": {"$in": candidate_ids}},
+            {"$set": {
+                "next_follow_up_at": datetime.utcnow() + timedelta(seconds=claim_seconds),
+                "follow_up_claim": {"worker_id": worker_id, "token": claim_token}
+            }}
+        )
+        # Candidates another worker updated first did not match the filter above
+        claimed = await self.db.prospects.find({
+            "id": {"$in": candidate_ids},
+            "follow_up_claim.token": claim_token
+        }).to_list(length=limit)
+        return clean_document(claimed)
+    
+    async def get_next_follow_up_due(self, campaign_id: str):
+        """Get the earliest scheduled follow-up time of a campaign"""
+        await self.connect()
+        query = self._follow_up_schedule_query(campaign_id)
+        query["next_follow_up_at"] = {"$ne": None}
+        prospect = await self.db.prospects.find_one(
+            query,
+            {"next_follow_up_at": 1},
+            sort=[("next_follow_up_at", 1)]
+        )
+        return prospect["next_follow_up_at"] if prospect else None
+    
+    async def iter_unscheduled_follow_ups(self, campaign_id: str, batch_size: int = 500):
+        """Stream prospects of a campaign that were put on follow-up without a due time"""
+        query = self._follow_up_schedule_query(campaign_id)
+        query["next_follow_up_at"] = None  # Also matches prospects that predate the field
+        async for prospects in self.iter_prospects(query, batch_size):
+            yield prospects
 
     async def get_prospects_needing_follow_up(self, campaign_id: str = None):
         """Get prospects that need follow-up emails"""
@@ -769,13 +1611,13 @@ class DatabaseService:
             return False
         
         # Check if there are any received messages after our email was sent
-        messages = thread.get("messages", [])
-        for message in messages:
-            if (message.get("type") == "received" and 
-                message.get("timestamp") > our_email_sent_at and
-                not message.get("is_auto_reply", False)):
-                return True
-        return False
+        response = await self.db.thread_messages.find_one({
+            "thread_id": thread["id"],
+            "type": "received",
+            "timestamp": {"$gt": our_email_sent_at},
+            "is_auto_reply": {"$ne": True}
+        })
+        return response is not None
 
     async def update_thread_with_sent_flag(self, thread_id: str, message_data: dict):
         """Add message to thread with sent flag"""
@@ -783,13 +1625,10 @@ class DatabaseService:
         message_data["sent_by_us"] = True
         message_data["message_id"] = f"msg_{generate_id()}"
         
-        result = await self.db.threads.update_one(
-            {"id": thread_id},
-            {
-                "$push": {"messages": message_data},
-                "$set": {"last_activity": datetime.utcnow()}
-            }
-        )
+        await self._insert_thread_messages(thread_id, [message_data])
+        summary = self._thread_message_summary(message_data)
+        summary["$set"] = {"last_activity": datetime.utcnow()}
+        result = await self.db.threads.update_one({"id": thread_id}, summary)
         return result.modified_count > 0
 
     async def get_active_follow_up_campaigns(self):
@@ -843,6 +1682,185 @@ class DatabaseService:
         result = await self.db.imap_scan_logs.insert_one(scan_log)
         return result.acknowledged
 
+    async def get_imap_sync_state(self, provider_id: str):
+        """Get the UID high-water mark of a provider's inbox"""
+        await self.connect()
+        state = await self.db.imap_sync_state.find_one({"provider_id": provider_id})
+        return clean_document(state) if state else None
+
+    async def save_imap_sync_state(self, provider_id: str, uid_validity: int, last_uid: int):
+        """Store the UID high-water mark of a provider's inbox"""
+        await self.connect()
+        result = await self.db.imap_sync_state.update_one(
+            {"provider_id": provider_id},
+            {"$set": {
+                "uid_validity": uid_validity,
+                "last_uid": last_uid,
+                "updated_at": datetime.utcnow()
+            }},
+            upsert=True
+        )
+        return result.acknowledged
+
+    async def claim_inbound_message(self, message_id: str, message_data: dict,
+                                    worker_id: str = None, claim_seconds: int = 300) -> bool:
+        """Record an inbound message by Message-ID; returns False if it was processed or another worker is on it"""
+        await self.connect()
+        now = datetime.utcnow()
+        claim = {"claimed_by": worker_id, "claimed_until": now + timedelta(seconds=claim_seconds)}
+        try:
+            existing = await self.db.inbound_messages.find_one_and_update(
+                {"message_id": message_id},
+                {"$setOnInsert": {
+                    **message_data,
+                    **claim,
+                    "message_id": message_id,
+                    "status": "processing",
+                    "created_at": now
+                }},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            return False  # Another worker inserted it first
+        
+        if existing is None:
+            return True
+        if existing.get("status") == "processed":
+            return False
+        
+        # A message left in "processing" is taken over once its claim runs out (its worker crashed)
+        taken = await self.db.inbound_messages.find_one_and_update(
+            {
+                "message_id": message_id,
+                "status": {"$ne": "processed"},
+                "$or": [
+                    {"claimed_by": worker_id},
+                    {"claimed_until": {"$lt": now}},
+                    {"claimed_until": {"$exists": False}}
+                ]
+            },
+            {"$set": claim}
+        )
+        return taken is not None
+
+    async def complete_inbound_message(self, message_id: str, result_data: dict = None):
+        """Mark an inbound message as processed"""
+        await self.connect()
+        result = await self.db.inbound_messages.update_one(
+            {"message_id": message_id},
+            {"$set": {**(result_data or {}), "status": "processed", "processed_at": datetime.utcnow()}}
+        )
+        return result.modified_count > 0
+
+    async def get_inbound_steps(self, message_id: str) -> set:
+        """Get the processing steps already finished for an inbound message"""
+        await self.connect()
+        message = await self.db.inbound_messages.find_one({"message_id": message_id}, {"completed_steps": 1})
+        return set((message or {}).get("completed_steps", []))
+
+    async def record_inbound_step(self, message_id: str, step: str):
+        """Record a finished processing step so a retry does not repeat it"""
+        await self.connect()
+        result = await self.db.inbound_messages.update_one(
+            {"message_id": message_id},
+            {"$addToSet": {"completed_steps": step}}
+        )
+        return result.modified_count > 0
+
+    async def fail_inbound_message(self, message_id: str, error: str, attempts: int):
+        """Mark an inbound message as given up on after repeated processing errors"""
+        await self.connect()
+        result = await self.db.inbound_messages.update_one(
+            {"message_id": message_id},
+            {"$set": {"status": "failed", "error": error, "attempts": attempts, "failed_at": datetime.utcnow()}}
+        )
+        return result.modified_count > 0
+
+    # Lease operations
+    async def acquire_lease(self, name: str, owner: str, ttl_seconds: int):
+        """Take or renew a named lease; returns its expiry, or None while another owner holds it"""
+        await self.connect()
+        now = datetime.utcnow()
+        try:
+            lease = await self.db.leases.find_one_and_update(
+                {"name": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl_seconds), "heartbeat_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return None  # The unique name index rejected the upsert: held by a live owner
+        return lease["expires_at"]
+    
+    async def release_lease(self, name: str, owner: str):
+        """Release a lease held by owner"""
+        await self.connect()
+        result = await self.db.leases.delete_one({"name": name, "owner": owner})
+        return result.deleted_count > 0
+    
+    async def get_leases(self):
+        """Get all leases"""
+        await self.connect()
+        leases = await self.db.leases.find().to_list(length=1000)
+        return clean_document(leases)
+    
+    # Background worker operations
+    async def create_worker_command(self, command_data: dict):
+        """Queue a command for every running background worker"""
+        await self.connect()
+        command = {
+            **command_data,
+            "id": generate_id(),
+            "acked_by": [],
+            "created_at": datetime.utcnow()
+        }
+        await self.db.worker_commands.insert_one(command)
+        return clean_document(command)
+    
+    async def get_unacked_worker_commands(self, worker_id: str, since: datetime):
+        """Get commands issued since a worker started that it has not applied yet, oldest first"""
+        await self.connect()
+        commands = await self.db.worker_commands.find({
+            "created_at": {"$gte": since},
+            "acked_by": {"$ne": worker_id}
+        }).sort("created_at", 1).to_list(length=100)
+        return clean_document(commands)
+    
+    async def ack_worker_command(self, command_id: str, worker_id: str, command_result: dict = None):
+        """Record that a worker applied a command"""
+        await self.connect()
+        result = await self.db.worker_commands.update_one(
+            {"id": command_id},
+            {
+                "$addToSet": {"acked_by": worker_id},
+                "$set": {f"results.{worker_id.replace('.', '_')}": command_result or {}}  # Field names cannot contain dots
+            }
+        )
+        return result.modified_count > 0
+    
+    async def save_worker_heartbeat(self, worker_id: str, worker_data: dict):
+        """Upsert a worker's status document"""
+        await self.connect()
+        result = await self.db.workers.update_one(
+            {"worker_id": worker_id},
+            {"$set": {**worker_data, "worker_id": worker_id, "heartbeat_at": datetime.utcnow()}},
+            upsert=True
+        )
+        return result
+    
+    async def get_workers(self):
+        """Get the status documents of all background workers"""
+        await self.connect()
+        workers = await self.db.workers.find().sort("started_at", 1).to_list(length=100)
+        return clean_document(workers)
+    
+    async def delete_worker(self, worker_id: str):
+        """Remove a worker's status document on clean shutdown"""
+        await self.connect()
+        result = await self.db.workers.delete_one({"worker_id": worker_id})
+        return result.deleted_count > 0
+    
     async def cleanup_old_scan_logs(self, days_to_keep: int = 7):
         """Clean up old IMAP scan logs"""
         await self.connect()
@@ -942,5 +1960,48 @@ class DatabaseService:
             logger.error(f"Error getting last IMAP scan for provider {provider_id}: {str(e)}")
             return None
 
+class BulkWriteBuffer:
+    """Collects email records and prospect updates and writes them in bulk, one round trip per collection"""
+    
+    def __init__(self, database: DatabaseService):
+        self.database = database
+        self.email_records: List[dict] = []
+        self.prospect_updates: Dict[str, dict] = {}
+        self.flush_count = 0
+    
+    @property
+    def pending(self) -> int:
+        """Number of buffered write operations"""
+        return len(self.email_records) + len(self.prospect_updates)
+    
+    def add_email_record(self, email_record: dict):
+        """Buffer an email record insert"""
+        self.email_records.append(email_record)
+    
+    def add_prospect_update(self, prospect_id: str, fields: dict):
+        """Buffer a prospect update; updates to the same prospect are merged"""
+        self.prospect_updates.setdefault(prospect_id, {}).update(fields)
+    
+    async def flush(self):
+        """Write all buffered operations; on failure whatever was not written stays buffered"""
+        email_records, self.email_records = self.email_records, []
+        prospect_updates, self.prospect_updates = self.prospect_updates, {}
+        if not email_records and not prospect_updates:
+            return
+        
+        try:
+            if email_records:
+                await self.database.create_email_records(email_records)
+                email_records = []
+            if prospect_updates:
+                await self.database.bulk_update_prospects(list(prospect_updates.items()))
+        except Exception:
+            self.email_records = email_records + self.email_records
+            for prospect_id, fields in self.prospect_updates.items():
+                prospect_updates.setdefault(prospect_id, {}).update(fields)  # Newer fields win
+            self.prospect_updates = prospect_updates
+            raise
+        self.flush_count += 1
+
 # Create global database service instance
 db_service = DatabaseService()
\ No newline at end of file
@@ -6,6 +6,7 @@ from datetime import datetime
 import logging
 from typing import Dict, List, Optional
 import os
+from app.services.blob_store_service import blob_store_service
 from app.services.database import db_service
 from app.services.enhanced_database import enhanced_db_service
 from app.services.groq_service_fixed import groq_service  # Use fixed version
@@ -317,15 +318,15 @@ class EmailProcessor:
                 "subject": subject,
                 "content": content,
                 "timestamp": datetime.utcnow(),
-                "raw_email": str(email_message),
                 "is_response_to_our_email": is_response_to_our_email,
-                "message_id": f"msg_{generate_id()}"
+                "message_id": f"msg_{generate_id()}",
+                **await blob_store_service.raw_email_fields(str(email_message).encode("utf-8", errors="replace"))
             }
             
             await self._add_message_to_thread(thread_context["id"], message_data)
             
-            # Update prospect last contact time
-            await db_service.update_prospect_last_contact(prospect["id"], datetime.utcnow())
+            # Update prospect last contact and last received times
+            await db_service.record_prospect_message_received(prospect["id"], message_data["timestamp"])
             
             # Enhanced follow-up stopping logic
             if is_response_to_our_email:
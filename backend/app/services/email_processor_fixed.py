@@ -1,14 +1,17 @@
 import asyncio
-import imaplib
 import email
+from collections import deque
 from email.header import decode_header
 from datetime import datetime
 import logging
 from typing import Dict, List, Optional
 import os
+from app.services.blob_store_service import blob_store_service
 from app.services.database import db_service
 from app.services.enhanced_database import enhanced_db_service
 from app.services.groq_service_fixed import groq_service  # Use fixed version
+from app.services.imap_client_service import imap_client_service
+from app.services.lease_service import lease_service
 from app.utils.helpers import send_email, generate_id, personalize_template
 
 # Configure logging
@@ -27,6 +30,19 @@ class EmailProcessorFixed:
         self.monitored_providers = {}  # Dictionary to store provider configurations
         self.provider_threads = {}  # Dictionary to store monitoring tasks per provider
         
+        # Inbound pipeline: IMAP scans enqueue parsed emails, workers classify and auto-respond
+        self.inbound_queue_size = int(os.getenv("INBOUND_QUEUE_SIZE", 200))
+        self.inbound_worker_count = int(os.getenv("INBOUND_WORKERS", 4))
+        self.inbound_queue: Optional[asyncio.Queue] = None
+        self.inbound_workers: List[asyncio.Task] = []
+        self.inflight_message_ids = set()
+        self.pending_uids: Dict[str, deque] = {}  # provider_id -> UID-ordered entries awaiting processing
+        self.sync_locks: Dict[str, asyncio.Lock] = {}
+        self.inbound_processed_count = 0
+        self.inbound_claim_seconds = int(os.getenv("INBOUND_CLAIM_SECONDS", 300))
+        self.inbound_max_attempts = int(os.getenv("INBOUND_MAX_ATTEMPTS", 3))
+        self.inbound_retry_delay = float(os.getenv("INBOUND_RETRY_DELAY_SECONDS", 30))
+        
     async def start_monitoring(self):
         """Start IMAP email monitoring for all enabled providers"""
         if self.processing:
@@ -39,7 +55,8 @@ class EmailProcessorFixed:
             # Load all enabled email providers from database
             await self._load_enabled_providers()
             
-            # Start monitoring in background
+            # Start the inbound workers, then monitoring in background
+            self._start_inbound_workers()
             asyncio.create_task(self._monitor_all_providers())
             return {"status": "started", "message": "FIXED Email monitoring started", "providers_count": len(self.monitored_providers)}
         except Exception as e:
@@ -126,6 +143,8 @@ class EmailProcessorFixed:
             if provider_id in self.monitored_providers:
                 provider_name = self.monitored_providers[provider_id]["name"]
                 del self.monitored_providers[provider_id]
+                await imap_client_service.close_provider(provider_id)
+                await lease_service.release(f"imap:{provider_id}")
                 logger.info(f"Removed provider {provider_name} from monitoring")
                 
         except Exception as e:
@@ -162,31 +181,37 @@ class EmailProcessorFixed:
                 await asyncio.sleep(60)  # Wait before retrying
     
     async def _monitor_single_provider(self, provider_id: str, provider_config: dict):
-        """Monitor a single email provider"""
+        """Monitor a single email provider over a persistent IMAP session"""
         consecutive_errors = 0
         max_errors = 5
+        poll_interval = None
         
         logger.info(f"Starting monitoring for provider: {provider_config['name']}")
         
+        lease_name = f"imap:{provider_id}"
+        
         while self.processing and provider_id in self.monitored_providers:
             try:
+                # Only the worker holding the mailbox lease keeps an IMAP session open and scans it
+                if not await lease_service.acquire(lease_name, on_lost=lambda: imap_client_service.close_provider(provider_id)):
+                    await imap_client_service.close_provider(provider_id)
+                    await asyncio.sleep(lease_service.heartbeat_interval)
+                    continue
+                
                 scan_result = await self._check_provider_for_new_emails(provider_config)
+                if scan_result.get("connection_error"):
+                    raise Exception(scan_result["connection_error"])
                 consecutive_errors = 0  # Reset error count on successful scan
                 
                 # Update last scan time
                 self.monitored_providers[provider_id]["last_scan"] = datetime.utcnow()
                 
-                # If we found emails, scan again sooner to catch any others
-                if scan_result.get("new_emails_found", 0) > 0:
-                    logger.info(f"Provider {provider_config['name']}: Found new emails, scanning again in 10 seconds...")
-                    await asyncio.sleep(10)
-                else:
-                    # Normal interval when no emails found
-                    await asyncio.sleep(30)
+                poll_interval = await self._wait_for_new_emails(provider_config, scan_result, poll_interval)
                     
             except Exception as e:
                 consecutive_errors += 1
                 logger.error(f"Provider {provider_config['name']} monitoring error (consecutive: {consecutive_errors}): {str(e)}")
+                await imap_client_service.close_provider(provider_id)
                 
                 # If too many consecutive errors, temporarily disable this provider
                 if consecutive_errors >= max_errors:
@@ -197,11 +222,32 @@ class EmailProcessorFixed:
                     # Exponential backoff on errors, but cap at 5 minutes
                     wait_time = min(60 * consecutive_errors, 300)
                     await asyncio.sleep(wait_time)
+        
+        await imap_client_service.close_provider(provider_id)
+        await lease_service.release(lease_name)
+    
+    async def _wait_for_new_emails(self, provider_config: dict, scan_result: dict, poll_interval: Optional[float]) -> Optional[float]:
+        """Wait for IDLE push of new mail, or poll with backoff when the server has no IDLE; returns the poll interval used"""
+        new_emails_found = scan_result.get("new_emails_found", 0) > 0
+        connection = imap_client_service.connections.get(provider_config["id"])
+        
+        if connection and connection.supports_idle and not new_emails_found:
+            if await connection.wait_for_new_mail(imap_client_service.idle_timeout):
+                logger.info(f"Provider {provider_config['name']}: IDLE reported new mail")
+            return None
+        
+        poll_interval = imap_client_service.next_poll_interval(poll_interval, new_emails_found)
+        await asyncio.sleep(poll_interval)
+        return poll_interval
     
     async def stop_monitoring(self):
         """Stop email monitoring for all providers"""
         self.processing = False
+        for provider_id in list(self.monitored_providers.keys()):
+            await lease_service.release(f"imap:{provider_id}")
         self.monitored_providers.clear()
+        await imap_client_service.close_all()
+        await self._stop_inbound_workers()
         logger.info("FIXED Email monitoring stopped for all providers")
         return {"status": "stopped"}
     
@@ -218,51 +264,80 @@ class EmailProcessorFixed:
         }
         
         try:
-            # Connect to IMAP server
-            mail = imaplib.IMAP4_SSL(provider_config["imap_host"], provider_config["imap_port"])
-            mail.login(provider_config["imap_username"], provider_config["imap_password"])
-            mail.select("inbox")
-            
-            # Search for unread emails
-            status, messages = mail.search(None, "UNSEEN")
-            
-            if status == "OK":
-                message_ids = messages[0].split()
-                scan_result["new_emails_found"] = len(message_ids)
+            # Reuse the provider's persistent IMAP session
+            provider_id = provider_config["id"]
+            mail = await imap_client_service.get_connection(provider_config)
+            uid_validity = mail.uid_validity or 0
+            
+            # Incremental sync from the stored UID high-water mark; on first sync (or when the
+            # server renumbered the mailbox) pick up the unread backlog instead
+            sync_state = await db_service.get_imap_sync_state(provider_id)
+            initial_sync = not sync_state or sync_state.get("uid_validity") != uid_validity
+            if initial_sync:
+                uids = await mail.search_unseen_uids()
+            else:
+                uids = await mail.search_uids_after(sync_state["last_uid"])
+            
+            # Messages still in the pipeline sit above the committed high-water mark; ones a
+            # previous scan failed to fetch or queue are retried, or dropped once they are gone
+            pending = self.pending_uids.setdefault(provider_id, deque())
+            found = set(uids)
+            retrying = {}
+            for entry in pending:
+                if entry.get("retry"):
+                    if entry["uid"] in found:
+                        retrying[entry["uid"]] = entry
+                    else:
+                        entry["retry"], entry["done"] = False, True
+            in_flight = {entry["uid"] for entry in pending if entry["uid"] not in retrying}
+            uids = sorted(uid for uid in uids if uid not in in_flight)
+            scan_result["new_emails_found"] = len(uids)
+            
+            if uids:
+                logger.info(f"Provider {provider_config['name']}: Found {len(uids)} new emails to process")
+            
+            batch_size = imap_client_service.fetch_batch_size
+            for i in range(0, len(uids), batch_size):
+                batch = uids[i:i + batch_size]
                 
-                logger.info(f"Provider {provider_config['name']}: Found {len(message_ids)} new emails to process")
+                # Fetch the whole batch in one round trip
+                raw_messages = await mail.fetch_messages(batch)
                 
-                for msg_id in message_ids:
+                handed_off = []
+                for uid in batch:
+                    entry = retrying.get(uid)
+                    if entry is None:
+                        entry = {"uid": uid, "uid_validity": uid_validity, "done": False}
+                        pending.append(entry)
+                    # Stays unseen and holds back the high-water mark until a later scan gets it through
+                    entry["retry"] = True
+                    if uid not in raw_messages:
+                        continue
                     try:
-                        # Fetch email
-                        status, msg_data = mail.fetch(msg_id, "(RFC822)")
-                        
-                        if status == "OK":
-                            # Parse email
-                            email_body = msg_data[0][1]
-                            email_message = email.message_from_bytes(email_body)
-                            
-                            # Process the email with provider context - FIXED VERSION
-                            processed = await self._process_email_fixed(email_message, provider_config)
-                            if processed:
-                                scan_result["emails_processed"] += 1
-                            
-                            # Mark as read
-                            mail.store(msg_id, '+FLAGS', '\\Seen')
-                            
+                        # Blocks while the queue is full, so slow workers throttle fetching
+                        if await self._enqueue_fetched_email(raw_messages[uid], provider_config, entry):
+                            scan_result["emails_processed"] += 1  # Handed to the inbound pipeline
+                        entry["retry"] = False
+                        handed_off.append(uid)
                     except Exception as e:
-                        error_msg = f"Provider {provider_config['name']}: Error processing email {msg_id}: {str(e)}"
+                        error_msg = f"Provider {provider_config['name']}: Error queueing email UID {uid}: {str(e)}"
                         logger.error(error_msg)
                         scan_result["errors"].append(error_msg)
-                        continue
+                
+                await mail.mark_seen(handed_off)
+                await self._commit_sync_state(provider_id)
             
-            mail.close()
-            mail.logout()
+            if initial_sync:
+                baseline = max(uids + [(mail.uid_next or 1) - 1])
+                if not pending or baseline > pending[-1]["uid"]:
+                    pending.append({"uid": baseline, "uid_validity": uid_validity, "done": True})
+                await self._commit_sync_state(provider_id)
             
         except Exception as e:
             error_msg = f"Provider {provider_config['name']}: IMAP connection error: {str(e)}"
             logger.error(error_msg)
             scan_result["errors"].append(error_msg)
+            scan_result["connection_error"] = error_msg
         
         # Calculate scan duration
         scan_duration = (datetime.utcnow() - scan_start_time).total_seconds()
@@ -281,8 +356,142 @@ class EmailProcessorFixed:
         
         return scan_result
     
-    async def _process_email_fixed(self, email_message, provider_config: dict = None):
-        """FIXED: Process individual email with enhanced follow-up detection and auto-response"""
+    async def _enqueue_fetched_email(self, raw_email: bytes, provider_config: dict, entry: dict) -> bool:
+        """Parse a fetched message and queue it for the workers, once per Message-ID"""
+        email_message = email.message_from_bytes(raw_email)
+        message_id = (email_message.get("Message-ID") or "").strip() or \
+            f"{provider_config['id']}:{entry['uid_validity']}:{entry['uid']}"
+        
+        if message_id in self.inflight_message_ids:
+            entry["done"] = True
+            return False
+        
+        claimed = await db_service.claim_inbound_message(message_id, {
+            "provider_id": provider_config["id"],
+            "uid_validity": entry["uid_validity"],
+            "uid": entry["uid"],
+            "sender": email_message.get("From", "")
+        }, lease_service.worker_id, self.inbound_claim_seconds)
+        if not claimed:
+            logger.info(f"Provider {provider_config['name']}: Message {message_id} already processed or claimed by another worker, skipping")
+            entry["done"] = True
+            return False
+        
+        self.inflight_message_ids.add(message_id)
+        await self.inbound_queue.put({
+            "message_id": message_id,
+            "email_message": email_message,
+            "raw_email": raw_email,
+            "provider_config": provider_config,
+            "entry": entry
+        })
+        return True
+    
+    def _start_inbound_workers(self):
+        """Start the worker pool that consumes the inbound queue"""
+        self.inbound_queue = asyncio.Queue(maxsize=self.inbound_queue_size)
+        self.inflight_message_ids.clear()
+        self.pending_uids.clear()
+        self.inbound_workers = [
+            asyncio.create_task(self._inbound_worker(worker_number))
+            for worker_number in range(self.inbound_worker_count)
+        ]
+        logger.info(f"Started {self.inbound_worker_count} inbound email workers (queue size {self.inbound_queue_size})")
+    
+    async def _stop_inbound_workers(self):
+        """Stop the worker pool; unfinished emails stay above the high-water mark and are fetched again"""
+        for worker in self.inbound_workers:
+            worker.cancel()
+        await asyncio.gather(*self.inbound_workers, return_exceptions=True)
+        self.inbound_workers = []
+        self.inbound_queue = None
+        self.inflight_message_ids.clear()
+        self.pending_uids.clear()
+    
+    async def _inbound_worker(self, worker_number: int):
+        """Consume queued emails: reply detection, intent classification and auto-response"""
+        while True:
+            item = await self.inbound_queue.get()
+            provider_config = item["provider_config"]
+            try:
+                # Process the email with provider context - FIXED VERSION
+                processed = await self._process_email_fixed(item["email_message"], provider_config, item["raw_email"],
+                                                            item["message_id"])
+                await db_service.complete_inbound_message(item["message_id"], {"matched_prospect": processed})
+                self.inbound_processed_count += 1
+            except Exception as e:
+                item["attempts"] = item.get("attempts", 0) + 1
+                logger.error(f"Inbound worker {worker_number}: Error processing message {item['message_id']} "
+                             f"(attempt {item['attempts']}/{self.inbound_max_attempts}): {str(e)}")
+                if item["attempts"] < self.inbound_max_attempts:
+                    # Not done, so the high-water mark waits for the retry
+                    self.inbound_queue.task_done()
+                    asyncio.create_task(self._retry_inbound(item))
+                    continue
+                try:
+                    await db_service.fail_inbound_message(item["message_id"], str(e), item["attempts"])
+                except Exception as fail_error:
+                    logger.error(f"Inbound worker {worker_number}: Error recording failed message {item['message_id']}: {str(fail_error)}")
+            
+            item["entry"]["done"] = True
+            self.inflight_message_ids.discard(item["message_id"])
+            self.inbound_queue.task_done()
+            
+            try:
+                await self._commit_sync_state(provider_config["id"])
+            except Exception as e:
+                logger.error(f"Inbound worker {worker_number}: Error saving IMAP sync state: {str(e)}")
+    
+    async def _retry_inbound(self, item: dict):
+        """Queue a failed email again after a delay, renewing its claim first"""
+        queue = self.inbound_queue
+        await asyncio.sleep(self.inbound_retry_delay)
+        if queue is not self.inbound_queue:
+            return  # Workers restarted; the email is still above the high-water mark and gets fetched again
+        try:
+            claimed = await db_service.claim_inbound_message(item["message_id"], {}, lease_service.worker_id,
+                                                             self.inbound_claim_seconds)
+        except Exception as e:
+            logger.error(f"Error renewing claim on message {item['message_id']}: {str(e)}")
+            claimed = True  # Our claim is only lost once it expires, keep trying
+        if not claimed:
+            # Processed or taken over by another worker after our claim ran out
+            item["entry"]["done"] = True
+            self.inflight_message_ids.discard(item["message_id"])
+            await self._commit_sync_state(item["provider_config"]["id"])
+            return
+        await queue.put(item)
+    
+    async def _commit_sync_state(self, provider_id: str):
+        """Advance the UID high-water mark past the leading run of finished messages"""
+        pending = self.pending_uids.get(provider_id)
+        if not pending:
+            return
+        
+        async with self.sync_locks.setdefault(provider_id, asyncio.Lock()):
+            committed = None
+            while pending and pending[0]["done"]:
+                committed = pending.popleft()
+            if committed:
+                await db_service.save_imap_sync_state(provider_id, committed["uid_validity"], committed["uid"])
+    
+    def get_pipeline_stats(self) -> Dict:
+        """Get inbound pipeline statistics"""
+        return {
+            "workers": len(self.inbound_workers),
+            "queue_size": self.inbound_queue.qsize() if self.inbound_queue else 0,
+            "queue_capacity": self.inbound_queue_size,
+            "in_flight": len(self.inflight_message_ids),
+            "processed": self.inbound_processed_count
+        }
+    
+    async def _process_email_fixed(self, email_message, provider_config: dict = None, raw_email: bytes = None,
+                                   inbound_message_id: str = None):
+        """FIXED: Process individual email with enhanced follow-up detection and auto-response
+        
+        Errors are raised so the inbound worker can retry; steps already finished for
+        inbound_message_id (recording the message, sending the auto-reply) are skipped on a retry.
+        """
         try:
             # Extract email details
             sender = email_message.get("From", "")
@@ -302,6 +511,11 @@ class EmailProcessorFixed:
             
             logger.info(f"FIXED: Processing email from: {sender_email}")
             
+            completed_steps = await db_service.get_inbound_steps(inbound_message_id) if inbound_message_id else set()
+            if "auto_reply_sent" in completed_steps:
+                logger.info(f"FIXED: Auto-response already sent for this email from {sender_email} - nothing left to do")
+                return True
+            
             # Create/update thread context
             thread_context = await self._get_or_create_thread_context_fixed(prospect["id"], sender_email)
             
@@ -310,27 +524,11 @@ class EmailProcessorFixed:
                 prospect["id"], content, subject, thread_context
             )
             
-            # Add message to thread with response flag
-            message_data = {
-                "type": "received",
-                "sender": sender_email,
-                "subject": subject,
-                "content": content,
-                "timestamp": datetime.utcnow(),
-                "raw_email": str(email_message),
-                "is_response_to_our_email": is_response_to_our_email,
-                "message_id": f"msg_{generate_id()}"
-            }
-            
-            await self._add_message_to_thread(thread_context["id"], message_data)
-            
-            # Update prospect last contact time
-            await db_service.update_prospect_last_contact(prospect["id"], datetime.utcnow())
-            
-            # FIXED: Enhanced follow-up stopping logic - ALWAYS STOP FOR ANY REPLY
-            if is_response_to_our_email:
-                logger.info(f"CRITICAL FIX: Detected reply from {sender_email} - STOPPING ALL FOLLOW-UPS")
-                await self._handle_prospect_response_fixed(prospect, content, subject, thread_context)
+            if "message_recorded" not in completed_steps:
+                await self._record_received_message_fixed(email_message, raw_email, prospect, sender_email,
+                                                          subject, content, thread_context, is_response_to_our_email)
+                if inbound_message_id:
+                    await db_service.record_inbound_step(inbound_message_id, "message_recorded")
             
             # FIXED: Enhanced intent classification and auto-response - ALWAYS TRY TO RESPOND
             logger.info("FIXED: Starting intent classification for auto-response...")
@@ -367,15 +565,17 @@ class EmailProcessorFixed:
                 )
                 
                 if response_data.get("error"):
-                    logger.error(f"Response generation failed: {response_data['error']}")
-                    return True
+                    raise RuntimeError(f"Response generation failed: {response_data['error']}")
                 
-                # Send automatic response
-                await self._send_automatic_response_fixed(
+                # Send automatic response; marked done as soon as it is sent so a retry never sends it twice
+                sent = await self._send_automatic_response_fixed(
                     prospect, 
                     response_data, 
-                    thread_context["id"]
+                    thread_context["id"],
+                    inbound_message_id
                 )
+                if not sent:
+                    raise RuntimeError(f"Automatic response to {sender_email} was not sent")
                 
                 logger.info(f"FIXED: Automatic response sent to: {sender_email}")
             else:
@@ -385,9 +585,34 @@ class EmailProcessorFixed:
                 
         except Exception as e:
             logger.error(f"FIXED: Error processing email: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return False
+            raise
+    
+    async def _record_received_message_fixed(self, email_message, raw_email: bytes, prospect: dict, sender_email: str,
+                                             subject: str, content: str, thread_context: dict,
+                                             is_response_to_our_email: bool):
+        """Add a received email to its thread, update the prospect and stop follow-ups on a reply"""
+        # Add message to thread with response flag; the raw MIME goes to the blob store
+        message_data = {
+            "type": "received",
+            "sender": sender_email,
+            "subject": subject,
+            "content": content,
+            "timestamp": datetime.utcnow(),
+            "is_response_to_our_email": is_response_to_our_email,
+            "message_id": f"msg_{generate_id()}",
+            "email_message_id": email_message.get("Message-ID"),
+            **await blob_store_service.raw_email_fields(raw_email or str(email_message).encode("utf-8", errors="replace"))
+        }
+        
+        await self._add_message_to_thread(thread_context["id"], message_data)
+        
+        # Update prospect last contact and last received times
+        await db_service.record_prospect_message_received(prospect["id"], message_data["timestamp"])
+        
+        # FIXED: Enhanced follow-up stopping logic - ALWAYS STOP FOR ANY REPLY
+        if is_response_to_our_email:
+            logger.info(f"CRITICAL FIX: Detected reply from {sender_email} - STOPPING ALL FOLLOW-UPS")
+            await self._handle_prospect_response_fixed(prospect, content, subject, thread_context)
     
     async def _check_if_response_to_our_email_fixed(self, prospect_id: str, content: str, subject: str, thread_context: dict):
         """FIXED: Enhanced check if this email is a response to our email - MORE AGGRESSIVE DETECTION"""
@@ -632,8 +857,9 @@ class EmailProcessorFixed:
             logger.error(f"FIXED: Error checking auto-response: {str(e)}")
             return True  # Default to responding
     
-    async def _send_automatic_response_fixed(self, prospect: Dict, response_data: Dict, thread_id: str):
-        """FIXED: Send automatic response with enhanced tracking"""
+    async def _send_automatic_response_fixed(self, prospect: Dict, response_data: Dict, thread_id: str,
+                                             inbound_message_id: str = None) -> bool:
+        """FIXED: Send automatic response with enhanced tracking; returns whether it was sent"""
         try:
             logger.info(f"FIXED: Sending automatic response to {prospect['email']}")
             
@@ -646,7 +872,7 @@ class EmailProcessorFixed:
             
             if not original_provider:
                 logger.error(f"FIXED: No email provider available for auto-response to {prospect['email']}")
-                return
+                return False
             
             # Send email with proper error handling using the original provider
             try:
@@ -658,6 +884,10 @@ class EmailProcessorFixed:
                 )
                 
                 if success:
+                    if inbound_message_id:
+                        # Recorded before anything else can fail, so a retry never sends it again
+                        await db_service.record_inbound_step(inbound_message_id, "auto_reply_sent")
+                    
                     # Create email record with enhanced tracking
                     email_id = generate_id()
                     email_record = {
@@ -699,8 +929,10 @@ class EmailProcessorFixed:
                     
                     provider_email = original_provider["email_address"]
                     logger.info(f"FIXED: Automatic response sent successfully to: {prospect['email']} from provider: {provider_email}")
+                    return True
                 else:
                     logger.error(f"FIXED: Failed to send automatic response to: {prospect['email']}")
+                    return False
                     
             except Exception as email_error:
                 logger.error(f"FIXED: SMTP Error sending automatic response to {prospect['email']}: {str(email_error)}")
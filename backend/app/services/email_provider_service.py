@@ -2,15 +2,16 @@ import os
 import smtplib
 import imaplib
 import email
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from typing import Dict, List, Optional, Tuple
-from datetime import datetime, timedelta
+from datetime import datetime
 import asyncio
 import logging
 from app.models import EmailProvider, EmailProviderType
 from app.services.database import db_service
+from app.services.rate_limit_service import rate_limit_service, RATE_LIMIT_ERROR
+from app.services.smtp_delivery_service import smtp_delivery_service
 from app.utils.helpers import generate_id
+from app.utils.mime_builder import message_builder, PreparedMessage
 
 logger = logging.getLogger(__name__)
 
@@ -156,24 +157,64 @@ class EmailProviderService:
             if not provider["is_active"]:
                 return False, "Email provider is not active"
             
-            # Check rate limits
-            if not await self._check_rate_limits(provider_id):
-                return False, "Rate limit exceeded"
+            # Reserve a send slot atomically; it is handed back if delivery fails
+            reservation = await rate_limit_service.reserve(provider_id, 1)
+            if not reservation["granted"]:
+                return False, RATE_LIMIT_ERROR
             
             # Send email
-            success = await self._send_email_smtp(provider, to_email, subject, content, content_type)
+            success, error = await self._send_email_smtp(provider, to_email, subject, content, content_type)
             
             if success:
-                # Update send counts
-                await self._update_send_counts(provider_id)
                 return True, None
             else:
-                return False, "Failed to send email"
+                await rate_limit_service.release(provider_id, 1)
+                return False, error or "Failed to send email"
                 
         except Exception as e:
             logger.error(f"Error sending email via provider {provider_id}: {str(e)}")
             return False, str(e)
     
+    async def send_bulk_emails(self, provider_id: str, emails: List[Dict], reserved: bool = False) -> List[Tuple[bool, Optional[str]]]:
+        """Send many emails through one provider over pooled SMTP sessions.
+        
+        Each item needs "to_email", "subject" and "content", and may carry "html_content".
+        Results are returned in input order; items beyond the provider's remaining
+        hourly/daily quota are not attempted and fail with "Rate limit exceeded".
+        Pass reserved=True when the caller already reserved quota for every email
+        with rate_limit_service.reserve. Quota of emails that fail is released.
+        """
+        try:
+            await db_service.connect()
+            
+            provider = await self.get_email_provider_by_id(provider_id)
+            if not provider or not provider["is_active"]:
+                if reserved:
+                    await rate_limit_service.release(provider_id, len(emails))
+                error = "Email provider is not active" if provider else "Email provider not found"
+                return [(False, error)] * len(emails)
+            
+            granted = len(emails) if reserved else (await rate_limit_service.reserve(provider_id, len(emails)))["granted"]
+            
+            messages = [
+                self._build_message(provider, item["to_email"], item["subject"], item["content"],
+                                    item.get("content_type", "html"), item.get("html_content"))
+                for item in emails[:granted]
+            ]
+            results = await smtp_delivery_service.send_bulk(provider, messages)
+            results += [(False, RATE_LIMIT_ERROR)] * (len(emails) - len(messages))
+            
+            failed_count = len([r for r in results[:granted] if not r[0]])
+            if failed_count:
+                await rate_limit_service.release(provider_id, failed_count)
+            
+            return results
+            
+        except Exception as e:
+            logger.error(f"Error bulk sending via provider {provider_id}: {str(e)}")
+            # Delivery status is unknown, so the reserved quota stays used
+            return [(False, str(e))] * len(emails)
+    
     async def get_emails(self, provider_id: str, folder: str = "INBOX", limit: int = 100) -> List[Dict]:
         """Get emails from provider"""
         try:
@@ -272,41 +313,16 @@ class EmailProviderService:
         except Exception as e:
             return f"Connection test error: {str(e)}"
     
+    def _build_message(self, provider: Dict, to_email: str, subject: str, content: str,
+                       content_type: str = "html", html_content: Optional[str] = None) -> PreparedMessage:
+        """Build the message bytes for a provider, reusing its cached envelope"""
+        return message_builder.build(provider, to_email, subject, content, content_type, html_content)
+    
     async def _send_email_smtp(self, provider: Dict, to_email: str, subject: str, 
-                              content: str, content_type: str = "html") -> bool:
-        """Send email via SMTP"""
-        try:
-            # Create message
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = f"{provider.get('display_name', '')} <{provider['email_address']}>"
-            msg['To'] = to_email
-            
-            # Add content
-            if content_type == "html":
-                html_part = MIMEText(content, 'html')
-                msg.attach(html_part)
-            else:
-                text_part = MIMEText(content, 'plain')
-                msg.attach(text_part)
-            
-            # Send email
-            server = smtplib.SMTP(provider["smtp_host"], provider["smtp_port"])
-            if provider.get("smtp_use_tls"):
-                server.starttls()
-            
-            server.login(provider.get("smtp_username", provider["email_address"]), 
-                        provider["smtp_password"])
-            
-            text = msg.as_string()
-            server.sendmail(provider["email_address"], to_email, text)
-            server.quit()
-            
-            return True
-            
-        except Exception as e:
-            logger.error(f"SMTP send error: {str(e)}")
-            return False
+                              content: str, content_type: str = "html") -> Tuple[bool, Optional[str]]:
+        """Send email via SMTP using the provider's pooled session; returns (success, error)"""
+        msg = self._build_message(provider, to_email, subject, content, content_type)
+        return await smtp_delivery_service.send_message(provider, msg)
     
     async def _get_emails_imap(self, provider: Dict, folder: str, limit: int) -> List[Dict]:
         """Get emails via IMAP"""
@@ -378,68 +394,6 @@ class EmailProviderService:
         except Exception as e:
             logger.error(f"Error extracting email content: {str(e)}")
             return ""
-    
-    async def _check_rate_limits(self, provider_id: str) -> bool:
-        """Check if provider is within rate limits"""
-        try:
-            provider = await self.get_email_provider_by_id(provider_id)
-            if not provider:
-                return False
-            
-            # Check daily limit
-            if provider.get("current_daily_count", 0) >= provider.get("daily_send_limit", 500):
-                return False
-            
-            # Check hourly limit
-            if provider.get("current_hourly_count", 0) >= provider.get("hourly_send_limit", 50):
-                return False
-            
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error checking rate limits: {str(e)}")
-            return False
-    
-    async def _update_send_counts(self, provider_id: str):
-        """Update send counts for rate limiting"""
-        try:
-            # Increment counts
-            await db_service.increment_provider_send_counts(provider_id)
-            
-            # Reset counters if needed (this could be a scheduled task)
-            await self._reset_rate_limit_counters_if_needed(provider_id)
-            
-        except Exception as e:
-            logger.error(f"Error updating send counts: {str(e)}")
-    
-    async def _reset_rate_limit_counters_if_needed(self, provider_id: str):
-        """Reset rate limit counters if time period has passed"""
-        try:
-            provider = await self.get_email_provider_by_id(provider_id)
-            if not provider:
-                return
-            
-            now = datetime.utcnow()
-            last_sync = provider.get("last_sync")
-            
-            if last_sync:
-                # Reset hourly counter if an hour has passed
-                if now - last_sync > timedelta(hours=1):
-                    await db_service.update_email_provider(provider_id, {
-                        "current_hourly_count": 0,
-                        "last_sync": now
-                    })
-                
-                # Reset daily counter if a day has passed
-                if now - last_sync > timedelta(days=1):
-                    await db_service.update_email_provider(provider_id, {
-                        "current_daily_count": 0,
-                        "current_hourly_count": 0,
-                        "last_sync": now
-                    })
-            
-        except Exception as e:
-            logger.error(f"Error resetting rate limit counters: {str(e)}")
 
 # Create global email provider service instance
 email_provider_service = EmailProviderService()
\ No newline at end of file
@@ -92,15 +92,20 @@ class EnhancedDatabaseService(DatabaseService):
             if provider:
                 return provider
         
-        # Fallback: Check first email sent to this prospect
+        # Fallback: Check first email sent to this prospect (older campaign records only carry provider_id)
         email_record = await self.db.emails.find_one({
             "prospect_id": prospect_id,
-            "sent_by_us": True,
-            "is_follow_up": False
+            "type": {"$ne": "received"},
+            "is_follow_up": {"$ne": True},
+            "$or": [
+                {"email_provider_id": {"$nin": [None, ""]}},
+                {"provider_id": {"$nin": [None, ""]}}
+            ]
         }, sort=[("sent_at", 1)])
         
-        if email_record and email_record.get("email_provider_id"):
-            provider = await self.get_email_provider_by_id(email_record["email_provider_id"])
+        provider_id = email_record and (email_record.get("email_provider_id") or email_record.get("provider_id"))
+        if provider_id:
+            provider = await self.get_email_provider_by_id(provider_id)
             if provider:
                 return provider
         
@@ -158,8 +163,9 @@ class EnhancedDatabaseService(DatabaseService):
         
         return stats
     
-    async def mark_follow_up_as_processed(self, prospect_id: str, follow_up_sequence: int):
-        """Mark a follow-up as processed for this prospect"""
+    async def mark_follow_up_as_processed(self, prospect_id: str, follow_up_sequence: int,
+                                          next_follow_up_at: datetime = None):
+        """Mark a follow-up as processed for this prospect and schedule the next one"""
         await self.connect()
         result = await self.db.prospects.update_one(
             {"id": prospect_id},
@@ -167,6 +173,7 @@ class EnhancedDatabaseService(DatabaseService):
                 "$set": {
                     "last_follow_up": datetime.utcnow(),
                     "follow_up_count": follow_up_sequence,
+                    "next_follow_up_at": next_follow_up_at,
                     "updated_at": datetime.utcnow()
                 }
             }
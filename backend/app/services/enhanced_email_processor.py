@@ -133,6 +133,7 @@ class EnhancedEmailProcessor:
             }
             
             await db_service.add_message_to_thread(thread["id"], message_data)
+            await db_service.record_prospect_message_received(prospect_id, message_data["timestamp"])
             
             # Process the email for follow-up decisions
             follow_up_result = await smart_follow_up_engine.process_email_response(
@@ -2,14 +2,26 @@ import os
 from typing import List, Dict, Optional, Tuple
 import json
 import asyncio
+import hashlib
+import logging
+import random
+import time
+from collections import deque
 from datetime import datetime
+from types import SimpleNamespace
+import httpx
 from app.services.database import db_service
 from app.services.knowledge_base_service import knowledge_base_service
+from app.services.classification_cache_service import classification_cache_service
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+INVALID_GROQ_API_KEY = "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"
+
 class MockGroqClient:
     """Mock Groq client for when API key is invalid or for testing"""
     def __init__(self, api_key):
@@ -69,24 +81,184 @@ class MockGroqClient:
                 
                 return MockResponse()
 
-class GroqService:
-    def __init__(self):
-        api_key = os.getenv("GROQ_API_KEY")
-        self.use_mock = not api_key or api_key == "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"  # Invalid key
+class ChatCompletionResponse:
+    """Chat completion result with the same shape as the groq SDK response"""
+    def __init__(self, data: Dict):
+        self.id = data.get("id")
+        self.model = data.get("model")
+        self.usage = data.get("usage", {})
+        self.choices = [
+            SimpleNamespace(
+                index=choice.get("index", 0),
+                finish_reason=choice.get("finish_reason"),
+                message=SimpleNamespace(**choice.get("message", {"role": "assistant", "content": ""}))
+            )
+            for choice in data.get("choices", [])
+        ]
+
+class GroqGateway:
+    """Async gateway for Groq chat completions: keep-alive HTTP, bounded concurrency, retries and latency metrics"""
+    
+    def __init__(self, api_key: Optional[str], backend: Optional[MockGroqClient] = None):
+        self.api_key = api_key
+        self.backend = backend  # Offline backend; None calls the Groq HTTP API
+        self.base_url = os.getenv("GROQ_API_BASE_URL", "https://api.groq.com/openai/v1")
+        self.max_concurrency = int(os.getenv("GROQ_MAX_CONCURRENCY", 8))
+        self.max_retries = int(os.getenv("GROQ_MAX_RETRIES", 3))
+        self.timeout = float(os.getenv("GROQ_TIMEOUT", 30))
+        self.retry_base_delay = float(os.getenv("GROQ_RETRY_BASE_DELAY", 0.5))
+        self.retry_max_delay = float(os.getenv("GROQ_RETRY_MAX_DELAY", 20))
+        
+        self._http: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._in_flight: Dict[str, asyncio.Future] = {}
         
-        if self.use_mock:
-            print("Using mock Groq service (invalid or missing API key)")
-            self.client = MockGroqClient(api_key or "mock_key")
+        # Same call shape as the groq SDK: await client.chat.completions.create(...)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create_chat_completion))
+        
+        self.call_count = 0
+        self.failure_count = 0
+        self.retry_count = 0
+        self.coalesced_count = 0
+        self.latencies = deque(maxlen=1000)
+    
+    @property
+    def is_mock(self) -> bool:
+        """Whether calls go to the offline backend"""
+        return self.backend is not None
+    
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Get the shared keep-alive HTTP client"""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                    keepalive_expiry=60
+                )
+            )
+        return self._http
+    
+    async def create_chat_completion(self, model: str, messages: List[Dict], temperature: float = 0.7,
+                                     max_tokens: int = 1000) -> ChatCompletionResponse:
+        """Run a chat completion; identical concurrent requests share one upstream call"""
+        payload = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+        
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced_count += 1
         else:
-            try:
-                from groq import Groq
-                self.client = Groq(api_key=api_key)
-                print("Using real Groq service")
-            except Exception as e:
-                print(f"Failed to initialize Groq client, falling back to mock: {str(e)}")
-                self.client = MockGroqClient(api_key)
-                self.use_mock = True
+            task = asyncio.ensure_future(self._complete(payload))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        
+        # Shielded so one cancelled caller does not cancel the call for the others
+        return await asyncio.shield(task)
+    
+    async def _complete(self, payload: Dict):
+        """Send a completion to the backend and record its latency"""
+        started_at = time.monotonic()
+        try:
+            if self.backend is not None:
+                response = self.backend.chat.completions.create(**payload)
+            else:
+                response = await self._post_with_retries(payload)
+            return response
+        except Exception:
+            self.failure_count += 1
+            raise
+        finally:
+            self.call_count += 1
+            self.latencies.append(time.monotonic() - started_at)
+    
+    async def _post_with_retries(self, payload: Dict) -> ChatCompletionResponse:
+        """POST to the API, retrying rate limits, server errors and network failures with jittered backoff"""
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    http_response = await self._get_http_client().post("/chat/completions", json=payload)
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = self._backoff_delay(attempt)
+                    reason = str(e) or e.__class__.__name__
+                else:
+                    if http_response.status_code != 429 and http_response.status_code < 500:
+                        http_response.raise_for_status()
+                        return ChatCompletionResponse(http_response.json())
+                    if attempt == self.max_retries:
+                        http_response.raise_for_status()
+                    delay = self._retry_after(http_response) or self._backoff_delay(attempt)
+                    reason = f"HTTP {http_response.status_code}"
+                
+                self.retry_count += 1
+                logger.warning(f"Groq call failed ({reason}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+    
+    def _retry_after(self, http_response: httpx.Response) -> Optional[float]:
+        """Honour the server's Retry-After header, with a little jitter so waiting callers spread out"""
+        try:
+            retry_after = float(http_response.headers.get("retry-after", ""))
+        except ValueError:
+            return None
+        return min(self.retry_max_delay, retry_after) + random.uniform(0, self.retry_base_delay)
+    
+    async def close(self):
+        """Close the HTTP client"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+    
+    def get_stats(self) -> Dict:
+        """Get call counts and latency percentiles"""
+        latencies = sorted(self.latencies)
         
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+        
+        return {
+            "backend": "mock" if self.is_mock else "groq",
+            "max_concurrency": self.max_concurrency,
+            "in_flight": len(self._in_flight),
+            "calls": self.call_count,
+            "failures": self.failure_count,
+            "retries": self.retry_count,
+            "coalesced": self.coalesced_count,
+            "latency_ms": {
+                "avg": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": round(latencies[-1] * 1000, 1) if latencies else None
+            }
+        }
+
+def _create_groq_gateway() -> GroqGateway:
+    """Use the Groq API when a valid key is configured, otherwise the offline mock"""
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key or api_key == INVALID_GROQ_API_KEY:
+        print("Using mock Groq service (invalid or missing API key)")
+        return GroqGateway(api_key, backend=MockGroqClient(api_key or "mock_key"))
+    
+    print("Using real Groq service")
+    return GroqGateway(api_key)
+
+# Shared gateway used by every Groq-backed service
+groq_gateway = _create_groq_gateway()
+
+class GroqService:
+    def __init__(self):
+        self.client = groq_gateway
+        self.use_mock = groq_gateway.is_mock
         self.model = "llama3-8b-8192"
         
     async def classify_intents(self, email_content: str, subject: str = "", 
@@ -95,6 +267,16 @@ class GroqService:
         Enhanced intent classification with fallback to mock when API fails
         """
         try:
+            # Repeated replies are served from the cache; the key changes whenever intents or prompts do
+            cache_key = classification_cache_service.make_key(
+                "intents", subject, email_content, self.model, use_custom_prompt,
+                await db_service.get_cache_version("intents"),
+                await db_service.get_cache_version("system_prompts")
+            )
+            cached_intents = await classification_cache_service.get(cache_key)
+            if cached_intents is not None:
+                return cached_intents
+            
             # Get available intents from database
             intents = await db_service.get_intents()
             
@@ -143,7 +325,7 @@ class GroqService:
             
             # Call the AI API (real or mock)
             try:
-                response = self.client.chat.completions.create(
+                response = await self.client.chat.completions.create(
                     model=self.model,
                     messages=messages,
                     temperature=0.3,
@@ -180,6 +362,7 @@ class GroqService:
                             })
                     
                     print(f"Successfully classified {len(valid_intents)} intents")
+                    await classification_cache_service.set(cache_key, valid_intents)
                     return valid_intents
                     
                 except json.JSONDecodeError as e:
@@ -257,6 +440,12 @@ class GroqService:
         Enhanced sentiment analysis with keyword-based fallback
         """
         try:
+            # Keyword scoring is cheaper than a Mongo round trip, so only the in-process tier is used
+            cache_key = classification_cache_service.make_key("sentiment", "", email_content)
+            cached_sentiment = await classification_cache_service.get(cache_key, shared=False)
+            if cached_sentiment is not None:
+                return cached_sentiment
+            
             # Simple keyword-based sentiment analysis
             content_lower = email_content.lower()
             
@@ -280,13 +469,15 @@ class GroqService:
             
             urgency = "high" if urgency_score > 0 else "medium" if positive_score > 0 or negative_score > 0 else "low"
             
-            return {
+            sentiment_result = {
                 "sentiment": sentiment,
                 "urgency": urgency,
                 "emotion_detected": sentiment,
                 "confidence": confidence,
                 "reasoning": f"Keyword-based analysis: {positive_score} positive, {negative_score} negative, {urgency_score} urgent words"
             }
+            await classification_cache_service.set(cache_key, sentiment_result, shared=False)
+            return sentiment_result
             
         except Exception as e:
             print(f"Error in sentiment analysis: {str(e)}")
@@ -421,8 +612,7 @@ class GroqService:
             
             # If no specific templates found, get all auto_response templates
             if not templates:
-                all_templates = await db_service.get_templates()
-                templates = [t for t in all_templates if t.get("type") == "auto_response"]
+                templates = await db_service.get_templates_by_type("auto_response")
             
             return templates
             
@@ -1,92 +1,20 @@
-import os
 from typing import List, Dict, Optional, Tuple
 import json
 import asyncio
 from datetime import datetime
 from app.services.database import db_service
 from app.services.knowledge_base_service import knowledge_base_service
+from app.services.classification_cache_service import classification_cache_service
+from app.services.groq_service import groq_gateway
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-class MockGroqClient:
-    """Mock Groq client for when API key is invalid or for testing"""
-    def __init__(self, api_key):
-        self.api_key = api_key
-        
-    class chat:
-        class completions:
-            @staticmethod
-            def create(model, messages, temperature=0.7, max_tokens=1000):
-                # Mock response with realistic classification
-                user_message = ""
-                for msg in messages:
-                    if msg.get("role") == "user":
-                        user_message = msg.get("content", "").lower()
-                        break
-                
-                # Determine intent based on content
-                intent_name = "General Inquiry"
-                confidence = 0.7
-                
-                if any(word in user_message for word in ["interested", "interest", "tell me more", "learn more"]):
-                    intent_name = "Interested - Auto Respond"
-                    confidence = 0.9
-                elif any(word in user_message for word in ["pricing", "price", "cost", "quote"]):
-                    intent_name = "Pricing Request - Auto Respond"
-                    confidence = 0.85
-                elif any(word in user_message for word in ["demo", "meeting", "call", "schedule"]):
-                    intent_name = "Demo Request"
-                    confidence = 0.8
-                elif any(word in user_message for word in ["question", "how does", "what is", "can you explain"]):
-                    intent_name = "Question - Auto Respond"
-                    confidence = 0.85
-                elif any(word in user_message for word in ["unsubscribe", "stop", "remove"]):
-                    intent_name = "Unsubscribe"
-                    confidence = 0.95
-                
-                class MockResponse:
-                    def __init__(self):
-                        self.choices = [MockChoice()]
-                
-                class MockChoice:
-                    def __init__(self):
-                        self.message = MockMessage()
-                
-                class MockMessage:
-                    def __init__(self):
-                        self.content = json.dumps({
-                            "intents": [{
-                                "intent_id": "mock_intent_001",
-                                "intent_name": intent_name,
-                                "confidence": confidence,
-                                "reasoning": f"Detected {intent_name.lower()} based on keywords and context",
-                                "keywords_found": [word for word in ["interested", "pricing", "demo"] if word in user_message],
-                                "context_strength": "high" if confidence > 0.8 else "medium"
-                            }]
-                        })
-                
-                return MockResponse()
-
 class GroqService:
     def __init__(self):
-        api_key = os.getenv("GROQ_API_KEY")
-        self.use_mock = not api_key or api_key == "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"  # Invalid key
-        
-        if self.use_mock:
-            print("Using mock Groq service (invalid or missing API key)")
-            self.client = MockGroqClient(api_key or "mock_key")
-        else:
-            try:
-                from groq import Groq
-                self.client = Groq(api_key=api_key)
-                print("Using real Groq service")
-            except Exception as e:
-                print(f"Failed to initialize Groq client, falling back to mock: {str(e)}")
-                self.client = MockGroqClient(api_key)
-                self.use_mock = True
-        
+        self.client = groq_gateway
+        self.use_mock = groq_gateway.is_mock
         self.model = "llama3-8b-8192"
         
     async def classify_intents(self, email_content: str, subject: str = "", 
@@ -95,6 +23,16 @@ class GroqService:
         Enhanced intent classification with fallback to mock when API fails
         """
         try:
+            # Repeated replies are served from the cache; the key changes whenever intents or prompts do
+            cache_key = classification_cache_service.make_key(
+                "intents", subject, email_content, self.model, use_custom_prompt,
+                await db_service.get_cache_version("intents"),
+                await db_service.get_cache_version("system_prompts")
+            )
+            cached_intents = await classification_cache_service.get(cache_key)
+            if cached_intents is not None:
+                return cached_intents
+            
             # Get available intents from database
             intents = await db_service.get_intents()
             
@@ -143,7 +81,7 @@ class GroqService:
             
             # Call the AI API (real or mock)
             try:
-                response = self.client.chat.completions.create(
+                response = await self.client.chat.completions.create(
                     model=self.model,
                     messages=messages,
                     temperature=0.3,
@@ -180,6 +118,7 @@ class GroqService:
                             })
                     
                     print(f"Successfully classified {len(valid_intents)} intents")
+                    await classification_cache_service.set(cache_key, valid_intents)
                     return valid_intents
                     
                 except json.JSONDecodeError as e:
@@ -257,6 +196,12 @@ class GroqService:
         Enhanced sentiment analysis with keyword-based fallback
         """
         try:
+            # Keyword scoring is cheaper than a Mongo round trip, so only the in-process tier is used
+            cache_key = classification_cache_service.make_key("sentiment", "", email_content)
+            cached_sentiment = await classification_cache_service.get(cache_key, shared=False)
+            if cached_sentiment is not None:
+                return cached_sentiment
+            
             # Simple keyword-based sentiment analysis
             content_lower = email_content.lower()
             
@@ -280,13 +225,15 @@ class GroqService:
             
             urgency = "high" if urgency_score > 0 else "medium" if positive_score > 0 or negative_score > 0 else "low"
             
-            return {
+            sentiment_result = {
                 "sentiment": sentiment,
                 "urgency": urgency,
                 "emotion_detected": sentiment,
                 "confidence": confidence,
                 "reasoning": f"Keyword-based analysis: {positive_score} positive, {negative_score} negative, {urgency_score} urgent words"
             }
+            await classification_cache_service.set(cache_key, sentiment_result, shared=False)
+            return sentiment_result
             
         except Exception as e:
             print(f"Error in sentiment analysis: {str(e)}")
@@ -421,8 +368,7 @@ class GroqService:
             
             # If no specific templates found, get all auto_response templates
             if not templates:
-                all_templates = await db_service.get_templates()
-                templates = [t for t in all_templates if t.get("type") == "auto_response"]
+                templates = await db_service.get_templates_by_type("auto_response")
             
             return templates
             
@@ -5,6 +5,7 @@ import asyncio
 from datetime import datetime
 from app.services.database import db_service
 from app.services.knowledge_base_service import knowledge_base_service
+from app.services.groq_service import GroqGateway
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -38,7 +39,7 @@ class MockGroqClient:
 class GroqService:
     def __init__(self):
         api_key = os.getenv("GROQ_API_KEY", "mock_key")
-        self.client = MockGroqClient(api_key)
+        self.client = GroqGateway(api_key, backend=MockGroqClient(api_key))
         self.model = "llama3-8b-8192"
         
     async def classify_intents(self, email_content: str, subject: str = "", 
@@ -153,8 +154,7 @@ class GroqService:
         
         # If no specific templates found, get all auto_response templates
         if not templates:
-            all_templates = await db_service.get_templates()
-            templates = [t for t in all_templates if t.get("type") == "auto_response"]
+            templates = await db_service.get_templates_by_type("auto_response")
         
         return templates
     
@@ -0,0 +1,257 @@
+"""
+IMAP Client Service - persistent, non-blocking IMAP sessions per provider with IDLE push notification
+"""
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import aioimaplib
+
+logger = logging.getLogger(__name__)
+
+UIDVALIDITY_RE = re.compile(rb"UIDVALIDITY (\d+)")
+UIDNEXT_RE = re.compile(rb"UIDNEXT (\d+)")
+FETCH_UID_RE = re.compile(rb"UID (\d+)")
+
+def _uid_set(uids: List[int]) -> str:
+    """Compress UIDs into an IMAP sequence set such as 1:3,7"""
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(start) if start == end else f"{start}:{end}" for start, end in ranges)
+
+class IMAPClientError(Exception):
+    """Raised when the IMAP server rejects a command"""
+
+class IMAPConnection:
+    """Authenticated IMAP session with the inbox selected, kept open between scans"""
+
+    def __init__(self, provider_config: Dict, timeout: int = 30):
+        self.provider_id = provider_config["id"]
+        self.signature = self.provider_signature(provider_config)
+        self.hostname, self.port, self.username, self.password = self.signature
+        self.timeout = timeout
+
+        self.client: Optional[aioimaplib.IMAP4_SSL] = None
+        self.supports_idle = False
+        self.uid_validity: Optional[int] = None
+        self.uid_next: Optional[int] = None
+        self.connected_at = None
+        self.connect_count = 0
+        self.idle_wakeups = 0
+
+    @staticmethod
+    def provider_signature(provider_config: Dict) -> Tuple:
+        """Connection settings that require a new session when they change"""
+        return (
+            provider_config["imap_host"],
+            int(provider_config.get("imap_port") or 993),
+            provider_config["imap_username"],
+            provider_config["imap_password"]
+        )
+
+    @property
+    def is_connected(self) -> bool:
+        """Whether the session is logged in with the inbox selected"""
+        return self.client is not None and self.client.get_state() == "SELECTED"
+
+    def _check(self, response, command: str):
+        """Raise if a command did not complete with OK"""
+        if response.result != "OK":
+            detail = b" ".join(line for line in response.lines if isinstance(line, bytes)).decode(errors="ignore")
+            raise IMAPClientError(f"IMAP {command} failed: {detail}")
+
+    async def connect(self):
+        """Open, authenticate and select the inbox"""
+        await self.close()
+
+        client = aioimaplib.IMAP4_SSL(host=self.hostname, port=self.port, timeout=self.timeout)
+        try:
+            await client.wait_hello_from_server()
+            self._check(await client.login(self.username, self.password), "LOGIN")
+            selected = await client.select("INBOX")
+            self._check(selected, "SELECT")
+        except Exception:
+            await self._logout(client)
+            raise
+
+        select_lines = b" ".join(line for line in selected.lines if isinstance(line, bytes))
+        uid_validity = UIDVALIDITY_RE.search(select_lines)
+        uid_next = UIDNEXT_RE.search(select_lines)
+        self.uid_validity = int(uid_validity.group(1)) if uid_validity else None
+        self.uid_next = int(uid_next.group(1)) if uid_next else None
+
+        self.client = client
+        self.supports_idle = client.has_capability("IDLE")
+        self.connected_at = datetime.utcnow()
+        self.connect_count += 1
+        logger.info(f"Opened IMAP session for provider {self.provider_id} ({self.hostname}:{self.port}, "
+                    f"IDLE {'supported' if self.supports_idle else 'not supported'})")
+
+    async def ensure_connected(self):
+        """Reconnect if the session was dropped"""
+        if not self.is_connected:
+            await self.connect()
+
+    async def _uid_search(self, *criteria: str) -> List[int]:
+        """Run UID SEARCH and return the matching UIDs"""
+        await self.ensure_connected()
+        response = await self.client.uid_search(*criteria, charset=None)
+        self._check(response, "UID SEARCH")
+        return [int(uid) for uid in response.lines[0].split()] if response.lines else []
+
+    async def search_unseen_uids(self) -> List[int]:
+        """Get UIDs of unread inbox messages"""
+        return await self._uid_search("UNSEEN")
+
+    async def search_uids_after(self, last_uid: int) -> List[int]:
+        """Get UIDs of messages that arrived after the given high-water mark"""
+        uids = await self._uid_search("UID", f"{last_uid + 1}:*")
+        # "n:*" always matches the newest message, even when its UID is below n
+        return sorted(uid for uid in uids if uid > last_uid)
+
+    async def fetch_messages(self, uids: List[int]) -> Dict[int, bytes]:
+        """Fetch the raw bytes of many messages in one UID FETCH, without setting \\Seen"""
+        if not uids:
+            return {}
+        await self.ensure_connected()
+        response = await self.client.uid("fetch", _uid_set(uids), "(UID BODY.PEEK[])")
+        self._check(response, "UID FETCH")
+
+        # Each message is a "* n FETCH (UID u BODY[] {size}" line followed by the literal;
+        # some servers send the UID after the literal instead
+        messages = {}
+        uid, body = None, None
+        for line in response.lines:
+            if isinstance(line, bytearray):
+                body = bytes(line)
+            else:
+                if b"FETCH (" in line:
+                    uid, body = None, None
+                match = FETCH_UID_RE.search(line)
+                if match:
+                    uid = int(match.group(1))
+            if uid is not None and body is not None:
+                messages[uid] = body
+                uid, body = None, None
+        return messages
+
+    async def mark_seen(self, uids: List[int]):
+        """Flag messages as read"""
+        if not uids:
+            return
+        await self.ensure_connected()
+        response = await asyncio.wait_for(
+            self.client.uid("store", _uid_set(uids), "+FLAGS", "(\\Seen)"), self.timeout  # UID STORE has no built-in timeout
+        )
+        self._check(response, "UID STORE")
+
+    async def wait_for_new_mail(self, timeout: float) -> bool:
+        """Block in IDLE until the server announces new mail or the timeout passes"""
+        await self.ensure_connected()
+        if not self.supports_idle:
+            raise IMAPClientError("Server does not support IDLE")
+
+        idle = await self.client.idle_start(timeout=timeout)
+        try:
+            push = await self.client.wait_server_push(timeout=timeout + self.timeout)
+        finally:
+            if self.client is not None and self.client.has_pending_idle():
+                self.client.idle_done()
+                await asyncio.wait_for(idle, self.timeout)
+
+        if push == aioimaplib.STOP_WAIT_SERVER_PUSH:
+            return False
+
+        self.idle_wakeups += 1
+        return any(b"EXISTS" in line for line in push if isinstance(line, (bytes, bytearray)))
+
+    async def _logout(self, client: aioimaplib.IMAP4_SSL):
+        """Log out, ignoring errors from already-dropped sessions"""
+        try:
+            if client.has_pending_idle():
+                await client.stop_wait_server_push()
+                client.idle_done()
+            if client.get_state() in ("AUTH", "SELECTED"):
+                await client.logout()
+        except Exception:
+            pass
+        finally:
+            if client.protocol.transport is not None:
+                client.protocol.transport.close()
+
+    async def close(self):
+        """Close the session"""
+        client, self.client = self.client, None
+        if client is not None:
+            await self._logout(client)
+
+    def get_stats(self) -> Dict:
+        """Get connection statistics"""
+        return {
+            "provider_id": self.provider_id,
+            "connected": self.is_connected,
+            "supports_idle": self.supports_idle,
+            "uid_validity": self.uid_validity,
+            "connected_at": self.connected_at.isoformat() if self.connected_at else None,
+            "connect_count": self.connect_count,
+            "idle_wakeups": self.idle_wakeups
+        }
+
+class IMAPClientService:
+    """Keeps one persistent IMAP session per monitored provider"""
+
+    def __init__(self):
+        self.timeout = int(os.getenv("IMAP_TIMEOUT", 30))
+        self.idle_timeout = int(os.getenv("IMAP_IDLE_TIMEOUT", 1500))  # Re-issue IDLE before the 29 minute server cutoff
+        self.poll_min_interval = int(os.getenv("IMAP_POLL_MIN_INTERVAL", 10))
+        self.poll_max_interval = int(os.getenv("IMAP_POLL_MAX_INTERVAL", 120))
+        self.fetch_batch_size = int(os.getenv("IMAP_FETCH_BATCH_SIZE", 50))
+        self.connections: Dict[str, IMAPConnection] = {}
+
+    async def get_connection(self, provider_config: Dict) -> IMAPConnection:
+        """Get the connected session for a provider, replacing it if the IMAP settings changed"""
+        connection = self.connections.get(provider_config["id"])
+
+        if connection is None or connection.signature != IMAPConnection.provider_signature(provider_config):
+            if connection is not None:
+                logger.info(f"IMAP settings changed for provider {provider_config['id']}, reconnecting")
+                await connection.close()
+            connection = IMAPConnection(provider_config, self.timeout)
+            self.connections[provider_config["id"]] = connection
+
+        await connection.ensure_connected()
+        return connection
+
+    def next_poll_interval(self, current: Optional[float], found_new_emails: bool) -> float:
+        """Polling fallback: scan again soon after mail arrives, back off while the inbox is quiet"""
+        if found_new_emails or current is None:
+            return self.poll_min_interval
+        return min(current * 2, self.poll_max_interval)
+
+    async def close_provider(self, provider_id: str):
+        """Close and forget the session for a provider"""
+        connection = self.connections.pop(provider_id, None)
+        if connection:
+            await connection.close()
+
+    async def close_all(self):
+        """Close every session"""
+        for provider_id in list(self.connections.keys()):
+            await self.close_provider(provider_id)
+
+    def get_stats(self) -> Dict:
+        """Get statistics for all provider sessions"""
+        return {
+            "idle_timeout": self.idle_timeout,
+            "poll_interval_range": [self.poll_min_interval, self.poll_max_interval],
+            "connections": [connection.get_stats() for connection in self.connections.values()]
+        }
+
+# Create global IMAP client service instance
+imap_client_service = IMAPClientService()
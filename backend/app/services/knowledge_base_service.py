@@ -5,6 +5,8 @@ import logging
 import json
 from app.models import KnowledgeBase
 from app.services.database import db_service
+from app.services.knowledge_index_service import knowledge_index_service
+from app.utils.bm25_index import STOP_WORDS
 from app.utils.helpers import generate_id
 
 logger = logging.getLogger(__name__)
@@ -23,6 +25,7 @@ class KnowledgeBaseService:
             "case_studies",
             "testimonials"
         ]
+        self.min_relevance = float(os.getenv("KNOWLEDGE_MIN_RELEVANCE", 0.2))  # Share of the best possible score
     
     async def create_knowledge_article(self, article_data: Dict) -> Tuple[Optional[str], Optional[str]]:
         """Create a new knowledge base article"""
@@ -40,12 +43,13 @@ class KnowledgeBaseService:
             if not article_data.get("keywords"):
                 article_data["keywords"] = await self._extract_keywords(article_data["content"])
             
-            # Generate embedding vector (placeholder for now - would use actual embedding service)
-            article_data["embedding_vector"] = await self._generate_embedding(article_data["content"])
+            # Model defaults are evaluated once at import, so stamp the real times
+            article_data["created_at"] = article_data["updated_at"] = datetime.utcnow()
             
             # Save to database
             result = await db_service.create_knowledge_article(article_data)
             if result:
+                await knowledge_index_service.upsert(article_data)
                 return article_id, None
             else:
                 return None, "Failed to save knowledge article"
@@ -87,13 +91,14 @@ class KnowledgeBaseService:
             if "content" in article_data and not article_data.get("keywords"):
                 article_data["keywords"] = await self._extract_keywords(article_data["content"])
             
-            # Regenerate embedding if content changed
-            if "content" in article_data:
-                article_data["embedding_vector"] = await self._generate_embedding(article_data["content"])
-            
             # Update in database
             article_data["updated_at"] = datetime.utcnow()
             result = await db_service.update_knowledge_article(article_id, article_data)
+            
+            # Reindex the stored article, since article_data may only hold the changed fields
+            article = await db_service.get_knowledge_article_by_id(article_id)
+            if article:
+                await knowledge_index_service.upsert(article)
             return bool(result), None
             
         except Exception as e:
@@ -104,6 +109,7 @@ class KnowledgeBaseService:
         """Delete a knowledge article"""
         try:
             result = await db_service.delete_knowledge_article(article_id)
+            await knowledge_index_service.remove(article_id)
             return bool(result), None
         except Exception as e:
             logger.error(f"Error deleting knowledge article {article_id}: {str(e)}")
@@ -111,17 +117,27 @@ class KnowledgeBaseService:
     
     async def search_knowledge_articles(self, query: str, category: str = None, 
                                       limit: int = 10) -> List[Dict]:
-        """Search knowledge articles by query"""
+        """Search active knowledge articles by query, best match first with a 0-1 relevance_score.
+
+        A blank query browses the articles of the category (or all articles) instead.
+        """
         try:
-            # Simple text search for now - would use vector search in production
-            articles = await db_service.search_knowledge_articles(query, category, limit)
-            
-            # Sort by relevance (placeholder scoring)
-            for article in articles:
-                article["relevance_score"] = await self._calculate_relevance_score(article, query)
-            
-            articles.sort(key=lambda x: x.get("relevance_score", 0), reverse=True)
-            return articles
+            if not (query or "").strip():
+                return await db_service.list_knowledge_articles(category, limit)
+            
+            matches = await knowledge_index_service.search(query, category, limit)
+            if not matches:
+                return []
+            
+            articles = await db_service.get_knowledge_articles_by_ids([article_id for article_id, _ in matches])
+            articles_by_id = {article["id"]: article for article in articles}
+            results = []
+            for article_id, score in matches:
+                article = articles_by_id.get(article_id)
+                if article:
+                    article["relevance_score"] = round(score, 4)
+                    results.append(article)
+            return results
             
         except Exception as e:
             logger.error(f"Error searching knowledge articles: {str(e)}")
@@ -138,7 +154,7 @@ class KnowledgeBaseService:
             # Filter and rank by relevance to intent
             relevant_articles = []
             for article in articles:
-                if article.get("relevance_score", 0) > 0.3:  # Threshold for relevance
+                if article.get("relevance_score", 0) > self.min_relevance:
                     relevant_articles.append(article)
             
             return relevant_articles
@@ -185,6 +201,14 @@ class KnowledgeBaseService:
             logger.error(f"Error getting knowledge for personalization: {str(e)}")
             return []
     
+    async def score_article_relevance(self, article_id: str, query: str) -> float:
+        """Relevance of an article for a query on the same 0-1 scale as search results"""
+        try:
+            return round(await knowledge_index_service.score(query, article_id), 4)
+        except Exception as e:
+            logger.error(f"Error scoring knowledge article {article_id}: {str(e)}")
+            return 0.0
+    
     async def get_knowledge_categories(self) -> List[str]:
         """Get all available knowledge categories"""
         return self.categories
@@ -222,20 +246,11 @@ class KnowledgeBaseService:
             # Simple keyword extraction - would use NLP in production
             words = content.lower().split()
             
-            # Remove common stop words
-            stop_words = {
-                "the", "is", "at", "which", "on", "and", "a", "to", "are", "as", "was", "with",
-                "for", "his", "her", "that", "of", "in", "it", "you", "i", "will", "be", "can",
-                "have", "has", "had", "do", "does", "did", "would", "could", "should", "may",
-                "might", "must", "shall", "will", "am", "is", "are", "was", "were", "being",
-                "been", "have", "has", "had", "do", "does", "did", "get", "got", "make", "made"
-            }
-            
             # Filter and count words
             word_count = {}
             for word in words:
                 word = word.strip(".,!?;:()[]{}\"'")
-                if len(word) > 3 and word not in stop_words:
+                if len(word) > 3 and word not in STOP_WORDS:
                     word_count[word] = word_count.get(word, 0) + 1
             
             # Get top keywords
@@ -246,64 +261,6 @@ class KnowledgeBaseService:
             logger.error(f"Error extracting keywords: {str(e)}")
             return []
     
-    async def _generate_embedding(self, content: str) -> List[float]:
-        """Generate embedding vector for content"""
-        try:
-            # Placeholder for actual embedding generation
-            # In production, this would use services like OpenAI embeddings, SentenceTransformers, etc.
-            # For now, return a simple hash-based vector
-            import hashlib
-            
-            hash_obj = hashlib.md5(content.encode())
-            hash_hex = hash_obj.hexdigest()
-            
-            # Convert hash to float vector (simplified)
-            vector = []
-            for i in range(0, len(hash_hex), 2):
-                vector.append(float(int(hash_hex[i:i+2], 16)) / 255.0)
-            
-            # Pad or truncate to 128 dimensions
-            while len(vector) < 128:
-                vector.append(0.0)
-            
-            return vector[:128]
-            
-        except Exception as e:
-            logger.error(f"Error generating embedding: {str(e)}")
-            return [0.0] * 128
-    
-    async def _calculate_relevance_score(self, article: Dict, query: str) -> float:
-        """Calculate relevance score for an article"""
-        try:
-            score = 0.0
-            query_lower = query.lower()
-            
-            # Title match
-            if query_lower in article["title"].lower():
-                score += 0.5
-            
-            # Content match
-            content_lower = article["content"].lower()
-            query_words = query_lower.split()
-            word_matches = sum(1 for word in query_words if word in content_lower)
-            score += (word_matches / len(query_words)) * 0.3
-            
-            # Keywords match
-            keywords = article.get("keywords", [])
-            keyword_matches = sum(1 for word in query_words if word in [kw.lower() for kw in keywords])
-            if keywords:
-                score += (keyword_matches / len(keywords)) * 0.2
-            
-            # Category bonus
-            if article.get("category") and article["category"].lower() in query_lower:
-                score += 0.1
-            
-            return min(score, 1.0)  # Cap at 1.0
-            
-        except Exception as e:
-            logger.error(f"Error calculating relevance score: {str(e)}")
-            return 0.0
-    
     async def _update_usage_count(self, article_id: str):
         """Update usage count for an article"""
         try:
@@ -0,0 +1,163 @@
+"""
+Knowledge Index Service - in-memory BM25 search over knowledge base articles
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from app.services.database import db_service
+from app.utils.bm25_index import BM25Index, tokenize
+
+logger = logging.getLogger(__name__)
+
+TITLE_WEIGHT = 3  # A title term counts as often as this many body occurrences
+
+def article_terms(article: Dict) -> Counter:
+    """Term counts of an article's title, content, keywords, tags and category"""
+    counts = Counter(tokenize(article.get("content") or ""))
+    for token in tokenize(article.get("title") or ""):
+        counts[token] += TITLE_WEIGHT
+    for value in (article.get("keywords") or []) + (article.get("tags") or []) + [article.get("category") or ""]:
+        counts.update(tokenize(str(value)))
+    return counts
+
+class KnowledgeIndexService:
+    """Keeps every knowledge article in a BM25Index, loaded from Mongo on first use and updated in place.
+
+    Article changes made through this process are applied immediately. Other processes, such as
+    the email workers, poll for articles updated since their last sync at most every
+    KNOWLEDGE_INDEX_SYNC_SECONDS and reload when the article count shows a deletion they missed.
+    Once enough changes pile up outside the main segment, it is rebuilt in a worker thread.
+    """
+
+    def __init__(self):
+        self.k1 = float(os.getenv("KNOWLEDGE_BM25_K1", 1.2))
+        self.b = float(os.getenv("KNOWLEDGE_BM25_B", 0.75))
+        self.sync_interval = float(os.getenv("KNOWLEDGE_INDEX_SYNC_SECONDS", 30))
+        self.compact_rows = int(os.getenv("KNOWLEDGE_INDEX_COMPACT_ROWS", 1000))
+        self.index: Optional[BM25Index] = None
+        self._versions: Dict[str, Optional[datetime]] = {}  # Article id -> updated_at it was indexed at
+        self._synced_through: Optional[datetime] = None
+        self._synced_at = 0.0
+        self._lock = asyncio.Lock()
+        self._compaction: Optional[asyncio.Task] = None
+        self._warm_up: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _index_chunk(index: BM25Index, articles: List[Dict]):
+        """Tokenize and add a chunk of articles"""
+        for article in articles:
+            index.add(article["id"], article_terms(article), article.get("category"), article.get("is_active", True))
+
+    async def _load(self):
+        """Build a fresh index from every article; the current one keeps serving until it is ready"""
+        started = time.monotonic()
+        index = BM25Index(self.k1, self.b)
+        versions = {}
+        async for chunk in db_service.iter_knowledge_articles(batch_size=1000):
+            await asyncio.to_thread(self._index_chunk, index, chunk)  # The new index is not shared yet
+            versions.update((article["id"], article.get("updated_at")) for article in chunk)
+        await asyncio.to_thread(index.compact)
+        self.index, self._versions = index, versions
+        self._synced_through = max((v for v in versions.values() if isinstance(v, datetime)), default=None)
+        self._synced_at = time.monotonic()
+        logger.info(f"Knowledge index loaded {index.live_count} articles in {time.monotonic() - started:.2f}s")
+
+    async def _sync(self):
+        """Apply articles changed by other processes since the last sync"""
+        query = {"updated_at": {"$gte": self._synced_through}} if self._synced_through else {}
+        async for chunk in db_service.iter_knowledge_articles(query, batch_size=1000):
+            for article in chunk:
+                if self._versions.get(article["id"], False) != article.get("updated_at"):
+                    self._apply(article)
+        if await db_service.count_knowledge_articles() != len(self._versions):
+            await self._load()  # Deleted elsewhere, or written without updated_at
+        self._synced_at = time.monotonic()
+
+    def _apply(self, article: Dict):
+        """Index a new or changed article"""
+        self.index.add(article["id"], article_terms(article), article.get("category"), article.get("is_active", True))
+        updated_at = self._versions[article["id"]] = article.get("updated_at")
+        if isinstance(updated_at, datetime) and (self._synced_through is None or updated_at > self._synced_through):
+            self._synced_through = updated_at
+
+    async def _ready(self) -> BM25Index:
+        """The loaded index, synced with Mongo when the last sync is older than sync_interval"""
+        if self.index is None or time.monotonic() - self._synced_at >= self.sync_interval:
+            async with self._lock:
+                await db_service.connect()
+                if self.index is None:
+                    await self._load()
+                elif time.monotonic() - self._synced_at >= self.sync_interval:
+                    await self._sync()
+        return self.index
+
+    async def _compact(self):
+        """Fold pending changes into the main segment off the event loop"""
+        async with self._lock:
+            index = self.index
+            started = time.monotonic()
+            await asyncio.to_thread(index.compact)
+            logger.info(f"Knowledge index compacted {index.live_count} articles in {time.monotonic() - started:.2f}s")
+
+    def _schedule_compaction(self):
+        """Start a compaction when enough changes are pending and none is running"""
+        index = self.index
+        if index is None or index.pending <= max(self.compact_rows, index.live_count // 20):
+            return
+        if self._compaction is None or self._compaction.done():
+            self._compaction = asyncio.create_task(self._compact())
+
+    async def _load_in_background(self):
+        """Load the index, logging instead of raising since nobody awaits the result"""
+        try:
+            await self._ready()
+        except Exception as e:
+            logger.error(f"Knowledge index warm-up failed: {str(e)}")
+
+    def warm_up(self):
+        """Start loading the index so the first search does not wait for it"""
+        if self.index is None and self._warm_up is None:
+            self._warm_up = asyncio.create_task(self._load_in_background())
+
+    async def search(self, query: str, category: str = None, limit: int = 10,
+                     active_only: bool = True) -> List[Tuple[str, float]]:
+        """Best matching article ids with relevance scores between 0 and 1"""
+        index = await self._ready()
+        results = index.search(query, limit, category, active_only)
+        self._schedule_compaction()
+        return results
+
+    async def score(self, query: str, article_id: str) -> float:
+        """Relevance of one article for a query"""
+        index = await self._ready()
+        return index.score(query, article_id)
+
+    async def upsert(self, article: Dict):
+        """Index a created or updated article; a no-op until the index is first loaded"""
+        if self.index is None:
+            return
+        async with self._lock:
+            self._apply(article)
+        self._schedule_compaction()
+
+    async def remove(self, article_id: str):
+        """Drop a deleted article from the index"""
+        if self.index is None:
+            return
+        async with self._lock:
+            self.index.remove(article_id)
+            self._versions.pop(article_id, None)
+        self._schedule_compaction()
+
+    def get_stats(self) -> Dict:
+        """Get index statistics"""
+        if self.index is None:
+            return {"loaded": False}
+        return {"loaded": True, **self.index.get_stats()}
+
+# Create global knowledge index service instance
+knowledge_index_service = KnowledgeIndexService()
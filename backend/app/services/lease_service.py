@@ -0,0 +1,115 @@
+"""
+Lease Service - Mongo-backed named leases with heartbeats, so one worker at a time owns a piece of background work
+"""
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+from app.services.database import db_service
+
+logger = logging.getLogger(__name__)
+
+class LeaseService:
+    """Acquires, renews and releases leases for this process"""
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.ttl = int(os.getenv("LEASE_TTL", 30))
+        self.heartbeat_interval = int(os.getenv("LEASE_HEARTBEAT_INTERVAL", 10))
+        self.held: Dict[str, datetime] = {}  # name -> expires_at
+        self.on_lost: Dict[str, Callable[[], Awaitable]] = {}
+        self.lost_count = 0
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    async def _ensure_started(self):
+        """Make sure the unique lease index exists and start heartbeating on first use"""
+        await db_service.ensure_indexes()
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def acquire(self, name: str, on_lost: Callable[[], Awaitable] = None) -> bool:
+        """Take or renew a lease; returns False while another live worker holds it"""
+        await self._ensure_started()
+        expires_at = await db_service.acquire_lease(name, self.worker_id, self.ttl)
+        if expires_at is None:
+            self.held.pop(name, None)
+            self.on_lost.pop(name, None)
+            return False
+
+        if name not in self.held:
+            logger.info(f"Worker {self.worker_id} acquired lease {name}")
+        self.held[name] = expires_at
+        if on_lost:
+            self.on_lost[name] = on_lost
+        return True
+
+    def is_held(self, name: str) -> bool:
+        """Whether this worker holds an unexpired lease"""
+        expires_at = self.held.get(name)
+        return expires_at is not None and expires_at > datetime.utcnow()
+
+    async def release(self, name: str):
+        """Give a lease up so another worker can take it immediately"""
+        self.on_lost.pop(name, None)
+        if self.held.pop(name, None) is not None:
+            try:
+                await db_service.release_lease(name, self.worker_id)
+                logger.info(f"Worker {self.worker_id} released lease {name}")
+            except Exception as e:
+                logger.error(f"Error releasing lease {name}: {str(e)}")
+
+    async def _heartbeat_loop(self):
+        """Renew every held lease well before it expires"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            for name in list(self.held.keys()):
+                if name not in self.held:
+                    continue  # Released while an earlier renewal was in flight
+                try:
+                    expires_at = await db_service.acquire_lease(name, self.worker_id, self.ttl)
+                except Exception as e:
+                    # Keep the lease until it actually expires; the next heartbeat retries
+                    logger.error(f"Error renewing lease {name}: {str(e)}")
+                    expires_at = self.held.get(name) if self.is_held(name) else None
+
+                if expires_at is not None:
+                    if name in self.held:
+                        self.held[name] = expires_at
+                    continue
+
+                logger.warning(f"Worker {self.worker_id} lost lease {name}")
+                self.held.pop(name, None)
+                self.lost_count += 1
+                callback = self.on_lost.pop(name, None)
+                if callback:
+                    try:
+                        await callback()
+                    except Exception as e:
+                        logger.error(f"Error handling lost lease {name}: {str(e)}")
+
+    async def stop(self):
+        """Stop heartbeating and release every held lease"""
+        task, self._heartbeat_task = self._heartbeat_task, None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for name in list(self.held.keys()):
+            await self.release(name)
+
+    def get_stats(self) -> Dict:
+        """Get the leases this worker holds"""
+        return {
+            "worker_id": self.worker_id,
+            "ttl_seconds": self.ttl,
+            "heartbeat_interval": self.heartbeat_interval,
+            "held": {name: expires_at.isoformat() for name, expires_at in self.held.items()},
+            "lost_count": self.lost_count
+        }
+
+# Create global lease service instance
+lease_service = LeaseService()
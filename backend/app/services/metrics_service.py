@@ -0,0 +1,214 @@
+"""
+Metrics Service - dashboard and analytics figures computed by MongoDB aggregations, cached briefly
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List
+from app.services.database import db_service
+from app.utils.cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+SENT_STATUSES = ["sent", "delivered"]
+
+def _count_if_set(field: str) -> Dict:
+    """$sum expression counting documents where a field is present and not null"""
+    return {"$sum": {"$cond": [{"$ifNull": [f"${field}", False]}, 1, 0]}}
+
+def _rate(part: int, total: int) -> float:
+    """Percentage rounded to one decimal"""
+    return round(part / total * 100, 1) if total else 0.0
+
+class MetricsService:
+    """Counts with count_documents/$facet instead of loading collections, shared by HTTP and WebSocket callers"""
+
+    def __init__(self):
+        self.ttl = float(os.getenv("METRICS_CACHE_TTL", 10))
+        self.top_campaigns_limit = int(os.getenv("METRICS_TOP_CAMPAIGNS", 5))
+        self.cache = LRUTTLCache(max_size=16, ttl=self.ttl)
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def _cached(self, name: str, compute: Callable[[], Awaitable[Dict]], force: bool = False) -> Dict:
+        """Return a cached result, computing it once for all concurrent callers when stale"""
+        if not force:
+            value = self.cache.get(name)
+            if value is not None:
+                return value
+
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            value = None if force else self.cache.get(name)
+            if value is None:
+                await db_service.connect()
+                value = await compute()
+                self.cache.set(name, value)
+            return value
+
+    async def _email_totals(self, since: datetime) -> Dict:
+        """Email counts overall and since a point in time, in a single aggregation"""
+        result = await db_service.db.emails.aggregate([
+            {"$facet": {
+                "totals": [
+                    {"$match": {"status": {"$in": SENT_STATUSES}}},
+                    {"$group": {
+                        "_id": None,
+                        "sent": {"$sum": 1},
+                        "opened": _count_if_set("opened_at"),
+                        "replied": _count_if_set("replied_at")
+                    }}
+                ],
+                "today": [
+                    {"$match": {"sent_at": {"$gte": since}}},
+                    {"$count": "count"}
+                ]
+            }}
+        ]).to_list(length=1)
+        facets = result[0] if result else {}
+        totals = (facets.get("totals") or [{}])[0]
+        return {
+            "sent": totals.get("sent", 0),
+            "opened": totals.get("opened", 0),
+            "replied": totals.get("replied", 0),
+            "today": (facets.get("today") or [{}])[0].get("count", 0)
+        }
+
+    async def _campaign_counts(self, month_start: datetime) -> Dict:
+        """Total, active and this month's campaigns in a single aggregation"""
+        result = await db_service.db.campaigns.aggregate([
+            {"$facet": {
+                "total": [{"$count": "count"}],
+                "active": [{"$match": {"status": "active"}}, {"$count": "count"}],
+                "this_month": [{"$match": {"created_at": {"$gte": month_start}}}, {"$count": "count"}]
+            }}
+        ]).to_list(length=1)
+        facets = result[0] if result else {}
+        return {name: (facets.get(name) or [{}])[0].get("count", 0) for name in ["total", "active", "this_month"]}
+
+    async def _top_campaigns(self) -> List[Dict]:
+        """Campaigns with the best reply and open rates over their sent emails"""
+        stats = await db_service.db.emails.aggregate([
+            {"$match": {"status": {"$in": SENT_STATUSES}, "campaign_id": {"$nin": [None, ""]}}},
+            {"$group": {
+                "_id": "$campaign_id",
+                "sent": {"$sum": 1},
+                "opened": _count_if_set("opened_at"),
+                "replied": _count_if_set("replied_at")
+            }},
+            {"$addFields": {
+                "reply_ratio": {"$divide": ["$replied", "$sent"]},
+                "open_ratio": {"$divide": ["$opened", "$sent"]}
+            }},
+            {"$sort": {"reply_ratio": -1, "open_ratio": -1, "sent": -1}},
+            {"$limit": self.top_campaigns_limit}
+        ]).to_list(length=self.top_campaigns_limit)
+
+        names = {
+            campaign["id"]: campaign.get("name", "")
+            async for campaign in db_service.db.campaigns.find(
+                {"id": {"$in": [stat["_id"] for stat in stats]}}, {"_id": 0, "id": 1, "name": 1}
+            )
+        }
+        return [
+            {
+                "campaign_id": stat["_id"],
+                "name": names.get(stat["_id"], stat["_id"]),
+                "emails_sent": stat["sent"],
+                "open_rate": _rate(stat["opened"], stat["sent"]),
+                "reply_rate": _rate(stat["replied"], stat["sent"])
+            }
+            for stat in stats
+        ]
+
+    async def _compute_dashboard_metrics(self) -> Dict:
+        """Overview counts, provider usage and the latest sends"""
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        total_prospects, campaigns, emails, providers, recent_emails = await asyncio.gather(
+            db_service.db.prospects.count_documents({}),
+            self._campaign_counts(today.replace(day=1)),
+            self._email_totals(today),
+            db_service.db.email_providers.find(
+                {}, {"_id": 0, "name": 1, "provider_type": 1, "is_active": 1, "current_daily_count": 1, "daily_send_limit": 1}
+            ).to_list(length=None),
+            db_service.db.emails.find(
+                {"status": {"$in": SENT_STATUSES + ["failed"]}},
+                {"_id": 0, "id": 1, "subject": 1, "recipient_email": 1, "status": 1, "sent_at": 1},
+                sort=[("sent_at", -1)]
+            ).limit(5).to_list(length=5)
+        )
+
+        return {
+            "overview": {
+                "total_prospects": total_prospects,
+                "total_campaigns": campaigns["total"],
+                "total_emails_sent": emails["sent"],
+                "emails_today": emails["today"],
+                "active_campaigns": campaigns["active"]
+            },
+            "provider_stats": {
+                provider.get("name", ""): {
+                    "type": provider.get("provider_type", ""),
+                    "status": "active" if provider.get("is_active") else "inactive",
+                    "emails_sent_today": provider.get("current_daily_count", 0),
+                    "daily_limit": provider.get("daily_send_limit", 500)
+                }
+                for provider in providers
+            },
+            "recent_activity": [
+                {
+                    "id": email.get("id", ""),
+                    "subject": email.get("subject", ""),
+                    "recipient": email.get("recipient_email", ""),
+                    "status": email.get("status", ""),
+                    "created_at": (email.get("sent_at") or datetime.utcnow()).isoformat()
+                }
+                for email in recent_emails
+            ],
+            "last_updated": datetime.utcnow().isoformat()
+        }
+
+    async def _compute_overall_analytics(self) -> Dict:
+        """Totals, open/reply rates and top campaigns across all sent email"""
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        month_start = today.replace(day=1)
+        total_prospects, prospects_this_month, campaigns, emails, top_campaigns = await asyncio.gather(
+            db_service.db.prospects.count_documents({}),
+            db_service.db.prospects.count_documents({"created_at": {"$gte": month_start}}),
+            self._campaign_counts(month_start),
+            self._email_totals(today),
+            self._top_campaigns()
+        )
+
+        return {
+            "total_campaigns": campaigns["total"],
+            "active_campaigns": campaigns["active"],
+            "total_emails_sent": emails["sent"],
+            "emails_today": emails["today"],
+            "total_prospects": total_prospects,
+            "average_open_rate": _rate(emails["opened"], emails["sent"]),
+            "average_reply_rate": _rate(emails["replied"], emails["sent"]),
+            "campaigns_this_month": campaigns["this_month"],
+            "prospects_this_month": prospects_this_month,
+            "top_performing_campaigns": top_campaigns,
+            "last_updated": datetime.utcnow().isoformat()
+        }
+
+    async def get_dashboard_metrics(self, force: bool = False) -> Dict[str, Any]:
+        """Get dashboard metrics, at most METRICS_CACHE_TTL seconds old"""
+        return await self._cached("dashboard_metrics", self._compute_dashboard_metrics, force)
+
+    async def get_overall_analytics(self, force: bool = False) -> Dict[str, Any]:
+        """Get overall analytics, at most METRICS_CACHE_TTL seconds old"""
+        return await self._cached("overall_analytics", self._compute_overall_analytics, force)
+
+    def invalidate(self):
+        """Drop cached metrics so the next caller recomputes them"""
+        self.cache.clear()
+
+    def get_stats(self) -> Dict:
+        """Get metrics cache statistics"""
+        return self.cache.get_stats()
+
+# Create global metrics service instance
+metrics_service = MetricsService()
@@ -0,0 +1,123 @@
+"""
+Prospect Import Service - streams CSV rows into prospects in validated, bulk-written chunks
+"""
+import asyncio
+import csv
+import io
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from itertools import islice
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from app.services.database import db_service
+from app.utils.helpers import generate_id
+
+logger = logging.getLogger(__name__)
+
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+# Columns stored as prospect fields; any other column goes into additional_fields
+PROSPECT_COLUMNS = [
+    "email", "first_name", "last_name", "company", "phone", "linkedin_url", "company_domain",
+    "industry", "company_linkedin_url", "job_title", "location", "company_size",
+    "annual_revenue", "lead_source", "status"
+]
+
+class ProspectImportService:
+    """Imports large CSV files without a per-row duplicate check or round trip"""
+
+    def __init__(self):
+        self.chunk_size = int(os.getenv("PROSPECT_IMPORT_CHUNK_SIZE", 1000))
+        self.max_reported_errors = int(os.getenv("PROSPECT_IMPORT_MAX_ERRORS", 1000))
+
+    def _build_prospect(self, row: Dict[str, str], now: datetime) -> Tuple[Optional[Dict], Optional[str]]:
+        """Prospect document for a CSV row, or the reason the row is invalid"""
+        email = (row.get("email") or "").strip()
+        if not EMAIL_PATTERN.match(email):
+            return None, f"Invalid email '{email}'" if email else "Missing email"
+
+        prospect = {column: (row.get(column) or "").strip() for column in PROSPECT_COLUMNS}
+        prospect.update({
+            "id": generate_id(),
+            "email": email,
+            "status": prospect["status"] or "active",
+            "list_ids": [],
+            "tags": [],
+            "additional_fields": {
+                column: (value or "").strip() for column, value in row.items()
+                if column and column not in PROSPECT_COLUMNS
+            },
+            "campaign_id": "",
+            "last_contact": None,
+            "follow_up_status": "active",
+            "follow_up_count": 0,
+            "last_follow_up": None,
+            "responded_at": None,
+            "response_type": "",
+            "created_at": now,
+            "updated_at": now
+        })
+        return prospect, None
+
+    async def import_csv(self, csv_file: BinaryIO, list_id: str = None) -> Dict:
+        """Parse and insert a CSV file chunk by chunk; returns counts and per-row failures"""
+        started = time.monotonic()
+        text = io.TextIOWrapper(csv_file, encoding="utf-8-sig", errors="replace", newline="")
+        try:
+            reader = csv.DictReader(text)
+            fieldnames = await asyncio.to_thread(lambda: reader.fieldnames)
+            if not fieldnames or "email" not in fieldnames:
+                raise ValueError("CSV must contain an 'email' column")
+
+            summary = {"total_rows": 0, "inserted": 0, "duplicates": 0, "invalid": 0, "failed": 0, "errors": [],
+                       "duplicate_check": await db_service.has_unique_prospect_email_index()}
+            if not summary["duplicate_check"]:
+                logger.warning("Unique index on prospects.email is missing; this import cannot reject duplicate emails")
+            row_number = 1  # The header is line 1
+            while True:
+                # csv parsing is CPU bound, so each chunk is read off the event loop
+                rows = await asyncio.to_thread(lambda: list(islice(reader, self.chunk_size)))
+                if not rows:
+                    break
+
+                now = datetime.utcnow()
+                prospects: List[Dict] = []
+                prospect_rows: List[int] = []
+                for row in rows:
+                    row_number += 1
+                    prospect, error = self._build_prospect(row, now)
+                    if error:
+                        summary["invalid"] += 1
+                        self._report_error(summary, row_number, row.get("email"), error)
+                        continue
+                    if list_id:
+                        prospect["list_ids"] = [list_id]
+                    prospects.append(prospect)
+                    prospect_rows.append(row_number)
+
+                result = await db_service.bulk_insert_prospects(prospects)
+                summary["total_rows"] += len(rows)
+                summary["inserted"] += result["inserted"]
+                summary["duplicates"] += len(result["duplicates"])
+                summary["failed"] += len(result["errors"])
+                for index in result["duplicates"]:
+                    self._report_error(summary, prospect_rows[index], prospects[index]["email"], "Email already exists")
+                for error in result["errors"]:
+                    self._report_error(summary, prospect_rows[error["index"]], prospects[error["index"]]["email"], error["error"])
+        finally:
+            text.detach()  # Leave closing the upload to its owner
+
+        summary["duration_seconds"] = round(time.monotonic() - started, 2)
+        logger.info(f"Imported {summary['inserted']} of {summary['total_rows']} CSV rows in {summary['duration_seconds']}s "
+                    f"({summary['duplicates']} duplicates, {summary['invalid']} invalid, {summary['failed']} failed)")
+        return summary
+
+    def _report_error(self, summary: Dict, row_number: int, email: Optional[str], error: str):
+        """Record a failed row, keeping at most max_reported_errors of them"""
+        if len(summary["errors"]) < self.max_reported_errors:
+            summary["errors"].append({"row": row_number, "email": email, "error": error})
+
+# Create global prospect import service instance
+prospect_import_service = ProspectImportService()
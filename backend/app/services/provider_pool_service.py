@@ -0,0 +1,147 @@
+"""
+Provider Pool Service - spreads outbound sends over several email providers with failover
+"""
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from app.services.database import db_service
+from app.services.rate_limit_service import rate_limit_service
+from app.services.smtp_delivery_service import CONNECTION_ERROR, RECIPIENT_REFUSED_ERROR
+
+logger = logging.getLogger(__name__)
+
+MIN_OUTAGE_BATCH = 3  # Failing fewer sends than this may just be bad recipients
+
+class ProviderPoolService:
+    """Splits each batch across active providers by remaining quota, recent latency and error rate.
+
+    Latency and error rate are moving averages kept per process from send results. A provider whose
+    error rate passes PROVIDER_POOL_MAX_ERROR_RATE, or that fails a whole batch, is left out for
+    PROVIDER_POOL_COOLDOWN_SECONDS unless no other provider is left.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("CAMPAIGN_PROVIDER_POOL", "true").lower() == "true"
+        self.alpha = float(os.getenv("PROVIDER_POOL_EWMA_ALPHA", 0.3))
+        self.max_error_rate = float(os.getenv("PROVIDER_POOL_MAX_ERROR_RATE", 0.5))
+        self.cooldown_seconds = int(os.getenv("PROVIDER_POOL_COOLDOWN_SECONDS", 300))
+        self._stats: Dict[str, Dict] = {}
+
+    def _provider_stats(self, provider_id: str) -> Dict:
+        """Moving averages of a provider, created on first use"""
+        return self._stats.setdefault(provider_id, {
+            "latency": 0.0, "error_rate": 0.0, "sent": 0, "failed": 0, "cooldown_until": 0.0
+        })
+
+    def _weight(self, provider_id: str) -> float:
+        """Relative share of sends a provider should get per unit of free quota"""
+        stats = self._provider_stats(provider_id)
+        return (1.0 - stats["error_rate"]) / (1.0 + stats["latency"])
+
+    @staticmethod
+    def _apportion(count: int, capacity: Dict[str, int], weights: Dict[str, float]) -> Dict[str, int]:
+        """Split count sends in proportion to weighted free quota (highest averages), capped by the quota"""
+        shares = {provider_id: 0 for provider_id in capacity}
+        for _ in range(count):
+            open_providers = [provider_id for provider_id in capacity if shares[provider_id] < capacity[provider_id]]
+            if not open_providers:
+                break
+            best = max(open_providers, key=lambda provider_id: (
+                capacity[provider_id] * max(weights[provider_id], 0.01) / (shares[provider_id] + 1)
+            ))
+            shares[best] += 1
+        return {provider_id: share for provider_id, share in shares.items() if share}
+
+    async def allocate(self, count: int, provider_ids: List[str] = None) -> Dict:
+        """Reserve quota for count sends across the pool, or only the given providers.
+
+        Returns {"allocations": [(provider_id, granted)], "retry_after": seconds}; retry_after is
+        0 when everything was allocated, the wait until a provider has a free slot otherwise, and
+        None when no provider can ever take the rest.
+        """
+        providers = await db_service.get_active_email_providers(provider_ids)
+        now = time.monotonic()
+        usable = [p for p in providers if self._provider_stats(p["id"])["cooldown_until"] <= now] or providers
+
+        capacity = {}
+        next_slots = []
+        for provider in usable:
+            provider_capacity = rate_limit_service.get_capacity(provider)
+            capacity[provider["id"]] = provider_capacity["available"]
+            if provider_capacity["next_slot_seconds"] is not None:
+                next_slots.append(provider_capacity["next_slot_seconds"])
+
+        shares = self._apportion(count, capacity, {provider_id: self._weight(provider_id) for provider_id in capacity})
+
+        allocations = []
+        for provider_id, share in shares.items():
+            reservation = await rate_limit_service.reserve(provider_id, share)
+            if reservation["granted"]:
+                allocations.append((provider_id, reservation["granted"]))
+            if reservation["retry_after"] is not None:
+                next_slots.append(reservation["retry_after"])
+
+        allocated = sum(granted for _, granted in allocations)
+        if allocated >= count:
+            retry_after = 0.0
+        else:
+            retry_after = min([slot for slot in next_slots if slot > 0] or [1.0]) if next_slots else None
+        return {"allocations": allocations, "retry_after": retry_after}
+
+    def record_result(self, provider_id: str, sent: int, failed: int, seconds: float) -> bool:
+        """Fold a batch's outcome into the provider's latency and error rate; returns True if it was benched"""
+        attempted = sent + failed
+        if not attempted:
+            return False
+        stats = self._provider_stats(provider_id)
+        stats["sent"] += sent
+        stats["failed"] += failed
+        stats["latency"] += self.alpha * (seconds / attempted - stats["latency"])
+        stats["error_rate"] += self.alpha * (failed / attempted - stats["error_rate"])
+        # A batch where nothing got through means the mailbox itself is down, not the recipients
+        outage = not sent and attempted >= MIN_OUTAGE_BATCH
+        if stats["error_rate"] > self.max_error_rate or outage:
+            stats["cooldown_until"] = time.monotonic() + self.cooldown_seconds
+            logger.warning(f"Provider {provider_id} error rate {stats['error_rate']:.0%}"
+                           f"{' (whole batch failed)' if outage else ''}; "
+                           f"leaving it out of the pool for {self.cooldown_seconds}s")
+            return True
+        return False
+
+    @staticmethod
+    def is_provider_failure(results: List[Tuple[bool, Optional[str]]]) -> bool:
+        """Whether a provider's share failed because of the provider rather than its recipients.
+
+        True when nothing got through and either the share was big enough to count as an outage
+        or every send failed to connect. A refused recipient means the mailbox is working.
+        """
+        if not results or any(success for success, _ in results):
+            return False
+        errors = [error or "" for _, error in results]
+        if any(error.startswith(RECIPIENT_REFUSED_ERROR) for error in errors):
+            return False
+        return len(results) >= MIN_OUTAGE_BATCH or all(error.startswith(CONNECTION_ERROR) for error in errors)
+
+    async def has_available_provider(self, provider_ids: List[str] = None) -> bool:
+        """Whether any active provider is outside its cooldown to take over failed sends"""
+        now = time.monotonic()
+        providers = await db_service.get_active_email_providers(provider_ids)
+        return any(self._provider_stats(provider["id"])["cooldown_until"] <= now for provider in providers)
+
+    def get_stats(self) -> Dict:
+        """Get per-provider latency and error rate for this process"""
+        now = time.monotonic()
+        return {
+            provider_id: {
+                "latency_seconds": round(stats["latency"], 3),
+                "error_rate": round(stats["error_rate"], 3),
+                "sent": stats["sent"],
+                "failed": stats["failed"],
+                "cooling_down": stats["cooldown_until"] > now
+            }
+            for provider_id, stats in self._stats.items()
+        }
+
+# Create global provider pool service instance
+provider_pool_service = ProviderPoolService()
@@ -0,0 +1,172 @@
+"""
+Rate Limit Service - atomic token-bucket send quotas for email providers
+"""
+import logging
+import math
+import os
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+from app.services.database import db_service
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ERROR = "Rate limit exceeded"
+
+DEFAULT_HOURLY_LIMIT = 50
+DEFAULT_DAILY_LIMIT = 500
+
+class RateLimitService:
+    """Token buckets per provider: the hourly and daily limits refill continuously over a sliding hour and day.
+
+    Usage is stored on the provider as rate_limit = {hourly, daily, updated_at, version} and changed
+    with a compare-and-set on the version, so concurrent senders in any process can never reserve
+    more than the limits allow. The last state seen is kept in process, so a reservation usually
+    costs a single findOneAndUpdate; a lost race re-reads the provider and tries again.
+    """
+
+    def __init__(self):
+        self.max_attempts = int(os.getenv("RATE_LIMIT_MAX_ATTEMPTS", 5))
+        self._providers: Dict[str, Dict] = {}
+
+    @staticmethod
+    def _limits(provider: Dict) -> Tuple[float, float]:
+        """Hourly and daily limits of a provider"""
+        return (
+            float(provider.get("hourly_send_limit", DEFAULT_HOURLY_LIMIT) or 0),
+            float(provider.get("daily_send_limit", DEFAULT_DAILY_LIMIT) or 0)
+        )
+
+    def _usage(self, provider: Dict, now: datetime) -> Tuple[float, float]:
+        """Hourly and daily usage after draining what the buckets refilled since the last update"""
+        state = provider.get("rate_limit")
+        if state:
+            hourly, daily, updated_at = state.get("hourly", 0.0), state.get("daily", 0.0), state.get("updated_at")
+        else:
+            # Providers that predate the buckets start from their fixed-window counters
+            hourly = float(provider.get("current_hourly_count", 0) or 0)
+            daily = float(provider.get("current_daily_count", 0) or 0)
+            updated_at = provider.get("last_sync")
+
+        elapsed = max((now - updated_at).total_seconds(), 0.0) if updated_at else 0.0
+        hourly_limit, daily_limit = self._limits(provider)
+        return (
+            max(hourly - elapsed * hourly_limit / 3600, 0.0),
+            max(daily - elapsed * daily_limit / 86400, 0.0)
+        )
+
+    def _available(self, provider: Dict, hourly: float, daily: float) -> int:
+        """Whole sends both buckets allow right now"""
+        hourly_limit, daily_limit = self._limits(provider)
+        # The epsilon absorbs float drift so a bucket that refilled exactly to a slot counts it
+        return max(int(min(hourly_limit - hourly, daily_limit - daily) + 1e-9), 0)
+
+    def _seconds_until(self, provider: Dict, hourly: float, daily: float, count: int) -> Optional[float]:
+        """Seconds until count more sends fit, or None when they never will"""
+        hourly_limit, daily_limit = self._limits(provider)
+        if count > hourly_limit or count > daily_limit:
+            return None
+        hourly_wait = (hourly + count - hourly_limit) * 3600 / hourly_limit
+        daily_wait = (daily + count - daily_limit) * 86400 / daily_limit
+        return max(hourly_wait, daily_wait, 0.0)
+
+    async def _update(self, provider_id: str, change: Callable[[Dict, float, float], int]) -> Tuple[Optional[Dict], float, float, Optional[int]]:
+        """Apply a usage change atomically; change returns how many sends to add to both buckets.
+
+        Returns the provider and its usage after the change, plus the amount applied. The provider
+        is None when it does not exist, and the amount is also None when every attempt lost a race.
+        """
+        await db_service.connect()
+        provider = self._providers.get(provider_id)
+        for _ in range(self.max_attempts):
+            fresh = provider is None
+            if fresh:
+                provider = await db_service.get_provider_rate_limit_state(provider_id)
+                if provider is None:
+                    return None, 0.0, 0.0, 0
+
+            now = datetime.utcnow()
+            hourly, daily = self._usage(provider, now)
+            delta = change(provider, hourly, daily)
+            if delta == 0:
+                if fresh:
+                    return provider, hourly, daily, 0  # Nothing to write
+                provider = None  # The cached state may be outdated; confirm against Mongo
+                continue
+            hourly, daily = max(hourly + delta, 0.0), max(daily + delta, 0.0)
+            expected = {
+                "version": (provider.get("rate_limit") or {}).get("version"),
+                "hourly_send_limit": provider.get("hourly_send_limit"),
+                "daily_send_limit": provider.get("daily_send_limit")
+            }
+            updated = await db_service.save_provider_rate_limit_state(
+                provider_id,
+                expected,
+                {"hourly": hourly, "daily": daily, "updated_at": now, "version": (expected["version"] or 0) + 1},
+                {"current_hourly_count": math.ceil(hourly), "current_daily_count": math.ceil(daily)}
+            )
+            if updated:
+                self._providers[provider_id] = updated
+                return updated, hourly, daily, delta
+            provider = None  # Another sender got there first; re-read and retry
+
+        self._providers.pop(provider_id, None)
+        logger.warning(f"Rate limit update for provider {provider_id} kept losing races; treating it as exhausted")
+        return None, 0.0, 0.0, None
+
+    async def reserve(self, provider_id: str, count: int = 1) -> Dict:
+        """Reserve up to count sends; returns how many were granted and when the next slot opens.
+
+        retry_after is 0 when everything was granted, the seconds until one more send fits
+        otherwise, and None when the limits can never allow a send.
+        """
+        if count <= 0:
+            return {"granted": 0, "retry_after": 0.0}
+
+        provider, hourly, daily, granted = await self._update(
+            provider_id, lambda provider, hourly, daily: min(count, self._available(provider, hourly, daily))
+        )
+        if provider is None:
+            # Lost races mean other senders are busy with it, so try again shortly; a missing provider never fits
+            return {"granted": 0, "retry_after": 1.0 if granted is None else None}
+
+        retry_after = 0.0 if granted == count else self._seconds_until(provider, hourly, daily, 1)
+        if granted < count:
+            logger.info(f"Provider {provider_id} rate limited: granted {granted}/{count}, next slot in {retry_after}s")
+        return {"granted": granted, "retry_after": retry_after}
+
+    async def release(self, provider_id: str, count: int = 1):
+        """Return reserved sends that were not used, e.g. because delivery failed"""
+        if count > 0:
+            await self._update(provider_id, lambda provider, hourly, daily: -count)
+
+    async def time_until_available(self, provider_id: str, count: int = 1) -> Optional[float]:
+        """Seconds until count sends fit without reserving them; None when they never will"""
+        await db_service.connect()
+        provider = await db_service.get_provider_rate_limit_state(provider_id)
+        if provider is None:
+            return None
+        hourly, daily = self._usage(provider, datetime.utcnow())
+        return self._seconds_until(provider, hourly, daily, count)
+
+    def get_capacity(self, provider: Dict) -> Dict:
+        """Current usage, limits and next free slot computed from a freshly read provider document"""
+        hourly, daily = self._usage(provider, datetime.utcnow())
+        hourly_limit, daily_limit = self._limits(provider)
+        return {
+            "provider_id": provider.get("id"),
+            "hourly_used": round(hourly, 2),
+            "hourly_limit": hourly_limit,
+            "daily_used": round(daily, 2),
+            "daily_limit": daily_limit,
+            "available": self._available(provider, hourly, daily),
+            "next_slot_seconds": self._seconds_until(provider, hourly, daily, 1)
+        }
+
+    async def get_status(self, provider_id: str) -> Optional[Dict]:
+        """Current usage, limits and next free slot of a provider"""
+        await db_service.connect()
+        provider = await db_service.get_provider_rate_limit_state(provider_id)
+        return self.get_capacity(provider) if provider else None
+
+# Create global rate limit service instance
+rate_limit_service = RateLimitService()
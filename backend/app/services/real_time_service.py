@@ -117,62 +117,10 @@ class RealTimeService:
     
     async def _update_dashboard_metrics(self):
         """Update dashboard metrics cache"""
-        from app.services.database import db_service
+        from app.services.metrics_service import metrics_service
         
         try:
-            # Get basic counts
-            total_prospects = await db_service.db.prospects.count_documents({})
-            total_campaigns = await db_service.db.campaigns.count_documents({})
-            total_emails_sent = await db_service.db.emails.count_documents({})
-            
-            # Get today's activity
-            today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-            emails_today = await db_service.db.emails.count_documents({
-                "created_at": {"$gte": today}
-            })
-            
-            # Get active campaigns
-            active_campaigns = await db_service.db.campaigns.count_documents({
-                "status": "active"
-            })
-            
-            # Get email provider stats
-            providers = await db_service.db.email_providers.find({}).to_list(length=None)
-            provider_stats = {}
-            for provider in providers:
-                provider_stats[provider['name']] = {
-                    "type": provider['provider_type'],
-                    "status": provider['status'],
-                    "emails_sent_today": provider.get('emails_sent_today', 0),
-                    "daily_limit": provider.get('daily_limit', 0)
-                }
-            
-            # Get recent activity
-            recent_emails = await db_service.db.emails.find({}).sort("created_at", -1).limit(10).to_list(length=10)
-            recent_activity = []
-            for email in recent_emails:
-                recent_activity.append({
-                    "id": str(email.get('_id')),
-                    "subject": email.get('subject', 'No Subject'),
-                    "recipient": email.get('recipient', 'Unknown'),
-                    "status": email.get('status', 'Unknown'),
-                    "created_at": email.get('created_at').isoformat() if email.get('created_at') else None
-                })
-            
-            # Update cache
-            self.metrics_cache = {
-                "overview": {
-                    "total_prospects": total_prospects,
-                    "total_campaigns": total_campaigns,
-                    "total_emails_sent": total_emails_sent,
-                    "emails_today": emails_today,
-                    "active_campaigns": active_campaigns
-                },
-                "provider_stats": provider_stats,
-                "recent_activity": recent_activity,
-                "last_updated": datetime.utcnow().isoformat()
-            }
-            
+            self.metrics_cache = await metrics_service.get_dashboard_metrics()
             self.last_metrics_update = datetime.utcnow()
             
         except Exception as e:
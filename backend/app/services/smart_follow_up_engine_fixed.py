@@ -1,17 +1,22 @@
 import asyncio
+import heapq
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 import logging
+import os
 import re
 from app.models import FollowUpRule, FollowUpStatus
 from app.services.database import db_service
 from app.services.enhanced_database import enhanced_db_service
 from app.services.email_provider_service import email_provider_service
 from app.services.groq_service import groq_service
-from app.utils.helpers import generate_id, personalize_template
+from app.services.lease_service import lease_service
+from app.utils.follow_up_schedule import CompiledFollowUpSchedule, compute_next_follow_up_at
+from app.utils.helpers import generate_id
+from app.utils.template_renderer import template_renderer
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +28,16 @@ class FixedSmartFollowUpEngine:
             "sick leave", "conference", "traveling", "will be back"
         ]
         self.processing = False
+        self.batch_size = int(os.getenv("FOLLOW_UP_BATCH_SIZE", 500))
+        self.max_sleep = int(os.getenv("FOLLOW_UP_MAX_SLEEP", 60))  # Bounds how late schedules written elsewhere are seen
+        self.recheck_interval = int(os.getenv("FOLLOW_UP_RECHECK_INTERVAL", 60))
+        self.backfill_interval = int(os.getenv("FOLLOW_UP_BACKFILL_INTERVAL", 600))
+        # Due prospects are claimed in small batches so a claim never outlives the work on it
+        self.claim_batch_size = int(os.getenv("FOLLOW_UP_CLAIM_BATCH_SIZE", 50))
+        self.claim_seconds = int(os.getenv("FOLLOW_UP_CLAIM_SECONDS", 600))
+        self.last_backfill_at = None
+        self.next_due_at = None
+        self.processed_count = 0
     
     async def start_follow_up_engine(self):
         """Start the FIXED smart follow-up engine"""
@@ -47,117 +62,224 @@ class FixedSmartFollowUpEngine:
         logger.info("FIXED smart follow-up engine stopped")
         return {"status": "stopped"}
     
+    def get_schedule_stats(self) -> Dict:
+        """Get follow-up scheduler statistics"""
+        return {
+            "next_due_at": self.next_due_at.isoformat() if self.next_due_at else None,
+            "last_backfill_at": self.last_backfill_at.isoformat() if self.last_backfill_at else None,
+            "processed_count": self.processed_count,
+            "max_sleep_seconds": self.max_sleep
+        }
+    
     async def _process_follow_ups_fixed(self):
-        """FIXED: Main follow-up processing loop with enhanced response detection"""
+        """FIXED: Main follow-up loop - sleeps until the earliest scheduled follow-up is due"""
+        try:
+            await db_service.ensure_indexes()
+        except Exception as e:
+            logger.error(f"FIXED: Could not create follow-up schedule indexes: {str(e)}")
+        
         while self.processing:
             try:
-                await self._check_and_send_follow_ups_fixed()
-                await asyncio.sleep(60)  # Check every minute for precise timing
+                self.next_due_at = await self._check_and_send_follow_ups_fixed()
+                await asyncio.sleep(self._seconds_until_fixed(self.next_due_at))
             except Exception as e:
                 logger.error(f"FIXED: Error in follow-up processing: {str(e)}")
                 await asyncio.sleep(120)  # Wait longer on error
     
-    async def _check_and_send_follow_ups_fixed(self):
-        """FIXED: Check for prospects that need follow-ups with aggressive response detection"""
+    def _seconds_until_fixed(self, due_at: Optional[datetime]) -> float:
+        """Sleep until the next due follow-up, but wake at least every max_sleep seconds"""
+        if due_at is None:
+            return self.max_sleep
+        seconds = (due_at - datetime.utcnow()).total_seconds()
+        return min(max(seconds, 1), self.max_sleep)
+    
+    async def _check_and_send_follow_ups_fixed(self) -> Optional[datetime]:
+        """FIXED: Send the follow-ups that are due and return when the next one is due"""
+        # Get active campaigns with follow-up enabled using enhanced method
+        campaigns = await enhanced_db_service.get_active_follow_up_campaigns_enhanced()
+        campaigns_by_id = {campaign["id"]: campaign for campaign in campaigns}
+        
+        if self.last_backfill_at is None or \
+                (datetime.utcnow() - self.last_backfill_at).total_seconds() >= self.backfill_interval:
+            # One worker backfills at a time; the others skip this round
+            if await lease_service.acquire("follow_up_backfill"):
+                try:
+                    for campaign in campaigns:
+                        await self._schedule_unscheduled_follow_ups_fixed(campaign)
+                finally:
+                    await lease_service.release("follow_up_backfill")
+            self.last_backfill_at = datetime.utcnow()
+        
+        # Min-heap of (next due time, campaign id): only campaigns with something due are scanned
+        schedule = []
+        for campaign_id in campaigns_by_id:
+            next_due = await db_service.get_next_follow_up_due(campaign_id)
+            if next_due:
+                heapq.heappush(schedule, (next_due, campaign_id))
+        
+        now = datetime.utcnow()
+        due_campaign_ids = []
+        while schedule and schedule[0][0] <= now:
+            due_campaign_ids.append(heapq.heappop(schedule)[1])
+        
+        for campaign_id in due_campaign_ids:
+            await self._process_campaign_follow_ups_fixed(campaigns_by_id[campaign_id], now)
+            next_due = await db_service.get_next_follow_up_due(campaign_id)
+            if next_due:
+                heapq.heappush(schedule, (next_due, campaign_id))
+        
+        if due_campaign_ids:
+            logger.info(f"FIXED: Processed due follow-ups for {len(due_campaign_ids)} of {len(campaigns)} active follow-up campaigns")
+        
+        return schedule[0][0] if schedule else None
+    
+    async def _get_campaign_follow_up_rule_fixed(self, campaign: Dict) -> Optional[Dict]:
+        """Get the follow-up rule attached to a campaign"""
+        follow_up_rule_id = campaign.get("follow_up_rule_id")
+        if follow_up_rule_id:
+            return await db_service.get_follow_up_rule_by_id(follow_up_rule_id)
+        return None
+    
+    def _next_follow_up_at_fixed(self, campaign: Dict, follow_up_rule: Optional[Dict],
+                                 follow_up_count: int, reference_time: Optional[datetime],
+                                 schedule: Optional[CompiledFollowUpSchedule] = None) -> Optional[datetime]:
+        """When the prospect's next follow-up is due; None when the sequence cannot continue"""
+        max_follow_ups = follow_up_rule.get("max_follow_ups", 3) if follow_up_rule else 3
+        if follow_up_count >= max_follow_ups:
+            return datetime.utcnow()  # Due now so the limit check stops the sequence
+        return compute_next_follow_up_at(campaign, follow_up_rule, follow_up_count, reference_time, schedule=schedule)
+    
+    def _schedule_update_fixed(self, next_follow_up_at: Optional[datetime]) -> Dict:
+        """Prospect fields for a new due time; a sequence with no due time left is completed"""
+        if next_follow_up_at is None:
+            return {"next_follow_up_at": None, "follow_up_status": "completed"}
+        return {"next_follow_up_at": next_follow_up_at}
+    
+    async def _schedule_unscheduled_follow_ups_fixed(self, campaign: Dict):
+        """Compute due times for prospects put on follow-up without one (older data, other code paths)"""
         try:
-            # Get active campaigns with follow-up enabled using enhanced method
-            campaigns = await enhanced_db_service.get_active_follow_up_campaigns_enhanced()
-            
-            logger.info(f"FIXED: Found {len(campaigns)} active follow-up campaigns")
-            
-            for campaign in campaigns:
-                await self._process_campaign_follow_ups_fixed(campaign)
+            follow_up_rule = await self._get_campaign_follow_up_rule_fixed(campaign)
+            schedule = CompiledFollowUpSchedule(campaign, follow_up_rule)
+            scheduled = 0
+            async for prospects in db_service.iter_unscheduled_follow_ups(campaign["id"], self.batch_size):
+                updates = []
+                for prospect in prospects:
+                    reference_time = prospect.get("last_follow_up") or prospect.get("last_contact") or prospect.get("created_at")
+                    next_follow_up_at = self._next_follow_up_at_fixed(
+                        campaign, follow_up_rule, prospect.get("follow_up_count", 0), reference_time, schedule
+                    )
+                    updates.append((prospect["id"], self._schedule_update_fixed(next_follow_up_at)))
+                await db_service.bulk_update_prospects(updates)
+                scheduled += len(updates)
+            
+            if scheduled:
+                logger.info(f"FIXED: Scheduled {scheduled} unscheduled prospects for campaign {campaign['id']}")
                 
         except Exception as e:
-            logger.error(f"FIXED: Error checking follow-ups: {str(e)}")
+            logger.error(f"FIXED: Error scheduling follow-ups for campaign {campaign.get('id')}: {str(e)}")
     
-    async def _process_campaign_follow_ups_fixed(self, campaign: Dict):
-        """FIXED: Process follow-ups for a specific campaign with enhanced response detection"""
+    def _deferral_update_fixed(self, prospect: Dict, campaign: Dict, follow_up_rule: Optional[Dict],
+                               schedule: CompiledFollowUpSchedule) -> Optional[Tuple[str, Dict]]:
+        """Move a due follow-up that could not be sent now to its next possible time"""
+        try:
+            reference_time = prospect.get("last_follow_up") or prospect.get("last_contact") or prospect.get("created_at")
+            next_follow_up_at = self._next_follow_up_at_fixed(
+                campaign, follow_up_rule, prospect.get("follow_up_count", 0), reference_time, schedule
+            )
+            if next_follow_up_at is not None:
+                # Not before the recheck interval (a failed send), and never inside a blocked send window
+                next_follow_up_at = schedule.next_window_open(
+                    max(next_follow_up_at, datetime.utcnow() + timedelta(seconds=self.recheck_interval))
+                )
+            return prospect["id"], self._schedule_update_fixed(next_follow_up_at)
+        except Exception as e:
+            logger.error(f"FIXED: Error deferring follow-up for prospect {prospect.get('id', 'unknown')}: {str(e)}")
+            return None
+    
+    async def _process_campaign_follow_ups_fixed(self, campaign: Dict, due_before: datetime):
+        """FIXED: Process the due follow-ups of a campaign with enhanced response detection"""
         try:
             campaign_id = campaign["id"]
-            follow_up_rule_id = campaign.get("follow_up_rule_id")
             
             # Get follow-up rule
-            follow_up_rule = None
-            if follow_up_rule_id:
-                follow_up_rule = await db_service.get_follow_up_rule_by_id(follow_up_rule_id)
-            
-            # Use campaign follow-up intervals or default
-            follow_up_intervals = campaign.get("follow_up_intervals", [3, 7, 14])
-            if follow_up_rule:
-                follow_up_intervals = [follow_up_rule["trigger_after_days"]]
-            
-            # FIXED: Get prospects needing follow-up with enhanced detection
-            prospects_needing_follow_up = await self._get_prospects_needing_follow_up_fixed(campaign_id)
+            follow_up_rule = await self._get_campaign_follow_up_rule_fixed(campaign)
             
-            logger.info(f"FIXED: Found {len(prospects_needing_follow_up)} prospects needing follow-up for campaign {campaign_id}")
+            # Resolve the campaign's intervals, dates and send windows once for all its prospects
+            schedule = CompiledFollowUpSchedule(campaign, follow_up_rule)
             
-            for prospect in prospects_needing_follow_up:
-                await self._check_prospect_follow_up_fixed(
-                    prospect, campaign, follow_up_rule, follow_up_intervals
-                )
+            # FIXED: Get prospects with a due follow-up with enhanced detection, one chunk at a time
+            total_checked = 0
+            async for prospects_needing_follow_up in self._iter_prospects_needing_follow_up_fixed(campaign_id, due_before):
+                total_checked += len(prospects_needing_follow_up)
+                
+                due_mask = schedule.due_mask(prospects_needing_follow_up)
+                deferrals = []
+                for prospect, due in zip(prospects_needing_follow_up, due_mask):
+                    sent_or_stopped = await self._check_prospect_follow_up_fixed(
+                        prospect, campaign, follow_up_rule, bool(due)
+                    )
+                    if not sent_or_stopped:
+                        deferral = self._deferral_update_fixed(prospect, campaign, follow_up_rule, schedule)
+                        if deferral:
+                            deferrals.append(deferral)
+                await db_service.bulk_update_prospects(deferrals)
+                self.processed_count += len(prospects_needing_follow_up)
+            
+            logger.info(f"FIXED: Checked {total_checked} prospects with due follow-ups for campaign {campaign_id}")
                 
         except Exception as e:
             logger.error(f"FIXED: Error processing campaign follow-ups: {str(e)}")
     
-    async def _get_prospects_needing_follow_up_fixed(self, campaign_id: str) -> List[Dict]:
-        """FIXED: Get prospects that need follow-up with enhanced response detection"""
-        await db_service.connect()
-        
-        # FIXED: More aggressive filtering - check for ANY responses
-        query = {
-            "campaign_id": campaign_id,
-            "follow_up_status": {"$ne": "stopped"},  # Don't include already stopped prospects
-            "status": {"$ne": "unsubscribed"},
-            "$or": [
-                {"responded_at": {"$exists": False}},  # Never responded
-                {"responded_at": None}  # Null response date
-            ]
-        }
-        
-        prospects = await db_service.db.prospects.find(query).to_list(length=1000)
+    async def _iter_prospects_needing_follow_up_fixed(self, campaign_id: str, due_before: datetime):
+        """FIXED: Claim and yield chunks of prospects whose follow-up is due, with enhanced response detection"""
+        while self.processing:
+            prospects = await db_service.claim_due_follow_ups(
+                campaign_id, due_before, lease_service.worker_id, self.claim_seconds, self.claim_batch_size
+            )
+            if prospects is None:
+                return
+            if not prospects:
+                continue  # Other workers claimed this batch first
+            
+            filtered_prospects = await self._filter_prospects_without_responses_fixed(prospects)
+            logger.info(f"FIXED: After response detection, {len(filtered_prospects)} of {len(prospects)} prospects still need follow-up")
+            if filtered_prospects:
+                yield filtered_prospects
+    
+    async def _filter_prospects_without_responses_fixed(self, prospects: List[Dict]) -> List[Dict]:
+        """FIXED: Double check each prospect for hidden responses"""
+        # last_received_at is kept by the email processor; derive it once for prospects that predate it
+        unknown_ids = [prospect["id"] for prospect in prospects if "last_received_at" not in prospect]
+        if unknown_ids:
+            last_received = await db_service.backfill_last_received_at(unknown_ids)
+            for prospect in prospects:
+                if prospect["id"] in last_received:
+                    prospect["last_received_at"] = last_received[prospect["id"]]
         
-        # FIXED: Double check each prospect for hidden responses
+        recent_cutoff = datetime.utcnow() - timedelta(days=30)
         filtered_prospects = []
         for prospect in prospects:
-            prospect_id = prospect["id"]
-            
-            # FIXED: Check if prospect has responded in thread messages
-            thread = await db_service.get_thread_by_prospect_id(prospect_id)
-            if thread:
-                messages = thread.get("messages", [])
-                recent_received = [
-                    m for m in messages 
-                    if (m.get("type") == "received" and 
-                        m.get("timestamp", datetime.min) > datetime.utcnow() - timedelta(days=30))
-                ]
-                
-                if recent_received:
-                    logger.info(f"FIXED: Prospect {prospect_id} has recent received messages - STOPPING follow-ups")
-                    # Stop follow-ups for this prospect
-                    await self._stop_prospect_follow_ups_fixed(prospect_id, "thread_response_detected")
-                    continue
-            
-            # FIXED: Check email records for responses
-            email_responses = await db_service.db.emails.find({
-                "prospect_id": prospect_id,
-                "type": "received",
-                "created_at": {"$gte": datetime.utcnow() - timedelta(days=30)}
-            }).to_list(length=10)
-            
-            if email_responses:
-                logger.info(f"FIXED: Prospect {prospect_id} has email responses - STOPPING follow-ups")
-                await self._stop_prospect_follow_ups_fixed(prospect_id, "email_response_detected")
+            # FIXED: Check if prospect has responded in the last 30 days
+            if self._last_received_after_fixed(prospect, recent_cutoff):
+                logger.info(f"FIXED: Prospect {prospect['id']} has recent received messages - STOPPING follow-ups")
+                await self._stop_prospect_follow_ups_fixed(prospect["id"], "thread_response_detected")
                 continue
             
             filtered_prospects.append(prospect)
         
-        logger.info(f"FIXED: After response detection, {len(filtered_prospects)} prospects still need follow-up")
-        return clean_document(filtered_prospects)
+        return filtered_prospects
+    
+    def _last_received_after_fixed(self, prospect: Dict, since: datetime) -> bool:
+        """Whether the prospect sent us anything after the given time"""
+        last_received_at = prospect.get("last_received_at")
+        return isinstance(last_received_at, datetime) and last_received_at > since
     
     async def _check_prospect_follow_up_fixed(self, prospect: Dict, campaign: Dict, 
-                                           follow_up_rule: Optional[Dict], follow_up_intervals: List[int]):
-        """FIXED: Check if a prospect needs a follow-up email with aggressive response detection"""
+                                           follow_up_rule: Optional[Dict], due: bool) -> bool:
+        """FIXED: Send a prospect's follow-up if it is due, with aggressive response detection.
+        
+        Returns False when the follow-up still has to be deferred to its next due time.
+        """
         try:
             prospect_id = prospect["id"]
             
@@ -166,26 +288,26 @@ class FixedSmartFollowUpEngine:
             # FIXED: Skip if prospect has responded or follow-up is stopped  
             if prospect.get("follow_up_status") in [FollowUpStatus.COMPLETED, FollowUpStatus.STOPPED, "stopped"]:
                 logger.info(f"FIXED: Prospect {prospect_id} follow-up status is stopped/completed")
-                return
+                return True
             
             # FIXED: Enhanced response detection - check if prospect responded after our last email
             last_email_sent_at = prospect.get("last_follow_up") or prospect.get("last_contact")
             if last_email_sent_at:
                 has_responded = await self._check_prospect_response_after_our_email_fixed(
-                    prospect_id, last_email_sent_at
+                    prospect, last_email_sent_at
                 )
                 
                 if has_responded:
                     logger.info(f"FIXED: Prospect {prospect_id} has responded after our email - STOPPING follow-ups")
                     await self._stop_prospect_follow_ups_fixed(prospect_id, "manual_response")
-                    return
+                    return True
             
             # FIXED: Check if prospect has ANY recent responses (more aggressive)
-            recent_responses = await self._check_for_any_recent_responses_fixed(prospect_id)
+            recent_responses = await self._check_for_any_recent_responses_fixed(prospect)
             if recent_responses:
                 logger.info(f"FIXED: Prospect {prospect_id} has recent responses - STOPPING follow-ups")
                 await self._stop_prospect_follow_ups_fixed(prospect_id, "recent_response_detected")
-                return
+                return True
             
             # Check follow-up limits
             follow_up_count = prospect.get("follow_up_count", 0)
@@ -193,82 +315,32 @@ class FixedSmartFollowUpEngine:
             
             if follow_up_count >= max_follow_ups:
                 await self._stop_prospect_follow_ups_fixed(prospect_id, "limit_reached")
-                return
-            
-            # Enhanced datetime-based follow-up scheduling with minute precision
-            should_send_follow_up = await self._should_send_follow_up_now_enhanced(
-                prospect, campaign, follow_up_rule, follow_up_intervals, follow_up_count
-            )
+                return True
             
-            if should_send_follow_up:
+            sent = False
+            if due:
                 logger.info(f"FIXED: Sending follow-up to prospect {prospect_id}")
                 # Send follow-up with enhanced provider consistency
-                await self._send_follow_up_email_enhanced(
+                sent = await self._send_follow_up_email_enhanced(
                     prospect, campaign, follow_up_rule, follow_up_count + 1
                 )
+            
+            return sent
                 
         except Exception as e:
             logger.error(f"FIXED: Error checking prospect follow-up {prospect.get('id', 'unknown')}: {str(e)}")
+            return False
     
-    async def _check_prospect_response_after_our_email_fixed(self, prospect_id: str, our_email_sent_at: datetime) -> bool:
+    async def _check_prospect_response_after_our_email_fixed(self, prospect: Dict, our_email_sent_at: datetime) -> bool:
         """FIXED: More aggressive check if prospect responded after our email"""
-        try:
-            # Check thread messages
-            thread = await db_service.get_thread_by_prospect_id(prospect_id)
-            if thread:
-                messages = thread.get("messages", [])
-                for message in messages:
-                    if (message.get("type") == "received" and 
-                        message.get("timestamp") > our_email_sent_at):
-                        logger.info(f"FIXED: Found response in thread after our email for prospect {prospect_id}")
-                        return True
-            
-            # Check email records  
-            email_responses = await db_service.db.emails.find({
-                "prospect_id": prospect_id,
-                "type": "received",
-                "created_at": {"$gte": our_email_sent_at}
-            }).to_list(length=1)
-            
-            if email_responses:
-                logger.info(f"FIXED: Found email response after our email for prospect {prospect_id}")
-                return True
-            
-            return False
-            
-        except Exception as e:
-            logger.error(f"FIXED: Error checking prospect response: {str(e)}")
-            return False
+        if self._last_received_after_fixed(prospect, our_email_sent_at):
+            logger.info(f"FIXED: Found response after our email for prospect {prospect['id']}")
+            return True
+        return False
     
-    async def _check_for_any_recent_responses_fixed(self, prospect_id: str) -> bool:
+    async def _check_for_any_recent_responses_fixed(self, prospect: Dict) -> bool:
         """FIXED: Check for ANY recent responses from prospect (last 7 days)"""
-        try:
-            recent_cutoff = datetime.utcnow() - timedelta(days=7)
-            
-            # Check thread messages
-            thread = await db_service.get_thread_by_prospect_id(prospect_id)
-            if thread:
-                messages = thread.get("messages", [])
-                recent_received = [
-                    m for m in messages 
-                    if (m.get("type") == "received" and 
-                        m.get("timestamp", datetime.min) > recent_cutoff)
-                ]
-                if recent_received:
-                    return True
-            
-            # Check email records
-            email_responses = await db_service.db.emails.find({
-                "prospect_id": prospect_id,
-                "type": "received", 
-                "created_at": {"$gte": recent_cutoff}
-            }).to_list(length=1)
-            
-            return len(email_responses) > 0
-            
-        except Exception as e:
-            logger.error(f"FIXED: Error checking recent responses: {str(e)}")
-            return False
+        return self._last_received_after_fixed(prospect, datetime.utcnow() - timedelta(days=7))
     
     async def _stop_prospect_follow_ups_fixed(self, prospect_id: str, reason: str):
         """FIXED: Comprehensive method to stop follow-ups for a prospect"""
@@ -294,102 +366,8 @@ class FixedSmartFollowUpEngine:
         except Exception as e:
             logger.error(f"FIXED: Error stopping follow-ups for prospect {prospect_id}: {str(e)}")
     
-    # Keep the existing methods for compatibility
-    async def _should_send_follow_up_now_enhanced(self, prospect: Dict, campaign: Dict, 
-                                                 follow_up_rule: Optional[Dict], follow_up_intervals: List[int],
-                                                 follow_up_count: int) -> bool:
-        """Enhanced follow-up timing logic with minute-level precision and timezone support"""
-        try:
-            import pytz
-            from datetime import datetime, timedelta
-            
-            # Get campaign timezone
-            campaign_timezone = campaign.get("follow_up_timezone", "UTC")
-            tz = pytz.timezone(campaign_timezone)
-            current_time = datetime.now(tz)
-            
-            # Check if campaign uses precise datetime scheduling
-            schedule_type = campaign.get("follow_up_schedule_type", "interval")
-            
-            if schedule_type == "datetime" and campaign.get("follow_up_dates"):
-                # Use precise datetime scheduling with minute precision
-                follow_up_dates = campaign.get("follow_up_dates", [])
-                
-                if follow_up_count < len(follow_up_dates):
-                    target_datetime = follow_up_dates[follow_up_count]
-                    
-                    # Handle both datetime objects and ISO strings
-                    if isinstance(target_datetime, str):
-                        target_datetime = datetime.fromisoformat(target_datetime.replace('Z', '+00:00'))
-                    
-                    # Convert to campaign timezone if needed
-                    if target_datetime.tzinfo is None:
-                        target_datetime = tz.localize(target_datetime)
-                    else:
-                        target_datetime = target_datetime.astimezone(tz)
-                    
-                    # Check if it's time to send (within 1 minute window for precision)
-                    time_diff = (current_time - target_datetime).total_seconds()
-                    if -60 <= time_diff <= 60:  # 1 minute window for precise scheduling
-                        logger.info(f"Precise datetime follow-up ready for prospect {prospect['id']} at {target_datetime}")
-                        return await self._is_in_campaign_time_window(campaign, current_time)
-                    
-                    return False
-            
-            # Fallback to interval-based scheduling with enhanced minute precision
-            last_contact = prospect.get("last_contact") or prospect.get("created_at")
-            last_follow_up = prospect.get("last_follow_up")
-            
-            if not last_contact:
-                return False
-            
-            # Determine next follow-up interval with minute precision support
-            if follow_up_count < len(follow_up_intervals):
-                interval_value = follow_up_intervals[follow_up_count]
-            else:
-                interval_value = follow_up_intervals[-1]  # Use last interval for remaining follow-ups
-            
-            # Check if enough time has passed (timezone aware with minute precision)
-            reference_time = last_follow_up or last_contact
-            if reference_time.tzinfo is None:
-                reference_time = pytz.UTC.localize(reference_time)
-            
-            reference_time = reference_time.astimezone(tz)
-            time_since_last = current_time - reference_time
-            
-            # Enhanced interval handling: < 1440 treated as minutes, >= 1440 as days
-            if interval_value < 1440:  # Less than 24 hours = minute-based
-                minutes_since_last = time_since_last.total_seconds() / 60
-                if minutes_since_last >= interval_value:
-                    logger.info(f"Minute-based follow-up ready: {minutes_since_last:.1f} minutes >= {interval_value} minutes")
-                    time_check_passed = True
-                else:
-                    time_check_passed = False
-            else:
-                # Day-based intervals (convert minutes to days)
-                interval_days = interval_value / 1440  # Convert minutes to days
-                days_since_last = time_since_last.total_seconds() / (24 * 3600)
-                if days_since_last >= interval_days:
-                    time_check_passed = True
-                else:
-                    time_check_passed = False
-            
-            if time_check_passed:
-                # Check time window if specified
-                if follow_up_rule and not await self._is_in_time_window(follow_up_rule):
-                    return False
-                
-                # Check campaign-specific time window
-                return await self._is_in_campaign_time_window(campaign, current_time)
-            
-            return False
-            
-        except Exception as e:
-            logger.error(f"Error checking enhanced follow-up timing: {str(e)}")
-            return False
-    
     async def _send_follow_up_email_enhanced(self, prospect: Dict, campaign: Dict, 
-                                           follow_up_rule: Optional[Dict], follow_up_sequence: int):
+                                           follow_up_rule: Optional[Dict], follow_up_sequence: int) -> bool:
         """Send a follow-up email with enhanced provider consistency and tracking"""
         try:
             prospect_id = prospect["id"]
@@ -399,17 +377,18 @@ class FixedSmartFollowUpEngine:
             original_provider = await enhanced_db_service.get_prospect_original_provider(prospect_id)
             if not original_provider:
                 logger.error(f"No email provider available for follow-up to prospect {prospect_id}")
-                return
+                return False
             
             # Get follow-up template
             template = await self._get_follow_up_template_enhanced(campaign, follow_up_rule, follow_up_sequence)
             if not template:
                 logger.warning(f"No follow-up template found for prospect {prospect_id}, sequence {follow_up_sequence}")
-                return
+                return False
             
-            # Personalize email content
-            personalized_content = personalize_template(template["content"], prospect)
-            personalized_subject = personalize_template(template["subject"], prospect)
+            # Personalize email content; the template stays compiled across prospects and runs
+            rendered = template_renderer.render_batch(template, [prospect])[0]
+            personalized_content = rendered["content"]
+            personalized_subject = rendered["subject"]
             
             # Add follow-up context to subject
             if follow_up_sequence > 1:
@@ -452,8 +431,13 @@ class FixedSmartFollowUpEngine:
                 # Mark email as sent by us
                 await db_service.mark_email_as_sent_by_us(email_id, f"thread_{prospect_id}")
                 
-                # Update prospect follow-up tracking
-                await enhanced_db_service.mark_follow_up_as_processed(prospect_id, follow_up_sequence)
+                # Update prospect follow-up tracking and schedule the next follow-up
+                next_follow_up_at = self._next_follow_up_at_fixed(
+                    campaign, follow_up_rule, follow_up_sequence, datetime.utcnow()
+                )
+                await enhanced_db_service.mark_follow_up_as_processed(prospect_id, follow_up_sequence, next_follow_up_at)
+                if next_follow_up_at is None:
+                    await db_service.update_prospect(prospect_id, self._schedule_update_fixed(None))
                 
                 # Update thread context with follow-up message
                 await enhanced_db_service.create_or_update_thread_context(
@@ -476,12 +460,15 @@ class FixedSmartFollowUpEngine:
                 )
                 
                 logger.info(f"Enhanced follow-up email sent to {prospect['email']} (sequence: {follow_up_sequence}) via {original_provider['name']}")
+                return True
                 
             else:
                 logger.error(f"Failed to send enhanced follow-up email to {prospect['email']}: {error}")
+                return False
                 
         except Exception as e:
             logger.error(f"Error sending enhanced follow-up email: {str(e)}")
+            return False
     
     async def _get_follow_up_template_enhanced(self, campaign: Dict, follow_up_rule: Optional[Dict], 
                                              follow_up_sequence: int) -> Optional[Dict]:
@@ -523,61 +510,6 @@ class FixedSmartFollowUpEngine:
         except Exception as e:
             logger.error(f"Error getting enhanced follow-up template: {str(e)}")
             return None
-    
-    async def _is_in_campaign_time_window(self, campaign: Dict, current_time) -> bool:
-        """Check if current time is within campaign's allowed sending window"""
-        try:
-            # Check day of week
-            current_day = current_time.strftime("%A").lower()
-            allowed_days = campaign.get("follow_up_days_of_week", 
-                                     ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"])
-            
-            if current_day not in allowed_days:
-                return False
-            
-            # Check time window
-            start_time = campaign.get("follow_up_time_window_start", "00:00")  # Allow 24/7 by default
-            end_time = campaign.get("follow_up_time_window_end", "23:59")
-            current_time_str = current_time.strftime("%H:%M")
-            
-            if start_time <= current_time_str <= end_time:
-                return True
-            
-            return False
-            
-        except Exception as e:
-            logger.error(f"Error checking enhanced campaign time window: {str(e)}")
-            return True  # Default to allowing send
-    
-    async def _is_in_time_window(self, follow_up_rule: Dict) -> bool:
-        """Check if current time is within the allowed sending window"""
-        try:
-            now = datetime.utcnow()
-            
-            # Check day of week
-            send_days = follow_up_rule.get("send_days", ["monday", "tuesday", "wednesday", "thursday", "friday"])
-            current_day = now.strftime("%A").lower()
-            
-            if follow_up_rule.get("exclude_weekends", True) and current_day in ["saturday", "sunday"]:
-                return False
-            
-            if current_day not in send_days:
-                return False
-            
-            # Check time window
-            start_time = follow_up_rule.get("send_time_start", "09:00")
-            end_time = follow_up_rule.get("send_time_end", "17:00")
-            
-            current_time = now.strftime("%H:%M")
-            
-            if start_time <= current_time <= end_time:
-                return True
-            
-            return False
-            
-        except Exception as e:
-            logger.error(f"Error checking time window: {str(e)}")
-            return True  # Default to allowing send
 
 def clean_document(docs):
     """Clean documents"""
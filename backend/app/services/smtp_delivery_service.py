@@ -0,0 +1,235 @@
+"""
+SMTP Delivery Service - pooled, persistent SMTP sessions and concurrent sending per provider
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from email.message import Message
+from typing import Dict, List, Optional, Tuple, Union
+import aiosmtplib
+from app.utils.mime_builder import PreparedMessage
+
+logger = logging.getLogger(__name__)
+
+# Prefixes of send errors whose cause the campaign runner needs to tell apart
+CONNECTION_ERROR = "SMTP connection failed"
+RECIPIENT_REFUSED_ERROR = "Recipient refused"
+CONNECTION_EXCEPTIONS = (
+    aiosmtplib.SMTPConnectError, aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPTimeoutError,
+    aiosmtplib.SMTPAuthenticationError, aiosmtplib.SMTPHeloError, OSError
+)
+
+class SMTPConnectionPool:
+    """Pool of authenticated SMTP sessions for a single email provider"""
+
+    def __init__(self, provider: Dict, max_size: int = 5, idle_timeout: int = 240, timeout: int = 30):
+        self.provider_id = provider["id"]
+        self.signature = self.provider_signature(provider)
+        self.hostname, self.port, self.username, self.password, self.use_tls, self.start_tls = self.signature
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+
+        self._idle: List[Tuple[aiosmtplib.SMTP, float]] = []  # (client, last_used)
+        self._slots = asyncio.Semaphore(max_size)
+        self.closed = False
+        self.created_count = 0
+        self.reused_count = 0
+
+    @staticmethod
+    def provider_signature(provider: Dict) -> Tuple:
+        """A provider's connection settings; a pool is rebuilt when they change"""
+        port = int(provider.get("smtp_port") or 587)
+        use_tls = port == 465  # Implicit TLS port
+        return (
+            provider["smtp_host"],
+            port,
+            provider.get("smtp_username") or provider["email_address"],
+            provider.get("smtp_password", ""),
+            use_tls,
+            bool(provider.get("smtp_use_tls", True)) and not use_tls
+        )
+
+    async def _open_connection(self) -> aiosmtplib.SMTP:
+        """Open, upgrade and authenticate a new SMTP session"""
+        client = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            username=self.username if self.password else None,  # Unauthenticated relays
+            password=self.password or None,
+            use_tls=self.use_tls,
+            start_tls=self.start_tls,
+            timeout=self.timeout
+        )
+        await client.connect()
+        self.created_count += 1
+        logger.info(f"Opened SMTP session for provider {self.provider_id} ({self.hostname}:{self.port})")
+        return client
+
+    async def _close_connection(self, client: aiosmtplib.SMTP):
+        """Close an SMTP session, ignoring errors from already-dropped connections"""
+        try:
+            if client.is_connected:
+                await client.quit()
+        except Exception:
+            client.close()
+
+    async def _checkout(self) -> aiosmtplib.SMTP:
+        """Take an idle healthy session or open a new one"""
+        while self._idle:
+            client, last_used = self._idle.pop()
+            if client.is_connected and time.monotonic() - last_used < self.idle_timeout:
+                self.reused_count += 1
+                return client
+            await self._close_connection(client)
+        return await self._open_connection()
+
+    async def _checkin(self, client: aiosmtplib.SMTP):
+        """Return a session to the idle list, or close it if the pool was closed while it was out"""
+        if self.closed:
+            await self._close_connection(client)
+        elif client.is_connected:
+            self._idle.append((client, time.monotonic()))
+
+    @asynccontextmanager
+    async def connection(self):
+        """Borrow a session from the pool for the duration of the block"""
+        async with self._slots:
+            client = await self._checkout()
+            try:
+                yield client
+            except Exception:
+                # Never hand a session in an unknown protocol state to the next sender
+                await self._close_connection(client)
+                raise
+            else:
+                await self._checkin(client)
+
+    async def _send_prepared(self, client: aiosmtplib.SMTP, sender: str, recipients: List[str], message: PreparedMessage):
+        """Send prebuilt message bytes, re-encoding 8bit bodies for servers without 8BITMIME"""
+        if message.eight_bit:
+            if client.is_ehlo_or_helo_needed:
+                await client.ehlo()
+            if client.supports_extension("8bitmime"):
+                await client.sendmail(sender, recipients, message.data, mail_options=["BODY=8BITMIME"])
+                return
+            await client.sendmail(sender, recipients, message.as_7bit())
+            return
+        await client.sendmail(sender, recipients, message.data)
+
+    async def send(self, sender: str, recipients: List[str], message: Union[Message, PreparedMessage]) -> None:
+        """Send a message, retrying once on a fresh session if the pooled one was dropped"""
+        for attempt in range(2):
+            try:
+                async with self.connection() as client:
+                    if isinstance(message, PreparedMessage):
+                        await self._send_prepared(client, sender, recipients, message)
+                    else:
+                        await client.send_message(message, sender=sender, recipients=recipients)
+                return
+            except (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError) as e:
+                if attempt == 1:
+                    raise
+                logger.warning(f"SMTP session for provider {self.provider_id} dropped, retrying: {str(e)}")
+
+    async def close(self):
+        """Close all idle sessions; sessions still checked out are closed when they come back"""
+        self.closed = True
+        idle, self._idle = self._idle, []
+        for client, _ in idle:
+            await self._close_connection(client)
+
+    def get_stats(self) -> Dict:
+        """Get pool statistics"""
+        return {
+            "provider_id": self.provider_id,
+            "idle_connections": len(self._idle),
+            "max_size": self.max_size,
+            "connections_created": self.created_count,
+            "connections_reused": self.reused_count
+        }
+
+class SMTPDeliveryService:
+    """Delivers messages over pooled SMTP sessions with bounded concurrency per provider"""
+
+    def __init__(self):
+        self.pool_size = int(os.getenv("SMTP_POOL_SIZE", 5))
+        self.max_concurrency = int(os.getenv("SMTP_MAX_CONCURRENCY", 10))
+        self.idle_timeout = int(os.getenv("SMTP_IDLE_TIMEOUT", 240))
+        self.pools: Dict[str, SMTPConnectionPool] = {}
+
+    async def get_pool(self, provider: Dict) -> SMTPConnectionPool:
+        """Get the pool for a provider, rebuilding it if the SMTP settings changed"""
+        pool = self.pools.get(provider["id"])
+        if pool is not None and pool.signature == SMTPConnectionPool.provider_signature(provider):
+            return pool
+
+        stale = pool
+        pool = self.pools[provider["id"]] = SMTPConnectionPool(provider, self.pool_size, self.idle_timeout)
+        if stale is not None:
+            logger.info(f"SMTP settings changed for provider {provider['id']}, rebuilding pool")
+            await stale.close()
+        return pool
+
+    async def send_message(self, provider: Dict, message: Union[Message, PreparedMessage]) -> Tuple[bool, Optional[str]]:
+        """Send a single message through the provider's pool"""
+        recipient = message.to_email if isinstance(message, PreparedMessage) else message["To"]
+        try:
+            pool = await self.get_pool(provider)
+            await pool.send(provider["email_address"], [recipient], message)
+            return True, None
+        except (aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPRecipientRefused) as e:
+            logger.error(f"SMTP server via provider {provider.get('id')} refused {recipient}: {str(e)}")
+            return False, f"{RECIPIENT_REFUSED_ERROR}: {str(e)}"
+        except CONNECTION_EXCEPTIONS as e:
+            logger.error(f"SMTP connection error via provider {provider.get('id')} to {recipient}: {str(e)}")
+            return False, f"{CONNECTION_ERROR}: {str(e)}"
+        except Exception as e:
+            logger.error(f"SMTP send error via provider {provider.get('id')} to {recipient}: {str(e)}")
+            return False, str(e)
+
+    async def send_bulk(self, provider: Dict, messages: List[Union[Message, PreparedMessage]],
+                        concurrency: Optional[int] = None) -> List[Tuple[bool, Optional[str]]]:
+        """Send many messages concurrently; results are returned in input order"""
+        if not messages:
+            return []
+
+        # More in-flight sends than pooled sessions would only queue on the pool
+        limit = min(concurrency or self.max_concurrency, self.pool_size)
+        semaphore = asyncio.Semaphore(max(limit, 1))
+
+        async def _send(message: Union[Message, PreparedMessage]) -> Tuple[bool, Optional[str]]:
+            async with semaphore:
+                return await self.send_message(provider, message)
+
+        started_at = time.monotonic()
+        results = await asyncio.gather(*[_send(message) for message in messages])
+
+        duration = time.monotonic() - started_at
+        sent = len([r for r in results if r[0]])
+        logger.info(f"Provider {provider.get('id')}: delivered {sent}/{len(messages)} messages in {duration:.2f}s")
+        return list(results)
+
+    async def close_provider(self, provider_id: str):
+        """Close and forget the pool for a provider"""
+        pool = self.pools.pop(provider_id, None)
+        if pool:
+            await pool.close()
+
+    async def close_all(self):
+        """Close every pooled session"""
+        for provider_id in list(self.pools.keys()):
+            await self.close_provider(provider_id)
+
+    def get_stats(self) -> Dict:
+        """Get statistics for all provider pools"""
+        return {
+            "pool_size": self.pool_size,
+            "max_concurrency": self.max_concurrency,
+            "pools": [pool.get_stats() for pool in self.pools.values()]
+        }
+
+# Create global SMTP delivery service instance
+smtp_delivery_service = SMTPDeliveryService()
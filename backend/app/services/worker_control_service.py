@@ -0,0 +1,226 @@
+"""
+Worker Control Service - runs the background engines in this process, or drives app.worker processes through Mongo
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from app.services.campaign_send_service import campaign_send_job_runner
+from app.services.database import db_service
+from app.services.email_processor_fixed import email_processor_fixed as email_processor
+from app.services.smart_follow_up_engine_fixed import fixed_smart_follow_up_engine
+from app.services.lease_service import lease_service
+
+logger = logging.getLogger(__name__)
+
+SERVICES = ["smart_follow_up_engine", "email_processor", "campaign_send_job_runner"]
+
+class WorkerControlService:
+    """Starts, stops and reports the follow-up engine, email processor and send job runner.
+
+    With BACKGROUND_SERVICES_MODE=embedded (the default) they run inside the API
+    process. With "external" they run in `python -m app.worker` processes; the API
+    queues commands in worker_commands and reads health from the workers collection.
+    """
+
+    def __init__(self):
+        self.mode = os.getenv("BACKGROUND_SERVICES_MODE", "embedded").lower()
+        self.stale_after_seconds = int(os.getenv("WORKER_STALE_SECONDS", 30))
+
+    @property
+    def is_external(self) -> bool:
+        """Whether the engines run in separate worker processes"""
+        return self.mode == "external"
+
+    def _is_running(self, service: str) -> bool:
+        """Whether a service runs in this process"""
+        return {
+            "smart_follow_up_engine": fixed_smart_follow_up_engine.processing,
+            "email_processor": email_processor.processing,
+            "campaign_send_job_runner": campaign_send_job_runner.processing
+        }[service]
+
+    async def start_local(self, services: Optional[List[str]] = None) -> Dict:
+        """Start services in this process"""
+        results = {}
+        for service in services or SERVICES:
+            if self._is_running(service):
+                results[service] = {"status": "already_running"}
+            elif service == "smart_follow_up_engine":
+                results[service] = await fixed_smart_follow_up_engine.start_follow_up_engine()
+            elif service == "email_processor":
+                results[service] = await email_processor.start_monitoring()
+            elif service == "campaign_send_job_runner":
+                results[service] = await campaign_send_job_runner.start_job_runner()
+        return results
+
+    async def stop_local(self, services: Optional[List[str]] = None) -> Dict:
+        """Stop services in this process"""
+        results = {}
+        for service in services or SERVICES:
+            if service == "smart_follow_up_engine":
+                results[service] = await fixed_smart_follow_up_engine.stop_follow_up_engine()
+            elif service == "email_processor":
+                results[service] = await email_processor.stop_monitoring()
+            elif service == "campaign_send_job_runner":
+                results[service] = await campaign_send_job_runner.stop_job_runner()
+        return results
+
+    async def _send_command(self, command: str, **command_data) -> Dict:
+        """Queue a command for the worker processes"""
+        created = await db_service.create_worker_command({"command": command, **command_data})
+        logger.info(f"Queued worker command {command} ({created['id']})")
+        return {"status": "command_queued", "command_id": created["id"]}
+
+    async def start_services(self, services: Optional[List[str]] = None) -> Dict:
+        """Start services wherever they run"""
+        if self.is_external:
+            result = await self._send_command("start", services=services or SERVICES)
+            return {service: result for service in services or SERVICES}
+        return await self.start_local(services)
+
+    async def stop_services(self, services: Optional[List[str]] = None) -> Dict:
+        """Stop services wherever they run"""
+        if self.is_external:
+            result = await self._send_command("stop", services=services or SERVICES)
+            return {service: result for service in services or SERVICES}
+        return await self.stop_local(services)
+
+    async def add_provider(self, provider_id: str, provider_data: Dict):
+        """Start IMAP monitoring of a provider if the email processor is running"""
+        if self.is_external:
+            await self._send_command("add_provider", provider_id=provider_id)
+        elif email_processor.processing:
+            await email_processor.add_provider_to_monitoring(provider_id, provider_data)
+
+    async def remove_provider(self, provider_id: str):
+        """Stop IMAP monitoring of a provider"""
+        if self.is_external:
+            await self._send_command("remove_provider", provider_id=provider_id)
+        else:
+            await email_processor.remove_provider_from_monitoring(provider_id)
+
+    async def apply_command(self, command: Dict) -> Dict:
+        """Carry out a queued command in this (worker) process"""
+        name = command.get("command")
+        if name == "start":
+            return await self.start_local(command.get("services"))
+        if name == "stop":
+            return await self.stop_local(command.get("services"))
+        if name == "add_provider":
+            if email_processor.processing:
+                provider = await db_service.get_email_provider_by_id(command["provider_id"])
+                if provider:
+                    await email_processor.add_provider_to_monitoring(command["provider_id"], provider)
+            return {"status": "applied"}
+        if name == "remove_provider":
+            await email_processor.remove_provider_from_monitoring(command["provider_id"])
+            return {"status": "applied"}
+        return {"status": "unknown_command"}
+
+    def local_status(self) -> Dict:
+        """Status of the services in this process"""
+        from app.services.smtp_delivery_service import smtp_delivery_service
+        from app.services.imap_client_service import imap_client_service
+        from app.services.groq_service import groq_gateway
+        from app.services.blob_store_service import blob_store_service
+        from app.services.provider_pool_service import provider_pool_service
+
+        monitored_providers_info = []
+        for provider_id, provider_config in email_processor.monitored_providers.items():
+            monitored_providers_info.append({
+                "id": provider_id,
+                "name": provider_config["name"],
+                "provider_type": provider_config["provider_type"],
+                "last_scan": provider_config["last_scan"].isoformat() if provider_config["last_scan"] else None,
+                "imap_host": provider_config["imap_host"],
+                "lease_held": lease_service.is_held(f"imap:{provider_id}")
+            })
+
+        return {
+            "smart_follow_up_engine": {
+                "status": "running" if fixed_smart_follow_up_engine.processing else "stopped",
+                "description": "FIXED - Handles automatic follow-up emails - STOPS immediately when replies received",
+                "schedule": fixed_smart_follow_up_engine.get_schedule_stats()
+            },
+            "email_processor": {
+                "status": "running" if email_processor.processing else "stopped",
+                "description": "FIXED - Handles automatic email responses (auto-responder) - RESPONDS to ALL emails",
+                "monitored_providers_count": len(monitored_providers_info),
+                "monitored_providers": monitored_providers_info,
+                "inbound_pipeline": email_processor.get_pipeline_stats()
+            },
+            "campaign_send_job_runner": {
+                **campaign_send_job_runner.get_status(),
+                "description": "Delivers queued campaign send jobs in the background and resumes them after restarts"
+            },
+            "smtp_delivery": smtp_delivery_service.get_stats(),
+            "imap_connections": imap_client_service.get_stats(),
+            "groq_gateway": groq_gateway.get_stats(),
+            "config_cache": db_service.get_config_cache_stats(),
+            "leases": lease_service.get_stats(),
+            "blob_store": blob_store_service.get_stats(),
+            "provider_pool": provider_pool_service.get_stats()
+        }
+
+    async def get_workers(self) -> List[Dict]:
+        """Worker status documents, flagged alive when their heartbeat is recent"""
+        stale_before = datetime.utcnow() - timedelta(seconds=self.stale_after_seconds)
+        workers = await db_service.get_workers()
+        for worker in workers:
+            worker["alive"] = worker.get("heartbeat_at") is not None and worker["heartbeat_at"] >= stale_before
+        return workers
+
+    async def get_provider_monitoring(self, provider_id: str) -> Dict:
+        """Whether a provider's inbox is monitored and its IMAP lease held: here when embedded, by a live worker when external"""
+        if not self.is_external:
+            is_monitoring = email_processor.is_provider_being_monitored(provider_id)
+            lease_held = lease_service.is_held(f"imap:{provider_id}")
+            return {
+                "is_monitoring": is_monitoring,
+                "lease_held": lease_held,
+                "email_processor_running": email_processor.processing,
+                "monitored_on": [lease_service.worker_id] if is_monitoring else [],
+                "lease_holder": lease_service.worker_id if lease_held else None
+            }
+
+        monitored_on, lease_holder, processor_running = [], None, False
+        for worker in await self.get_workers():
+            if not worker["alive"]:
+                continue
+            processor = worker.get("services", {}).get("email_processor") or {}
+            processor_running = processor_running or processor.get("status") == "running"
+            for provider in processor.get("monitored_providers", []):
+                if provider.get("id") == provider_id:
+                    monitored_on.append(worker["worker_id"])
+                    if provider.get("lease_held"):
+                        lease_holder = worker["worker_id"]
+        return {
+            "is_monitoring": bool(monitored_on),
+            "lease_held": lease_holder is not None,
+            "email_processor_running": processor_running,
+            "monitored_on": monitored_on,
+            "lease_holder": lease_holder
+        }
+
+    async def get_services_status(self) -> Dict:
+        """Service status for the API: this process when embedded, the live workers when external"""
+        if not self.is_external:
+            return self.local_status()
+
+        live_workers = [worker for worker in await self.get_workers() if worker["alive"]]
+        services = {}
+        for service in SERVICES:
+            running_on = [
+                worker["worker_id"] for worker in live_workers
+                if worker.get("services", {}).get(service, {}).get("status") == "running"
+            ]
+            services[service] = {
+                "status": "running" if running_on else "stopped",
+                "running_on": running_on,
+                "workers": {worker["worker_id"]: worker.get("services", {}).get(service) for worker in live_workers}
+            }
+        return services
+
+# Create global worker control service instance
+worker_control_service = WorkerControlService()
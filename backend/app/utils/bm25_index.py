@@ -0,0 +1,226 @@
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+STOP_WORDS = frozenset({
+    "the", "is", "at", "which", "on", "and", "a", "to", "are", "as", "was", "with",
+    "for", "his", "her", "that", "of", "in", "it", "you", "i", "will", "be", "can",
+    "have", "has", "had", "do", "does", "did", "would", "could", "should", "may",
+    "might", "must", "shall", "am", "were", "being", "been", "get", "got", "make", "made",
+    "an", "or", "by", "from", "this", "we", "our", "your", "they", "their", "not", "but"
+})
+
+_NO_TERMS = np.empty(0, dtype=np.int32)
+_NO_FREQUENCIES = np.empty(0, dtype=np.float32)
+
+Segment = Tuple[np.ndarray, np.ndarray, np.ndarray]  # (offsets per term, rows, term frequencies)
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens, without stop words and single characters"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) > 1 and token not in STOP_WORDS]
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    """Array with room for at least size entries, doubling so appends stay amortized O(1)"""
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(size, len(array) * 2), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+def _build_segment(row_terms: List[np.ndarray], row_frequencies: List[np.ndarray],
+                   rows: Sequence[int], term_count: int) -> Segment:
+    """Term-major postings of the given rows: the postings of term t are rows[offsets[t]:offsets[t + 1]]"""
+    terms = [row_terms[row] for row in rows]
+    sizes = np.fromiter((len(row) for row in terms), dtype=np.int64, count=len(terms))
+    all_terms = np.concatenate(terms) if terms else _NO_TERMS
+    all_frequencies = np.concatenate([row_frequencies[row] for row in rows]) if terms else _NO_FREQUENCIES
+    all_rows = np.repeat(np.asarray(rows, dtype=np.int32), sizes)
+
+    order = np.argsort(all_terms, kind="stable")
+    offsets = np.zeros(term_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(all_terms, minlength=term_count), out=offsets[1:])
+    return offsets, all_rows[order], all_frequencies[order]
+
+class BM25Index:
+    """In-memory BM25 index with incremental adds and removes.
+
+    Postings live in contiguous NumPy arrays ordered by term, so a query only touches the
+    postings of its own terms. Documents added since the last compact() go to a small delta
+    segment that is rebuilt lazily on the next search; removed documents are masked out until
+    then. Document frequencies and lengths are kept exact, so scores never go stale.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms: Dict[str, int] = {}
+        self.categories: Dict[str, int] = {}
+        self.doc_ids: List[Optional[str]] = []  # Row -> document id, None once removed
+        self.rows: Dict[str, int] = {}
+        self.row_terms: List[np.ndarray] = []
+        self.row_frequencies: List[np.ndarray] = []
+        self.live_count = 0
+        self.total_length = 0.0
+
+        self._df = np.zeros(1024, dtype=np.int64)
+        self._lengths = np.zeros(1024, dtype=np.float32)
+        self._alive = np.zeros(1024, dtype=bool)
+        self._active = np.zeros(1024, dtype=bool)
+        self._category = np.zeros(1024, dtype=np.int32)
+        self._main: Tuple[Segment, int] = (_build_segment([], [], [], 0), 0)  # (segment, rows it covers)
+        self._main_removed = 0
+        self._delta: Optional[Tuple[int, Segment]] = None  # (main rows it was built for, segment)
+
+    def _term_id(self, term: str) -> int:
+        """Id of a term, assigned on first sight"""
+        term_id = self.terms.get(term)
+        if term_id is None:
+            term_id = self.terms[term] = len(self.terms)
+        return term_id
+
+    def add(self, doc_id: str, counts: Dict[str, int], category: Optional[str] = None, active: bool = True):
+        """Index a document from its term counts, replacing an earlier version"""
+        self.remove(doc_id)
+        term_ids = np.fromiter((self._term_id(term) for term in counts), dtype=np.int32, count=len(counts))
+        frequencies = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+
+        row = len(self.doc_ids)
+        self._df = _grow(self._df, len(self.terms))
+        self._lengths, self._alive, self._active, self._category = (
+            _grow(array, row + 1) for array in (self._lengths, self._alive, self._active, self._category)
+        )
+        self.doc_ids.append(doc_id)
+        self.rows[doc_id] = row
+        self.row_terms.append(term_ids)
+        self.row_frequencies.append(frequencies)
+
+        length = float(frequencies.sum())
+        self._lengths[row] = length
+        self._alive[row] = True
+        self._active[row] = active
+        self._category[row] = self.categories.setdefault(category or "", len(self.categories))
+        self._df[term_ids] += 1
+        self.live_count += 1
+        self.total_length += length
+        self._delta = None
+
+    def remove(self, doc_id: str) -> bool:
+        """Drop a document; returns False when it was not indexed"""
+        row = self.rows.pop(doc_id, None)
+        if row is None:
+            return False
+        self._df[self.row_terms[row]] -= 1
+        self._alive[row] = False
+        self.live_count -= 1
+        self.total_length -= float(self._lengths[row])
+        self.doc_ids[row] = None
+        self.row_terms[row] = _NO_TERMS
+        self.row_frequencies[row] = _NO_FREQUENCIES
+        if row < self._main[1]:
+            self._main_removed += 1
+        else:
+            self._delta = None
+        return True
+
+    @property
+    def pending(self) -> int:
+        """Rows outside the main segment plus removed rows still inside it"""
+        return len(self.doc_ids) - self._main[1] + self._main_removed
+
+    def compact(self):
+        """Rebuild the main segment from every live document; safe to run in a worker thread"""
+        row_count = len(self.doc_ids)
+        rows = np.flatnonzero(self._alive[:row_count]).tolist()
+        segment = _build_segment(self.row_terms, self.row_frequencies, rows, len(self.terms))
+        self._main = (segment, row_count)  # One assignment, so a concurrent search sees old or new
+        self._main_removed = int((~self._alive[rows]).sum()) if rows else 0  # Removed while building
+
+    def _segments(self) -> List[Segment]:
+        """Main segment plus the delta segment, rebuilt if documents changed since the last search"""
+        main, main_rows = self._main
+        if self._delta is None or self._delta[0] != main_rows:
+            rows = [row for row in range(main_rows, len(self.doc_ids)) if self._alive[row]]
+            self._delta = (main_rows, _build_segment(self.row_terms, self.row_frequencies, rows, len(self.terms)))
+        return [main, self._delta[1]]
+
+    def _query_terms(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Known query term ids and their BM25 idf"""
+        term_ids = np.array(sorted({self.terms[token] for token in tokenize(query) if token in self.terms}), dtype=np.int64)
+        term_ids = term_ids[self._df[term_ids] > 0] if len(term_ids) else term_ids
+        df = self._df[term_ids]
+        return term_ids, np.log1p((self.live_count - df + 0.5) / (df + 0.5))
+
+    def _term_scores(self, frequencies: np.ndarray, rows: np.ndarray, idf: float, average_length: float) -> np.ndarray:
+        """BM25 contribution of one term for the given postings"""
+        norm = self.k1 * (1.0 - self.b + self.b * self._lengths[rows] / average_length)
+        return idf * frequencies * (self.k1 + 1.0) / (frequencies + norm)
+
+    def search(self, query: str, limit: int = 10, category: Optional[str] = None,
+               active_only: bool = True) -> List[Tuple[str, float]]:
+        """Top documents for a query as (doc_id, score), best first.
+
+        Scores are BM25 divided by the query's upper bound, so they fall between 0 and 1 and
+        stay comparable across queries.
+        """
+        if not self.live_count or limit <= 0:
+            return []
+        term_ids, idf = self._query_terms(query)
+        if not len(term_ids):
+            return []
+
+        average_length = self.total_length / self.live_count
+        posting_rows, posting_scores = [], []
+        for offsets, rows, frequencies in self._segments():
+            for term_id, term_idf in zip(term_ids, idf):
+                if term_id + 1 >= len(offsets):
+                    continue  # Term first seen after this segment was built
+                start, end = offsets[term_id], offsets[term_id + 1]
+                if start < end:
+                    posting_rows.append(rows[start:end])
+                    posting_scores.append(self._term_scores(frequencies[start:end], rows[start:end], term_idf, average_length))
+        if not posting_rows:
+            return []
+
+        scores = np.bincount(np.concatenate(posting_rows), weights=np.concatenate(posting_scores))
+        candidates = np.flatnonzero(scores)
+        keep = self._alive[candidates]
+        if active_only:
+            keep &= self._active[candidates]
+        if category is not None:
+            keep &= self._category[candidates] == self.categories.get(category, -1)
+        candidates = candidates[keep]
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        upper_bound = float(idf.sum()) * (self.k1 + 1.0)
+        return [(self.doc_ids[row], float(scores[row]) / upper_bound) for row in candidates]
+
+    def score(self, query: str, doc_id: str) -> float:
+        """Normalized score of one document for a query, 0 when it is not indexed or does not match"""
+        row = self.rows.get(doc_id)
+        if row is None:
+            return 0.0
+        term_ids, idf = self._query_terms(query)
+        if not len(term_ids):
+            return 0.0
+        matches = np.isin(self.row_terms[row], term_ids)
+        frequencies = np.zeros(len(term_ids), dtype=np.float32)
+        frequencies[np.searchsorted(term_ids, self.row_terms[row][matches])] = self.row_frequencies[row][matches]
+        rows = np.full(len(term_ids), row)
+        total = self._term_scores(frequencies, rows, idf, self.total_length / self.live_count).sum()
+        return float(total) / (float(idf.sum()) * (self.k1 + 1.0))
+
+    def get_stats(self) -> Dict:
+        """Get index size statistics"""
+        (offsets, rows, frequencies), main_rows = self._main
+        return {
+            "documents": self.live_count,
+            "terms": len(self.terms),
+            "postings": int(len(rows)),
+            "pending_rows": self.pending,
+            "average_length": round(self.total_length / self.live_count, 1) if self.live_count else 0.0,
+            "postings_mb": round((offsets.nbytes + rows.nbytes + frequencies.nbytes) / 1024 / 1024, 1)
+        }
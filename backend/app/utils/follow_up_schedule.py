@@ -0,0 +1,194 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import numpy as np
+import pytz
+
+# A datetime-scheduled follow-up is only sent within this many seconds of its target
+DATETIME_SCHEDULE_WINDOW = 60
+
+def get_follow_up_intervals(campaign: Dict, follow_up_rule: Optional[Dict]) -> List[int]:
+    """Follow-up intervals in minutes: the rule's trigger, else the campaign's list"""
+    if follow_up_rule:
+        return [follow_up_rule["trigger_after_days"]]
+    return campaign.get("follow_up_intervals", [3, 7, 14])
+
+def _to_utc(value, tz) -> datetime:
+    """Read a naive (campaign time zone) or aware datetime or ISO string as naive UTC"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = tz.localize(value)
+    return value.astimezone(pytz.UTC).replace(tzinfo=None)
+
+def compute_next_follow_up_at(campaign: Dict, follow_up_rule: Optional[Dict], follow_up_count: int,
+                              reference_time: Optional[datetime], now: Optional[datetime] = None,
+                              schedule: Optional["CompiledFollowUpSchedule"] = None) -> Optional[datetime]:
+    """When follow-up number follow_up_count + 1 becomes due, as naive UTC.
+
+    Mirrors the timing rules of the follow-up engine: datetime schedules use the
+    campaign's follow_up_dates, everything else (including follow-ups past the last
+    date) adds the next interval to the time of the last email and is moved to the
+    next time the send windows are open. Returns None when nothing more can be sent.
+    """
+    now = now or datetime.utcnow()
+    tz = pytz.timezone(campaign.get("follow_up_timezone", "UTC"))
+
+    follow_up_dates = campaign.get("follow_up_dates") or []
+    is_datetime_schedule = campaign.get("follow_up_schedule_type", "interval") == "datetime"
+    if is_datetime_schedule and follow_up_count < len(follow_up_dates):
+        target = _to_utc(follow_up_dates[follow_up_count], tz)
+        if (now - target).total_seconds() > DATETIME_SCHEDULE_WINDOW:
+            return None  # Missed its window; the engine never sends late datetime follow-ups
+        return target
+
+    intervals = get_follow_up_intervals(campaign, follow_up_rule)
+    if not reference_time or not intervals:
+        return None
+
+    interval_value = intervals[follow_up_count] if follow_up_count < len(intervals) else intervals[-1]
+
+    # Intervals are minutes; the engine reads values >= 1440 as days, which is the same duration
+    due_at = _to_utc(reference_time, pytz.UTC) + timedelta(minutes=interval_value)
+    schedule = schedule or CompiledFollowUpSchedule(campaign, follow_up_rule)
+    return schedule.next_window_open(max(due_at, now))
+
+_WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+_ALL_DAYS = np.ones(7, dtype=bool)
+
+def _day_mask(days: List[str]) -> np.ndarray:
+    """Monday-first boolean mask of allowed weekdays"""
+    allowed = {day.lower() for day in days}
+    return np.array([day in allowed for day in _WEEKDAYS], dtype=bool)
+
+def _minute_of_day(value: str) -> int:
+    """Minutes since midnight of an "HH:MM" string"""
+    hours, minutes = value.split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+def _to_datetime64(value) -> np.datetime64:
+    """Naive UTC datetime (or ISO string) as datetime64[ms]; NaT when missing"""
+    if not value:
+        return np.datetime64("NaT", "ms")
+    return np.datetime64(_to_utc(value, pytz.UTC), "ms")
+
+class CompiledFollowUpSchedule:
+    """A campaign's follow-up timing resolved once into UTC arrays and window masks.
+
+    Decides which prospects of a batch are due with a few NumPy comparisons instead
+    of per-prospect time zone conversion and date parsing. Decisions match the
+    engine's original rules: datetime schedules send within a minute of the target,
+    interval schedules once the interval has passed since the last email, and both
+    only inside the campaign's (and for intervals the rule's) sending window.
+    """
+
+    def __init__(self, campaign: Dict, follow_up_rule: Optional[Dict]):
+        self.tz = pytz.timezone(campaign.get("follow_up_timezone", "UTC"))
+        self.max_follow_ups = follow_up_rule.get("max_follow_ups", 3) if follow_up_rule else 3
+        self.intervals = np.array(get_follow_up_intervals(campaign, follow_up_rule), dtype="int64") * 60_000  # ms
+
+        self.targets = None
+        if campaign.get("follow_up_schedule_type", "interval") == "datetime" and campaign.get("follow_up_dates"):
+            self.targets = np.array([_to_datetime64(_to_utc(value, self.tz)) for value in campaign["follow_up_dates"]])
+
+        try:
+            self.campaign_days = _day_mask(campaign.get("follow_up_days_of_week", _WEEKDAYS))
+            self.campaign_window = (
+                _minute_of_day(campaign.get("follow_up_time_window_start", "00:00")),  # Allow 24/7 by default
+                _minute_of_day(campaign.get("follow_up_time_window_end", "23:59"))
+            )
+        except Exception:
+            self.campaign_days, self.campaign_window = _ALL_DAYS, None  # Default to allowing send
+
+        self.rule_days, self.rule_window = _ALL_DAYS, None
+        if follow_up_rule:
+            try:
+                self.rule_days = _day_mask(follow_up_rule.get("send_days", _WEEKDAYS[:5]))
+                if follow_up_rule.get("exclude_weekends", True):
+                    self.rule_days = self.rule_days & _day_mask(_WEEKDAYS[:5])
+                self.rule_window = (
+                    _minute_of_day(follow_up_rule.get("send_time_start", "09:00")),
+                    _minute_of_day(follow_up_rule.get("send_time_end", "17:00"))
+                )
+            except Exception:
+                self.rule_days, self.rule_window = _ALL_DAYS, None
+
+    @staticmethod
+    def _in_window(moment: datetime, days: np.ndarray, window) -> bool:
+        """Whether a wall-clock time falls on an allowed day and inside the HH:MM window"""
+        if not days[moment.weekday()]:
+            return False
+        minute = moment.hour * 60 + moment.minute
+        return window is None or window[0] <= minute <= window[1]
+
+    @classmethod
+    def _next_opening(cls, moment: datetime, days: np.ndarray, window) -> Optional[datetime]:
+        """First wall-clock time at or after moment inside the day and HH:MM window; None if never"""
+        if not days.any() or (window is not None and window[0] > window[1]):
+            return None
+        if cls._in_window(moment, days, window):
+            return moment
+        start = window[0] if window else 0
+        for offset in range(8):
+            day = moment + timedelta(days=offset)
+            opening = day.replace(hour=start // 60, minute=start % 60, second=0, microsecond=0)
+            if days[day.weekday()] and opening > moment:
+                return opening
+        return None
+
+    def next_window_open(self, after: datetime) -> Optional[datetime]:
+        """First naive UTC time at or after `after` inside both the campaign window (in its
+        time zone) and the rule window; None when the two never open together"""
+        moment = after
+        for _ in range(16):
+            local = pytz.UTC.localize(moment).astimezone(self.tz).replace(tzinfo=None)
+            campaign_opening = self._next_opening(local, self.campaign_days, self.campaign_window)
+            if campaign_opening is None:
+                return None
+            if campaign_opening != local:
+                moment = max(_to_utc(campaign_opening, self.tz), moment)
+                continue
+
+            rule_opening = self._next_opening(moment, self.rule_days, self.rule_window)
+            if rule_opening is None:
+                return None
+            if rule_opening == moment:
+                return moment
+            moment = rule_opening
+        return None
+
+    def due_mask(self, prospects: List[Dict], now: Optional[datetime] = None) -> np.ndarray:
+        """Boolean array: which prospects should get their next follow-up right now"""
+        now = now or datetime.utcnow()
+        if not prospects:
+            return np.zeros(0, dtype=bool)
+
+        # The windows depend only on the current time, so they are checked once for the batch
+        in_campaign_window = self._in_window(pytz.UTC.localize(now).astimezone(self.tz), self.campaign_days, self.campaign_window)
+        if not in_campaign_window:
+            return np.zeros(len(prospects), dtype=bool)
+        in_rule_window = self._in_window(now, self.rule_days, self.rule_window)
+
+        now64 = np.datetime64(now, "ms")
+        counts = np.array([prospect.get("follow_up_count", 0) for prospect in prospects], dtype="int64")
+        references = np.array([
+            _to_datetime64(prospect.get("last_follow_up") or prospect.get("last_contact") or prospect.get("created_at"))
+            for prospect in prospects
+        ])
+
+        # Interval schedule: the interval for this follow-up has passed since the last email;
+        # without intervals there is no interval schedule at all
+        if len(self.intervals):
+            interval = self.intervals[np.minimum(counts, len(self.intervals) - 1)]
+            elapsed = (now64 - references).astype("int64")
+            due = ~np.isnat(references) & (elapsed >= interval) & in_rule_window
+        else:
+            due = np.zeros(len(prospects), dtype=bool)
+
+        if self.targets is not None:
+            # Datetime schedule: within a minute of this follow-up's target; past the last date intervals apply
+            has_target = counts < len(self.targets)
+            targets = self.targets[np.minimum(counts, len(self.targets) - 1)]
+            near_target = np.abs((now64 - targets).astype("int64")) <= DATETIME_SCHEDULE_WINDOW * 1000
+            due = np.where(has_target, near_target, due)
+
+        return due
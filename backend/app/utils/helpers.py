@@ -2,7 +2,7 @@ import uuid
 import aiosmtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from jinja2 import Template
+from app.utils.template_renderer import template_renderer
 import os
 
 def generate_id():
@@ -49,19 +49,5 @@ async def send_email(to_email: str, subject: str, content: str):
         raise Exception(error_msg)
 
 def personalize_template(template_content: str, prospect: dict) -> str:
-    """Personalize template with prospect data"""
-    try:
-        template = Template(template_content)
-        return template.render(
-            first_name=prospect.get("first_name", ""),
-            last_name=prospect.get("last_name", ""),
-            company=prospect.get("company", ""),
-            email=prospect.get("email", ""),
-            industry=prospect.get("industry", "Technology"),
-            job_title=prospect.get("job_title", ""),
-            phone=prospect.get("phone", ""),
-            location=prospect.get("location", "")
-        )
-    except Exception as e:
-        print(f"Template personalization failed: {str(e)}")
-        return template_content
\ No newline at end of file
+    """Personalize template with prospect data; compiled templates are cached by template_renderer"""
+    return template_renderer.render(template_content, prospect)
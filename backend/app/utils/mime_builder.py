@@ -0,0 +1,152 @@
+import base64
+import os
+import secrets
+from email.header import Header
+from email.utils import formataddr, formatdate, make_msgid
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+from app.utils.cache import LRUTTLCache
+
+CRLF = b"\r\n"
+MAX_LINE = 998  # Octets per line SMTP allows, excluding CRLF
+TRANSFER_ENCODINGS = (b"7bit", b"8bit", b"base64")
+
+def _header(name: str, value: str) -> bytes:
+    """Header line, RFC 2047 encoded and folded only when it needs to be"""
+    value = value.replace("\r", " ").replace("\n", " ")  # No header injection through recipient data
+    if value.isascii() and len(name) + len(value) < 76:
+        return f"{name}: {value}\r\n".encode("ascii")
+    encoded = Header(value, "us-ascii" if value.isascii() else "utf-8", header_name=name).encode(linesep="\r\n")
+    return f"{name}: {encoded}\r\n".encode("ascii")
+
+def _has_long_line(raw: bytes) -> bool:
+    """Whether CRLF-terminated text has a line over MAX_LINE octets, jumping a window at a time"""
+    start = 0
+    while len(raw) - start > MAX_LINE:
+        newline = raw.rfind(b"\n", start, start + MAX_LINE + 2)
+        if newline == -1:
+            return True
+        start = newline + 1
+    return False
+
+class PreparedMessage:
+    """Serialized message ready for SMTP sendmail"""
+
+    __slots__ = ("to_email", "data", "eight_bit", "_rebuild")
+
+    def __init__(self, to_email: str, data: bytes, eight_bit: bool = False,
+                 rebuild: Optional[Callable[[], "PreparedMessage"]] = None):
+        self.to_email = to_email
+        self.data = data
+        self.eight_bit = eight_bit
+        self._rebuild = rebuild
+
+    def as_7bit(self) -> bytes:
+        """Message bytes without 8bit parts, for servers that do not advertise 8BITMIME"""
+        return self._rebuild().data if self.eight_bit else self.data
+
+class MessageBuilder:
+    """Serializes multipart/alternative messages straight to bytes, reusing everything that is not per recipient.
+
+    The From header, boundary and part headers are encoded once per provider, and encoded bodies
+    are kept in a small LRU keyed by their text, so a body shared by a whole batch is encoded once.
+    Per recipient only To, Subject, Date and Message-ID are encoded and spliced in. Bodies go out
+    as 7bit or 8bit text when their lines allow it, which needs no encoding pass at all, and as
+    base64 otherwise.
+    """
+
+    def __init__(self):
+        self.allow_8bit = os.getenv("SMTP_ALLOW_8BIT", "true").lower() == "true"
+        self.envelopes = LRUTTLCache(max_size=int(os.getenv("MIME_ENVELOPE_CACHE_SIZE", 256)), ttl=86400)
+        self.bodies = LRUTTLCache(max_size=int(os.getenv("MIME_BODY_CACHE_SIZE", 64)), ttl=3600)
+
+    def _envelope(self, provider: Dict) -> Dict:
+        """Encoded headers shared by every message of a provider"""
+        display_name = provider.get("display_name") or ""
+        email_address = provider["email_address"]
+        key = (provider.get("id"), display_name, email_address)
+        envelope = self.envelopes.get(key)
+        if envelope is not None:
+            return envelope
+
+        boundary = f"=_{secrets.token_hex(16)}".encode("ascii")  # "=_" never occurs in base64 output
+        envelope = {
+            "boundary": boundary,
+            "domain": email_address.rpartition("@")[2] or None,
+            "head": b"".join([
+                _header("From", formataddr((display_name, email_address), charset="utf-8")),
+                b"MIME-Version: 1.0\r\n",
+                b'Content-Type: multipart/alternative; boundary="' + boundary + b'"\r\n'
+            ]),
+            "parts": {
+                (subtype, encoding): b"".join([
+                    b"--", boundary, CRLF,
+                    b'Content-Type: text/', subtype.encode("ascii"), b'; charset="utf-8"\r\n',
+                    b"Content-Transfer-Encoding: ", encoding, CRLF, CRLF
+                ])
+                for subtype in ("plain", "html")
+                for encoding in TRANSFER_ENCODINGS
+            },
+            "close": b"--" + boundary + b"--\r\n"
+        }
+        self.envelopes.set(key, envelope)
+        return envelope
+
+    def _encode_body(self, text: str, boundary: bytes, allow_8bit: bool) -> Tuple[bytes, bytes]:
+        """Transfer encoding and encoded bytes of a body, from the cache when the same text was encoded before"""
+        key = (text, boundary, allow_8bit)
+        cached = self.bodies.get(key)
+        if cached is not None:
+            return cached
+
+        raw = text.encode("utf-8", "replace")
+        if b"\r" in raw:
+            raw = raw.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        raw = raw.replace(b"\n", CRLF)
+
+        if _has_long_line(raw) or boundary in raw:
+            encoded = (b"base64", base64.encodebytes(raw).replace(b"\n", CRLF))
+        elif raw.isascii():
+            encoded = (b"7bit", raw)
+        elif allow_8bit:
+            encoded = (b"8bit", raw)
+        else:
+            encoded = (b"base64", base64.encodebytes(raw).replace(b"\n", CRLF))
+        self.bodies.set(key, encoded)
+        return encoded
+
+    def build(self, provider: Dict, to_email: str, subject: str, content: str,
+              content_type: str = "html", html_content: Optional[str] = None,
+              allow_8bit: Optional[bool] = None) -> PreparedMessage:
+        """Build the bytes of a message from a provider; html_content makes content the plain text alternative"""
+        allow_8bit = self.allow_8bit if allow_8bit is None else allow_8bit
+        envelope = self._envelope(provider)
+        if html_content:
+            bodies = [("plain", content), ("html", html_content)]
+        else:
+            bodies = [("html" if content_type == "html" else "plain", content)]
+
+        chunks: List[bytes] = [
+            envelope["head"],
+            _header("To", to_email),
+            _header("Subject", subject or ""),
+            b"Date: ", formatdate(usegmt=True).encode("ascii"), CRLF,
+            b"Message-ID: ", make_msgid(domain=envelope["domain"]).encode("ascii"), CRLF,
+            CRLF
+        ]
+        eight_bit = False
+        for subtype, text in bodies:
+            encoding, body = self._encode_body(text or "", envelope["boundary"], allow_8bit)
+            eight_bit = eight_bit or encoding == b"8bit"
+            chunks += [envelope["parts"][(subtype, encoding)], body, CRLF]
+        chunks.append(envelope["close"])
+
+        rebuild = partial(self.build, provider, to_email, subject, content, content_type, html_content, False) if eight_bit else None
+        return PreparedMessage(to_email, b"".join(chunks), eight_bit, rebuild)
+
+    def get_stats(self) -> Dict:
+        """Get envelope and body cache statistics"""
+        return {"envelopes": self.envelopes.get_stats(), "bodies": self.bodies.get_stats()}
+
+# Create global message builder instance
+message_builder = MessageBuilder()
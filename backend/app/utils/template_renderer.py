@@ -0,0 +1,99 @@
+import logging
+import os
+from typing import Any, Dict, Hashable, List, Optional
+from jinja2 import Environment
+from app.utils.cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_FIELDS = ["subject", "content", "html_content"]
+TEMPLATE_MARKERS = ("{{", "{%", "{#")
+
+def template_context(prospect: Dict, **extra: Any) -> Dict[str, Any]:
+    """Variables available to templates for a prospect"""
+    return {
+        "first_name": prospect.get("first_name", ""),
+        "last_name": prospect.get("last_name", ""),
+        "company": prospect.get("company", ""),
+        "email": prospect.get("email", ""),
+        "industry": prospect.get("industry", "Technology"),
+        "job_title": prospect.get("job_title", ""),
+        "phone": prospect.get("phone", ""),
+        "location": prospect.get("location", ""),
+        **extra
+    }
+
+class TemplateRenderer:
+    """Renders Jinja templates compiled once per template version and kept in a bounded LRU cache.
+
+    Stored templates are cached under (id, updated_at, field); ad hoc text under the text itself,
+    in a separate smaller cache so one-off AI or follow-up text cannot evict campaign templates.
+    A cached entry is only used when its source still matches, so a template edited without
+    touching updated_at is recompiled instead of rendering stale content.
+    """
+
+    def __init__(self):
+        self.environment = Environment(cache_size=0)  # These caches replace Jinja's own
+        ttl = float(os.getenv("TEMPLATE_CACHE_TTL", 86400))
+        self.cache = LRUTTLCache(max_size=int(os.getenv("TEMPLATE_CACHE_SIZE", 512)), ttl=ttl)
+        self.adhoc_cache = LRUTTLCache(max_size=int(os.getenv("TEMPLATE_ADHOC_CACHE_SIZE", 64)), ttl=ttl)
+        self.compile_count = 0
+
+    def _compile(self, source: str, key: Optional[Hashable] = None):
+        """Compiled template for source, or None when it cannot be compiled"""
+        cache, cache_key = (self.cache, key) if key is not None else (self.adhoc_cache, source)
+        cached = cache.get(cache_key)
+        if cached is not None and cached[0] == source:
+            return cached[1]
+
+        try:
+            compiled = self.environment.from_string(source)
+        except Exception as e:
+            logger.error(f"Template compilation failed: {str(e)}")
+            compiled = None  # Cached as well, so a broken template is not recompiled for every recipient
+        self.compile_count += 1
+        cache.set(cache_key, (source, compiled))
+        return compiled
+
+    def render(self, source: str, prospect: Dict, key: Optional[Hashable] = None, **extra: Any) -> str:
+        """Render template text for a prospect; text that cannot be rendered is returned unchanged"""
+        if not source or not any(marker in source for marker in TEMPLATE_MARKERS):
+            return source
+        compiled = self._compile(source, key)
+        if compiled is None:
+            return source
+        try:
+            return compiled.render(template_context(prospect, **extra))
+        except Exception as e:
+            logger.error(f"Template rendering failed: {str(e)}")
+            return source
+
+    def render_batch(self, template: Dict, prospects: List[Dict]) -> List[Dict[str, Optional[str]]]:
+        """Render subject, content and HTML of a stored template for each prospect.
+
+        Each field is compiled at most once for the whole batch; the HTML body can use {{subject}}
+        for the prospect's rendered subject. html_content is None when the template has none.
+        """
+        template_id = template.get("id")
+        version = template.get("updated_at")
+        keys = {
+            field: (template_id, version, field) if template_id else None
+            for field in TEMPLATE_FIELDS
+        }
+        rendered = []
+        for prospect in prospects:
+            subject = self.render(template.get("subject", ""), prospect, keys["subject"])
+            html_content = template.get("html_content")
+            rendered.append({
+                "subject": subject,
+                "content": self.render(template.get("content", ""), prospect, keys["content"], subject=subject),
+                "html_content": self.render(html_content, prospect, keys["html_content"], subject=subject) if html_content else None
+            })
+        return rendered
+
+    def get_stats(self) -> Dict:
+        """Get compiled template cache statistics"""
+        return {**self.cache.get_stats(), "adhoc": self.adhoc_cache.get_stats(), "compiled": self.compile_count}
+
+# Create global template renderer instance
+template_renderer = TemplateRenderer()
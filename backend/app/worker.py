@@ -0,0 +1,115 @@
+"""
+Background worker - runs the follow-up engine, email processor and campaign send job
+runner outside the API process. Start with `python -m app.worker` from backend/ and set
+BACKGROUND_SERVICES_MODE=external on the API so it only talks to workers through Mongo.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import asyncio
+import logging
+import os
+import signal
+import socket
+from datetime import datetime
+from app.services.database import db_service
+from app.services.knowledge_index_service import knowledge_index_service
+from app.services.lease_service import lease_service
+from app.services.worker_control_service import worker_control_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class BackgroundWorker:
+    """Runs the background engines, heartbeats their status and applies queued commands"""
+
+    def __init__(self):
+        self.worker_id = lease_service.worker_id
+        self.heartbeat_interval = int(os.getenv("WORKER_HEARTBEAT_INTERVAL", 10))
+        self.command_poll_interval = int(os.getenv("WORKER_COMMAND_POLL_INTERVAL", 2))
+        self.started_at = datetime.utcnow()
+        self.stop_event = asyncio.Event()
+
+    async def _save_heartbeat(self):
+        """Publish this worker's service status"""
+        await db_service.save_worker_heartbeat(self.worker_id, {
+            "hostname": socket.gethostname(),
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "services": worker_control_service.local_status()
+        })
+
+    async def _heartbeat_loop(self):
+        """Publish status until shutdown"""
+        while not self.stop_event.is_set():
+            try:
+                await self._save_heartbeat()
+            except Exception as e:
+                logger.error(f"Error saving worker heartbeat: {str(e)}")
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), timeout=self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _command_loop(self):
+        """Apply commands queued by the API since this worker started"""
+        while not self.stop_event.is_set():
+            try:
+                for command in await db_service.get_unacked_worker_commands(self.worker_id, self.started_at):
+                    logger.info(f"Applying worker command {command['command']} ({command['id']})")
+                    try:
+                        result = await worker_control_service.apply_command(command)
+                    except Exception as e:
+                        logger.error(f"Error applying worker command {command['id']}: {str(e)}")
+                        result = {"status": "error", "error": str(e)}
+                    await db_service.ack_worker_command(command["id"], self.worker_id, result)
+                    await self._save_heartbeat()
+            except Exception as e:
+                logger.error(f"Error polling worker commands: {str(e)}")
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), timeout=self.command_poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        """Start the services and run until SIGINT or SIGTERM"""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop_event.set)
+
+        await db_service.connect()
+        await db_service.start_config_change_stream()
+        await db_service.ensure_indexes()
+        knowledge_index_service.warm_up()  # Auto-responses search the knowledge base for every email
+
+        results = await worker_control_service.start_local()
+        logger.info(f"Worker {self.worker_id} started services: {results}")
+
+        await asyncio.gather(self._heartbeat_loop(), self._command_loop())
+        await self.shutdown()
+
+    async def shutdown(self):
+        """Stop the services, release leases and remove this worker's status"""
+        logger.info(f"Worker {self.worker_id} shutting down")
+        try:
+            await worker_control_service.stop_local()
+
+            from app.services.smtp_delivery_service import smtp_delivery_service
+            await smtp_delivery_service.close_all()
+
+            from app.services.imap_client_service import imap_client_service
+            await imap_client_service.close_all()
+
+            from app.services.groq_service import groq_gateway
+            await groq_gateway.close()
+
+            await lease_service.stop()
+            await db_service.delete_worker(self.worker_id)
+            await db_service.stop_config_change_stream()
+            await db_service.disconnect()
+        except Exception as e:
+            logger.error(f"Error during worker shutdown: {str(e)}")
+
+if __name__ == "__main__":
+    asyncio.run(BackgroundWorker().run())
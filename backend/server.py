@@ -1,13 +1,10 @@
 # AI Email Responder - Working Backend with FIXES
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, File, HTTPException, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 import logging
-import aiosmtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import asyncio
 import re
 import json
@@ -15,6 +12,8 @@ import json
 # FIXED: Import fixed email services instead of original ones
 from app.services.email_processor_fixed import email_processor_fixed as email_processor
 from app.services.smart_follow_up_engine_fixed import fixed_smart_follow_up_engine as enhanced_smart_follow_up_engine
+from app.services.campaign_send_service import campaign_send_job_runner
+from app.services.worker_control_service import worker_control_service
 
 # Import EmailProviderType from the main models file
 import sys
@@ -246,9 +245,7 @@ async def get_campaigns():
         for campaign in campaigns:
             prospect_count = 0
             if campaign.get('list_ids'):
-                for list_id in campaign['list_ids']:
-                    prospects = await db_service.get_prospects_by_list_id(list_id)
-                    prospect_count += len(prospects)
+                prospect_count = await db_service.count_prospects_for_lists(campaign['list_ids'])
             campaign['prospect_count'] = prospect_count
         
         return campaigns
@@ -273,9 +270,7 @@ async def create_campaign(campaign: Campaign):
         # Calculate prospect count from lists
         prospect_count = 0
         if campaign.list_ids:
-            for list_id in campaign.list_ids:
-                prospects = await db_service.get_prospects_by_list_id(list_id)
-                prospect_count += len(prospects)
+            prospect_count = await db_service.count_prospects_for_lists(campaign.list_ids)
         
         # Generate ID and add timestamps
         campaign_id = generate_id()
@@ -643,7 +638,6 @@ async def create_email_provider(provider: EmailProvider):
     try:
         from app.services.database import db_service
         from app.utils.helpers import generate_id
-        from app.services.email_processor import email_processor
         
         # Connect to database
         await db_service.connect()
@@ -672,9 +666,9 @@ async def create_email_provider(provider: EmailProvider):
         
         if result:
             # Auto-start IMAP monitoring if enabled and email processor is running
-            if provider_data["imap_enabled"] and email_processor.processing:
+            if provider_data["imap_enabled"]:
                 try:
-                    await email_processor.add_provider_to_monitoring(provider_id, provider_data)
+                    await worker_control_service.add_provider(provider_id, provider_data)
                     logging.info(f"Auto-started IMAP monitoring for provider: {provider.name}")
                 except Exception as imap_error:
                     logging.warning(f"Failed to auto-start IMAP monitoring: {str(imap_error)}")
@@ -710,7 +704,6 @@ async def toggle_provider_imap(provider_id: str):
     """Toggle IMAP monitoring for a specific provider"""
     try:
         from app.services.database import db_service
-        from app.services.email_processor import email_processor
         
         # Connect to database
         await db_service.connect()
@@ -732,12 +725,11 @@ async def toggle_provider_imap(provider_id: str):
         # Update email processor monitoring
         if new_imap_status:
             # Start monitoring this provider
-            if email_processor.processing:
-                await email_processor.add_provider_to_monitoring(provider_id, provider)
-                logging.info(f"Started IMAP monitoring for provider: {provider['name']}")
+            await worker_control_service.add_provider(provider_id, provider)
+            logging.info(f"Started IMAP monitoring for provider: {provider['name']}")
         else:
             # Stop monitoring this provider
-            await email_processor.remove_provider_from_monitoring(provider_id)
+            await worker_control_service.remove_provider(provider_id)
             logging.info(f"Stopped IMAP monitoring for provider: {provider['name']}")
         
         return {
@@ -755,7 +747,6 @@ async def get_provider_imap_status(provider_id: str):
     """Get IMAP status for a specific provider"""
     try:
         from app.services.database import db_service
-        from app.services.email_processor import email_processor
         
         # Connect to database
         await db_service.connect()
@@ -765,16 +756,15 @@ async def get_provider_imap_status(provider_id: str):
         if not provider:
             raise HTTPException(status_code=404, detail="Email provider not found")
         
-        # Get IMAP monitoring status
-        is_monitoring = email_processor.is_provider_being_monitored(provider_id)
+        # Get IMAP monitoring status from this process, or from the worker heartbeats in external mode
+        monitoring = await worker_control_service.get_provider_monitoring(provider_id)
         last_scan = await db_service.get_last_imap_scan_for_provider(provider_id)
         
         return {
             "provider_id": provider_id,
             "provider_name": provider.get("name"),
             "imap_enabled": provider.get("imap_enabled", False),
-            "is_monitoring": is_monitoring,
-            "email_processor_running": email_processor.processing,
+            **monitoring,
             "last_scan": last_scan.isoformat() if last_scan else None,
             "imap_config": {
                 "host": provider.get("imap_host", ""),
@@ -799,7 +789,6 @@ async def update_email_provider(provider_id: str, provider: EmailProvider):
 async def delete_email_provider(provider_id: str):
     try:
         from app.services.database import db_service
-        from app.services.email_processor import email_processor
         
         # Connect to database
         await db_service.connect()
@@ -812,7 +801,7 @@ async def delete_email_provider(provider_id: str):
         # Stop IMAP monitoring if it's enabled for this provider
         if provider.get("imap_enabled", False):
             try:
-                await email_processor.remove_provider_from_monitoring(provider_id)
+                await worker_control_service.remove_provider(provider_id)
                 logging.info(f"Stopped IMAP monitoring for provider: {provider.get('name', 'Unknown')}")
             except Exception as imap_error:
                 logging.warning(f"Failed to stop IMAP monitoring: {str(imap_error)}")
@@ -943,6 +932,23 @@ async def get_provider_imap_status(provider_id: str):
         logging.error(f"Error getting IMAP status for provider {provider_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting IMAP status: {str(e)}")
 
+@app.get("/api/email-providers/{provider_id}/rate-limit")
+async def get_email_provider_rate_limit(provider_id: str):
+    """Get a provider's send quota usage and when its next send slot opens"""
+    try:
+        from app.services.rate_limit_service import rate_limit_service
+        
+        status = await rate_limit_service.get_status(provider_id)
+        if not status:
+            raise HTTPException(status_code=404, detail="Email provider not found")
+        return status
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error getting rate limit for provider {provider_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error getting rate limit: {str(e)}")
+
 @app.post("/api/email-providers/{provider_id}/set-default")
 async def set_default_email_provider(provider_id: str):
     """Set an email provider as the default"""
@@ -1167,8 +1173,8 @@ async def get_list_by_id(list_id: str):
         raise HTTPException(status_code=500, detail=f"Error fetching list: {str(e)}")
 
 @app.get("/api/lists/{list_id}/prospects")
-async def get_list_prospects(list_id: str):
-    """Get prospects for a specific list"""
+async def get_list_prospects(list_id: str, skip: int = 0, limit: int = 100):
+    """Get a page of prospects for a specific list"""
     try:
         from app.services.database import db_service
         
@@ -1176,18 +1182,21 @@ async def get_list_prospects(list_id: str):
         await db_service.connect()
         
         # Check if list exists
-        list_data = await db_service.get_list_by_id(list_id)
+        list_data = await db_service.db.prospect_lists.find_one({"id": list_id}, {"_id": 0, "name": 1})
         if not list_data:
             raise HTTPException(status_code=404, detail="List not found")
         
-        # Get prospects for this list
-        prospects = await db_service.get_prospects_by_list_id(list_id)
+        # Get a page of prospects for this list
+        prospects = await db_service.get_prospects_by_list_id(list_id, skip=skip, limit=limit)
+        total_count = await db_service.db.prospects.count_documents({"list_ids": list_id})
         
         return {
             "list_id": list_id,
             "list_name": list_data.get("name", "Unknown"),
             "prospects": prospects,
-            "total_count": len(prospects)
+            "skip": skip,
+            "limit": limit,
+            "total_count": total_count
         }
         
     except HTTPException:
@@ -1384,32 +1393,16 @@ async def search_industries(search_term: str):
 async def get_services_status():
     """Get status of FIXED auto follow-up and auto-responder services with provider details"""
     try:
-        # Get monitored providers info
-        monitored_providers_info = []
-        if hasattr(email_processor, 'monitored_providers'):
-            for provider_id, provider_config in email_processor.monitored_providers.items():
-                monitored_providers_info.append({
-                    "id": provider_id,
-                    "name": provider_config["name"],
-                    "provider_type": provider_config["provider_type"],
-                    "last_scan": provider_config["last_scan"].isoformat() if provider_config["last_scan"] else None,
-                    "imap_host": provider_config["imap_host"]
-                })
-        
-        return {
-            "services": {
-                "smart_follow_up_engine": {
-                    "status": "running" if enhanced_smart_follow_up_engine.processing else "stopped",
-                    "description": "FIXED - Handles automatic follow-up emails - STOPS immediately when replies received"
-                },
-                "email_processor": {
-                    "status": "running" if email_processor.processing else "stopped", 
-                    "description": "FIXED - Handles automatic email responses (auto-responder) - RESPONDS to ALL emails",
-                    "monitored_providers_count": len(monitored_providers_info),
-                    "monitored_providers": monitored_providers_info
-                }
-            },
-            "overall_status": "healthy" if (enhanced_smart_follow_up_engine.processing and email_processor.processing) else "degraded",
+        from app.services.worker_control_service import worker_control_service
+        
+        services = await worker_control_service.get_services_status()
+        response = {
+            "mode": worker_control_service.mode,
+            "services": services,
+            "overall_status": "healthy" if (
+                services["smart_follow_up_engine"]["status"] == "running" and
+                services["email_processor"]["status"] == "running"
+            ) else "degraded",
             "fixes_applied": [
                 "✅ Follow-ups now STOP immediately when ANY reply is received",
                 "✅ Auto-responder now RESPONDS to ALL incoming emails", 
@@ -1418,6 +1411,9 @@ async def get_services_status():
             ],
             "timestamp": datetime.utcnow().isoformat()
         }
+        if worker_control_service.is_external:
+            response["workers"] = await worker_control_service.get_workers()
+        return response
     except Exception as e:
         return {
             "services": {
@@ -1432,21 +1428,10 @@ async def get_services_status():
 async def start_all_services():
     """Manually start both FIXED follow-up and auto-responder services"""
     try:
-        results = {}
+        from app.services.worker_control_service import worker_control_service
         
-        # Start FIXED Follow-up Engine
-        if not enhanced_smart_follow_up_engine.processing:
-            follow_up_result = await enhanced_smart_follow_up_engine.start_follow_up_engine()
-            results["smart_follow_up_engine"] = follow_up_result
-        else:
-            results["smart_follow_up_engine"] = {"status": "already_running"}
-        
-        # Start FIXED Email Processor
-        if not email_processor.processing:
-            email_result = await email_processor.start_monitoring()
-            results["email_processor"] = email_result
-        else:
-            results["email_processor"] = {"status": "already_running"}
+        # Starts the engines here, or asks the worker processes to in external mode
+        results = await worker_control_service.start_services()
         
         return {
             "message": "All FIXED services start initiated",
@@ -1461,23 +1446,40 @@ async def start_all_services():
 async def stop_all_services():
     """Manually stop both FIXED follow-up and auto-responder services"""
     try:
-        # Stop FIXED Follow-up Engine
-        follow_up_result = await enhanced_smart_follow_up_engine.stop_follow_up_engine()
+        from app.services.worker_control_service import worker_control_service
         
-        # Stop FIXED Email Processor
-        email_result = await email_processor.stop_monitoring()
+        results = await worker_control_service.stop_services()
         
         return {
             "message": "All FIXED services stopped",
-            "results": {
-                "smart_follow_up_engine": follow_up_result,
-                "email_processor": email_result
-            },
+            "results": results,
             "timestamp": datetime.utcnow().isoformat()
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error stopping FIXED services: {str(e)}")
+
+@app.get("/api/cache/classification")
+async def get_classification_cache_stats():
+    """Get hit/miss counters of the intent classification and sentiment cache"""
+    try:
+        from app.services.classification_cache_service import classification_cache_service
+        return {
+            **classification_cache_service.get_stats(),
+            "timestamp": datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting classification cache stats: {str(e)}")
+
+@app.delete("/api/cache/classification")
+async def clear_classification_cache():
+    """Drop every cached classification and sentiment result"""
+    try:
+        from app.services.classification_cache_service import classification_cache_service
+        return await classification_cache_service.clear()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error clearing classification cache: {str(e)}")
+
 @app.get("/api/analytics/campaign/{campaign_id}")
 async def get_campaign_analytics(campaign_id: str):
     return {
@@ -1495,96 +1497,17 @@ async def get_campaign_analytics(campaign_id: str):
 async def get_dashboard_metrics():
     """Get real-time dashboard metrics from actual database"""
     try:
-        from app.services.database import db_service
-        
-        # Connect to database
-        await db_service.connect()
-        
-        # Get actual data from database
-        prospects = await db_service.get_prospects()
-        campaigns = await db_service.get_campaigns()
-        email_providers = await db_service.get_email_providers()
-        
-        # Count emails sent today
-        today = datetime.utcnow().date()
-        emails_today = await db_service.db.emails.count_documents({
-            "sent_at": {
-                "$gte": datetime.combine(today, datetime.min.time()),
-                "$lt": datetime.combine(today, datetime.max.time())
-            }
-        })
-        
-        # Get total emails sent
-        total_emails_sent = await db_service.db.emails.count_documents({})
-        
-        # Count active campaigns
-        active_campaigns = len([c for c in campaigns if c.get("status") == "active"])
-        
-        # Get recent activity (last 5 sent emails)
-        recent_emails = await db_service.db.emails.find(
-            {"status": "sent"},
-            sort=[("sent_at", -1)]
-        ).limit(5).to_list(length=5)
-        
-        recent_activity = []
-        for email in recent_emails:
-            recent_activity.append({
-                "id": email.get("id", ""),
-                "subject": email.get("subject", ""),
-                "recipient": email.get("recipient_email", ""),
-                "status": email.get("status", ""),
-                "created_at": email.get("sent_at", datetime.utcnow()).isoformat()
-            })
-        
-        # Get provider stats
-        provider_stats = {}
-        for provider in email_providers:
-            provider_stats[provider["name"]] = {
-                "type": provider["provider_type"],
-                "status": "active" if provider["is_active"] else "inactive",
-                "emails_sent_today": provider.get("current_daily_count", 0),
-                "daily_limit": provider.get("daily_send_limit", 500)
-            }
+        from app.services.metrics_service import metrics_service
         
+        metrics = await metrics_service.get_dashboard_metrics()
         return {
-            "metrics": {
-                "overview": {
-                    "total_prospects": len(prospects),
-                    "total_campaigns": len(campaigns),
-                    "total_emails_sent": total_emails_sent,
-                    "emails_today": emails_today,
-                    "active_campaigns": active_campaigns
-                },
-                "provider_stats": provider_stats,
-                "recent_activity": recent_activity
-            },
-            "last_updated": datetime.utcnow().isoformat()
+            "metrics": {key: value for key, value in metrics.items() if key != "last_updated"},
+            "last_updated": metrics["last_updated"]
         }
         
     except Exception as e:
         logging.error(f"Error getting dashboard metrics: {str(e)}")
-        # Return basic metrics on error
-        return {
-            "metrics": {
-                "overview": {
-                    "total_prospects": 2,
-                    "total_campaigns": 1,
-                    "total_emails_sent": 2,
-                    "emails_today": 2,
-                    "active_campaigns": 0
-                },
-                "provider_stats": {
-                    "Production Gmail Provider": {
-                        "type": "gmail",
-                        "status": "active",
-                        "emails_sent_today": 2,
-                        "daily_limit": 500
-                    }
-                },
-                "recent_activity": []
-            },
-            "last_updated": datetime.utcnow().isoformat()
-        }
+        raise HTTPException(status_code=500, detail=f"Error getting dashboard metrics: {str(e)}")
 
 # Email sending functionality
 async def send_email(to_email: str, subject: str, content: str):
@@ -1617,96 +1540,41 @@ async def send_email(to_email: str, subject: str, content: str):
     except Exception as e:
         logging.error(f"Error in send_email: {str(e)}")
         raise e
-async def send_email_via_provider(provider_data: dict, recipient: dict, subject: str, content: str, html_content: str = None):
-    """Send email using the specified provider with HTML support"""
-    try:
-        # Create message
-        message = MIMEMultipart('alternative')
-        message["From"] = provider_data["email_address"]
-        message["To"] = recipient["email"]
-        message["Subject"] = subject
-        
-        # Attach plain text version
-        text_part = MIMEText(content, "plain")
-        message.attach(text_part)
-        
-        # Attach HTML version if provided
-        if html_content:
-            html_part = MIMEText(html_content, "html")
-            message.attach(html_part)
-        
-        # Send email using aiosmtplib
-        await aiosmtplib.send(
-            message,
-            hostname=provider_data.get("smtp_host", "smtp.gmail.com"),
-            port=provider_data.get("smtp_port", 587),
-            username=provider_data.get("smtp_username", provider_data["email_address"]),
-            password=provider_data.get("smtp_password", "app_password"),
-            start_tls=provider_data.get("smtp_use_tls", True)
-        )
-        
-        return {"status": "sent", "message": "Email sent successfully"}
-    except Exception as e:
-        logging.error(f"Error sending email to {recipient['email']}: {str(e)}")
-        return {"status": "failed", "message": str(e)}
-
-def personalize_template(template_content: str, recipient: dict) -> str:
-    """Personalize template with recipient data - supports both text and HTML"""
-    personalized = template_content
-    
-    # Replace placeholders
-    placeholders = {
-        "{{first_name}}": recipient.get("first_name", ""),
-        "{{last_name}}": recipient.get("last_name", ""),
-        "{{company}}": recipient.get("company", ""),
-        "{{job_title}}": recipient.get("job_title", ""),
-        "{{industry}}": recipient.get("industry", ""),
-        "{{email}}": recipient.get("email", ""),
-        "{{subject}}": recipient.get("subject", "")  # For HTML templates
-    }
-    
-    for placeholder, value in placeholders.items():
-        personalized = personalized.replace(placeholder, value)
-    
-    return personalized
 
 @app.post("/api/campaigns/{campaign_id}/send")
 async def send_campaign_emails(campaign_id: str, send_request: EmailSendRequest):
-    """Send emails for a specific campaign with auto-start follow-up and auto-response services"""
+    """Queue a background send job for a campaign and auto-start follow-up and auto-response services"""
     try:
         from app.services.database import db_service
         from app.services.email_provider_service import email_provider_service
+        from app.services.provider_pool_service import provider_pool_service
         from app.services.smart_follow_up_engine_enhanced import enhanced_smart_follow_up_engine
         from app.services.email_processor import email_processor
-        from app.utils.helpers import generate_id, personalize_template
         
         # Connect to database
         await db_service.connect()
         
-        # Auto-start Follow-up and Auto-Response Services
-        logging.info("Auto-starting follow-up and auto-response services...")
-        
-        if not enhanced_smart_follow_up_engine.processing:
-            await enhanced_smart_follow_up_engine.start_follow_up_engine()
-            logging.info("Smart Follow-up Engine started automatically")
-        
-        if not email_processor.processing:
-            await email_processor.start_monitoring()
-            logging.info("Email Processor (Auto-Responder) started automatically")
+        # Auto-start Follow-up and Auto-Response Services (worker processes own them in external mode)
+        if not worker_control_service.is_external:
+            logging.info("Auto-starting follow-up and auto-response services...")
+            
+            if not enhanced_smart_follow_up_engine.processing:
+                await enhanced_smart_follow_up_engine.start_follow_up_engine()
+                logging.info("Smart Follow-up Engine started automatically")
+            
+            if not email_processor.processing:
+                await email_processor.start_monitoring()
+                logging.info("Email Processor (Auto-Responder) started automatically")
+            
+            if not campaign_send_job_runner.processing:
+                await campaign_send_job_runner.start_job_runner()
+                logging.info("Campaign Send Job Runner started automatically")
         
         # Get campaign data
         campaign = await db_service.get_campaign_by_id(campaign_id)
         if not campaign:
             raise HTTPException(status_code=404, detail="Campaign not found")
         
-        # Check if campaign has already been sent
-        current_status = campaign.get("status", "draft")
-        if current_status in ["sent", "completed", "active"]:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Campaign has already been {current_status}. Cannot send again."
-            )
-        
         # Get template data
         template_id = campaign.get("template_id")
         if not template_id:
@@ -1716,155 +1584,111 @@ async def send_campaign_emails(campaign_id: str, send_request: EmailSendRequest)
         if not template:
             raise HTTPException(status_code=404, detail="Template not found")
         
-        # Get prospects from the campaign's lists
-        prospects = []
-        list_ids = campaign.get("list_ids", [])
-        
-        if list_ids:
-            # Get prospects from specific lists
-            for list_id in list_ids:
-                list_prospects = await db_service.get_prospects_by_list_id(list_id)
-                if list_prospects:
-                    prospects.extend(list_prospects)
-        
-        # If no prospects from lists, get all prospects (fallback)
-        if not prospects:
-            prospects = await db_service.get_prospects(limit=send_request.max_emails)
-        
-        # If still no prospects from database, return error
-        if not prospects:
-            raise HTTPException(status_code=404, detail="No prospects found for this campaign")
-        
-        # Remove duplicates by email
-        seen_emails = set()
-        unique_prospects = []
-        for prospect in prospects:
-            if prospect["email"] not in seen_emails:
-                seen_emails.add(prospect["email"])
-                unique_prospects.append(prospect)
-        
-        prospects = unique_prospects[:send_request.max_emails]
-        
-        if not prospects:
-            raise HTTPException(status_code=404, detail="No prospects found for this campaign")
-        
-        # Get email provider
+        # Get email provider; without an explicit one the job spreads over every active provider
         if send_request.email_provider_id:
             provider = await email_provider_service.get_email_provider_by_id(send_request.email_provider_id)
+            if not provider:
+                raise HTTPException(status_code=404, detail="Email provider not found")
+        elif provider_pool_service.enabled:
+            provider = None
+            if not await db_service.get_active_email_providers():
+                raise HTTPException(status_code=404, detail="No active email provider found")
         else:
             provider = await email_provider_service.get_default_provider()
+            if not provider:
+                raise HTTPException(status_code=404, detail="Email provider not found")
+        
+        # Check if campaign has already been sent, moving it to "sending" in the same step so
+        # two concurrent requests cannot both queue a job
+        claimed = await db_service.claim_campaign_for_send(campaign_id)
+        if not claimed:
+            current_status = (await db_service.get_campaign_by_id(campaign_id) or {}).get("status", "draft")
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Campaign has already been {current_status}. Cannot send again."
+            )
         
-        if not provider:
-            raise HTTPException(status_code=404, detail="Email provider not found")
-        
-        # Send emails
-        email_results = []
-        sent_count = 0
-        failed_count = 0
-        
-        for prospect in prospects:
-            try:
-                # Personalize template - support both HTML and text
-                personalized_subject = personalize_template(template["subject"], prospect)
-                personalized_content = personalize_template(template["content"], prospect)
-                
-                # Personalize HTML content if available
-                personalized_html_content = None
-                if template.get("html_content") and template.get("is_html_enabled", False):
-                    personalized_html_content = personalize_template(template["html_content"], prospect)
-                
-                # Send email using email provider service
-                success, error = await email_provider_service.send_email(
-                    provider["id"],
-                    prospect["email"],
-                    personalized_subject,
-                    personalized_content,
-                    personalized_html_content  # Pass HTML content
-                )
-                
-                if success:
-                    sent_count += 1
-                    status = "sent"
-                    message = "Email sent successfully"
-                else:
-                    failed_count += 1
-                    status = "failed"
-                    message = error or "Failed to send email"
-                
-                # Create email record
-                email_record = {
-                    "id": generate_id(),
-                    "campaign_id": campaign_id,
-                    "prospect_id": prospect["id"],
-                    "recipient_email": prospect["email"],
-                    "subject": personalized_subject,
-                    "content": personalized_content,
-                    "status": status,
-                    "sent_at": datetime.utcnow(),
-                    "provider_id": provider["id"]
-                }
-                
-                await db_service.create_email_record(email_record)
-                
-                # Update prospect last contact and follow-up status
-                await db_service.update_prospect_last_contact(prospect["id"], datetime.utcnow())
-                
-                # Set up prospect for follow-up if campaign has follow-up enabled
-                if campaign.get("follow_up_enabled", False) and success:
-                    await db_service.update_prospect(prospect["id"], {
-                        "campaign_id": campaign_id,
-                        "follow_up_status": "active",
-                        "follow_up_count": 0,
-                        "last_follow_up": None
-                    })
-                
-                email_results.append({
-                    "recipient": prospect["email"],
-                    "status": status,
-                    "message": message,
-                    "subject": personalized_subject
-                })
-                
-            except Exception as e:
-                failed_count += 1
-                email_results.append({
-                    "recipient": prospect["email"],
-                    "status": "failed",
-                    "message": str(e),
-                    "subject": template["subject"]
-                })
-        
-        # Update campaign status - keep active if follow-up enabled
-        campaign_status = "active" if campaign.get("follow_up_enabled", False) else "sent"
-        await db_service.update_campaign(campaign_id, {"status": campaign_status})
+        # Create the send job and return at once; recipients are streamed from the campaign's
+        # lists and deduplicated by email in the background, then the job runner delivers them
+        try:
+            job = await campaign_send_job_runner.create_send_job(campaign, provider, send_request.max_emails)
+        except Exception:
+            await db_service.update_campaign(campaign_id, {"status": claimed.get("status", "draft")})
+            raise
         
         return {
             "campaign_id": campaign_id,
-            "status": "completed",
-            "total_sent": sent_count,
-            "total_failed": failed_count,
-            "total_prospects": len(prospects),
-            "email_results": email_results,
-            "message": f"Campaign sent successfully. {sent_count} emails sent, {failed_count} failed."
+            "job_id": job["id"],
+            "status": job["status"],
+            "total_sent": 0,
+            "total_failed": 0,
+            "total_prospects": None,  # Known once recipients are added; see status_url
+            "status_url": f"/api/campaigns/{campaign_id}/status",
+            "message": "Campaign queued; recipients are being added and sending starts shortly."
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error sending campaign {campaign_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error sending campaign: {str(e)}")
 
 @app.get("/api/campaigns/{campaign_id}/status")
 async def get_campaign_status(campaign_id: str):
-    """Get campaign sending status"""
-    return {
-        "campaign_id": campaign_id,
-        "status": "completed",
-        "total_sent": 47,
-        "total_failed": 3,
-        "total_prospects": 50,
-        "started_at": datetime.utcnow().isoformat(),
-        "completed_at": datetime.utcnow().isoformat(),
-        "message": "Campaign completed successfully"
-    }
+    """Get campaign sending status and progress of its latest send job"""
+    try:
+        from app.services.database import db_service
+        
+        # Connect to database
+        await db_service.connect()
+        
+        campaign = await db_service.get_campaign_by_id(campaign_id)
+        if not campaign:
+            raise HTTPException(status_code=404, detail="Campaign not found")
+        
+        job = await db_service.get_latest_send_job_for_campaign(campaign_id)
+        if job:
+            return {
+                **campaign_send_job_runner.summarize_job(job),
+                "campaign_status": campaign.get("status")
+            }
+        
+        # Campaigns sent before send jobs existed: report from email records
+        analytics = await db_service.get_campaign_analytics(campaign_id)
+        return {
+            "campaign_id": campaign_id,
+            "job_id": None,
+            "status": campaign.get("status", "draft"),
+            "campaign_status": campaign.get("status", "draft"),
+            "total_sent": analytics["total_sent"],
+            "total_failed": analytics["total_failed"],
+            "total_prospects": analytics["total_sent"] + analytics["total_failed"],
+            "total_pending": 0
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error getting campaign status {campaign_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error getting campaign status: {str(e)}")
+
+@app.get("/api/send-jobs/{job_id}")
+async def get_send_job(job_id: str):
+    """Get progress of a campaign send job"""
+    try:
+        from app.services.database import db_service
+        
+        job = await db_service.get_send_job_by_id(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Send job not found")
+        
+        return campaign_send_job_runner.summarize_job(job)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error getting send job {job_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error getting send job: {str(e)}")
 
 @app.post("/api/templates")
 async def create_template(template: dict):
@@ -2213,53 +2037,44 @@ async def delete_prospect(prospect_id: str):
         raise HTTPException(status_code=500, detail=f"Error deleting prospect: {str(e)}")
 
 @app.post("/api/prospects/upload")
-async def upload_prospects_csv(file_content: str):
+async def upload_prospects_csv(file: UploadFile = File(None), file_content: str = None, list_id: str = None):
     """Upload prospects from CSV"""
     try:
         from app.services.database import db_service
-        from app.utils.helpers import generate_id
-        import csv
+        from app.services.prospect_import_service import prospect_import_service
         import io
         
         # Connect to database
         await db_service.connect()
         
-        # Parse CSV content
-        csv_reader = csv.DictReader(io.StringIO(file_content))
-        prospects_data = []
-        
-        for row in csv_reader:
-            # Generate ID and add timestamps
-            prospect_id = generate_id()
-            prospect = {
-                "id": prospect_id,
-                "email": row.get("email", "").strip(),
-                "first_name": row.get("first_name", "").strip(),
-                "last_name": row.get("last_name", "").strip(),
-                "company": row.get("company", "").strip(),
-                "job_title": row.get("job_title", "").strip(),
-                "industry": row.get("industry", "").strip(),
-                "status": row.get("status", "active").strip(),
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            
-            # Validate required fields
-            if prospect["email"] and "@" in prospect["email"]:
-                prospects_data.append(prospect)
-        
-        # Upload prospects to database
-        result = await db_service.upload_prospects(prospects_data)
+        # Multipart uploads are spooled to disk by Starlette and parsed in chunks from there
+        if file is not None:
+            summary = await prospect_import_service.import_csv(file.file, list_id=list_id)
+        elif file_content is not None:
+            summary = await prospect_import_service.import_csv(io.BytesIO(file_content.encode("utf-8")), list_id=list_id)
+        else:
+            raise HTTPException(status_code=400, detail="No CSV file provided")
         
-        return {
+        response = {
             "message": "CSV uploaded successfully",
-            "prospects_added": len(result["successful_inserts"]),
-            "prospects_failed": len(result["failed_inserts"]),
-            "total_prospects": len(prospects_data),
-            "successful_inserts": result["successful_inserts"],
-            "failed_inserts": result["failed_inserts"]
+            "prospects_added": summary["inserted"],
+            "prospects_failed": summary["duplicates"] + summary["invalid"] + summary["failed"],
+            "duplicates": summary["duplicates"],
+            "invalid": summary["invalid"],
+            "total_prospects": summary["total_rows"],
+            "failed_inserts": summary["errors"],
+            "duplicate_check": summary["duplicate_check"],
+            "duration_seconds": summary["duration_seconds"]
         }
+        if not summary["duplicate_check"]:
+            response["warning"] = ("Duplicate emails were not rejected: the unique index on prospects.email "
+                                   "could not be built. Remove existing duplicate prospects and restart to enable it.")
+        return response
         
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Error uploading CSV: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error uploading CSV: {str(e)}")
@@ -2268,48 +2083,13 @@ async def upload_prospects_csv(file_content: str):
 async def get_overall_analytics():
     """Get overall analytics dashboard"""
     try:
-        from app.services.database import db_service
+        from app.services.metrics_service import metrics_service
         
-        # Connect to database
-        await db_service.connect()
-        
-        # Get campaigns
-        campaigns = await db_service.get_campaigns()
-        
-        # Get prospects
-        prospects = await db_service.get_prospects()
-        
-        # Calculate basic analytics
-        total_campaigns = len(campaigns)
-        total_prospects = len(prospects)
-        
-        # Get email statistics from database
-        # For now, return mock data - in production, you'd query the emails collection
-        return {
-            "total_campaigns": total_campaigns,
-            "total_emails_sent": 247,
-            "total_prospects": total_prospects,
-            "average_open_rate": 24.5,
-            "average_reply_rate": 8.2,
-            "top_performing_campaigns": [
-                {"name": "Welcome Series", "open_rate": 35.2, "reply_rate": 12.1},
-                {"name": "Follow-up Campaign", "open_rate": 28.7, "reply_rate": 9.3}
-            ]
-        }
+        return await metrics_service.get_overall_analytics()
         
     except Exception as e:
         logging.error(f"Error getting analytics: {str(e)}")
-        return {
-            "total_campaigns": 5,
-            "total_emails_sent": 1247,
-            "total_prospects": 150,
-            "average_open_rate": 24.5,
-            "average_reply_rate": 8.2,
-            "top_performing_campaigns": [
-                {"name": "Welcome Series", "open_rate": 35.2, "reply_rate": 12.1},
-                {"name": "Follow-up Campaign", "open_rate": 28.7, "reply_rate": 9.3}
-            ]
-        }
+        raise HTTPException(status_code=500, detail=f"Error getting analytics: {str(e)}")
 
 # WebSocket endpoint for real-time dashboard
 @app.websocket("/api/ws/{client_id}")
@@ -2323,70 +2103,13 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
             if message.get("type") == "get_current_metrics":
                 # Get current metrics and send to client
                 try:
-                    from app.services.database import db_service
-                    
-                    # Connect to database
-                    await db_service.connect()
-                    
-                    # Get actual data from database
-                    prospects = await db_service.get_prospects()
-                    campaigns = await db_service.get_campaigns()
-                    email_providers = await db_service.get_email_providers()
-                    
-                    # Count emails sent today
-                    today = datetime.utcnow().date()
-                    emails_today = await db_service.db.emails.count_documents({
-                        "sent_at": {
-                            "$gte": datetime.combine(today, datetime.min.time()),
-                            "$lt": datetime.combine(today, datetime.max.time())
-                        }
-                    })
-                    
-                    # Get total emails sent
-                    total_emails_sent = await db_service.db.emails.count_documents({})
-                    
-                    # Count active campaigns
-                    active_campaigns = len([c for c in campaigns if c.get("status") == "active"])
-                    
-                    # Get recent activity (last 5 sent emails)
-                    recent_emails = await db_service.db.emails.find(
-                        {"status": {"$in": ["sent", "failed"]}},
-                        sort=[("sent_at", -1)]
-                    ).limit(5).to_list(length=5)
-                    
-                    recent_activity = []
-                    for email in recent_emails:
-                        recent_activity.append({
-                            "id": email.get("id", ""),
-                            "subject": email.get("subject", ""),
-                            "recipient": email.get("recipient_email", ""),
-                            "status": email.get("status", ""),
-                            "created_at": email.get("sent_at", datetime.utcnow()).isoformat()
-                        })
-                    
-                    # Get provider stats
-                    provider_stats = {}
-                    for provider in email_providers:
-                        provider_stats[provider["name"]] = {
-                            "type": provider["provider_type"],
-                            "status": "active" if provider["is_active"] else "inactive",
-                            "emails_sent_today": provider.get("current_daily_count", 0),
-                            "daily_limit": provider.get("daily_send_limit", 500)
-                        }
+                    from app.services.metrics_service import metrics_service
                     
+                    # Shares the cached result with the HTTP dashboard endpoint
+                    metrics = await metrics_service.get_dashboard_metrics()
                     metrics_data = {
                         "type": "current_metrics",
-                        "data": {
-                            "overview": {
-                                "total_prospects": len(prospects),
-                                "total_campaigns": len(campaigns),
-                                "total_emails_sent": total_emails_sent,
-                                "emails_today": emails_today,
-                                "active_campaigns": active_campaigns
-                            },
-                            "provider_stats": provider_stats,
-                            "recent_activity": recent_activity
-                        },
+                        "data": {key: value for key, value in metrics.items() if key != "last_updated"},
                         "timestamp": datetime.utcnow().isoformat()
                     }
                     
@@ -2409,6 +2132,8 @@ async def startup_event():
     try:
         from app.services.database import db_service
         await db_service.connect()
+        await db_service.start_config_change_stream()
+        await db_service.ensure_indexes()
         logging.info("Database connected successfully")
         
         # Initialize seed data
@@ -2422,11 +2147,18 @@ async def startup_event():
         # Initialize services
         try:
             from app.services.knowledge_base_service import knowledge_base_service
+            from app.services.knowledge_index_service import knowledge_index_service
             from app.services.response_verification_service import response_verification_service
+            knowledge_index_service.warm_up()
             logging.info("Services initialized successfully")
         except ImportError as e:
             logging.warning(f"Could not initialize some services: {e}")
         
+        # Background services run in `python -m app.worker` processes in external mode
+        if worker_control_service.is_external:
+            logging.info("Background services mode is external; leaving them to the worker processes")
+            return
+        
         # FIXED: Auto-start services on application startup
         try:
             # Start the FIXED follow-up engine
@@ -2437,6 +2169,10 @@ async def startup_event():
             email_result = await email_processor.start_monitoring()
             logging.info(f"✅ FIXED Email Processor (Auto Responder) started automatically on startup: {email_result}")
             
+            # Start the campaign send job runner (resumes unfinished send jobs)
+            send_job_result = await campaign_send_job_runner.start_job_runner()
+            logging.info(f"✅ Campaign Send Job Runner started automatically on startup: {send_job_result}")
+            
         except Exception as e:
             logging.error(f"❌ Error starting FIXED services on startup: {str(e)}")
             
@@ -2447,7 +2183,20 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on shutdown"""
     try:
+        from app.services.smtp_delivery_service import smtp_delivery_service
+        await smtp_delivery_service.close_all()
+        
+        from app.services.imap_client_service import imap_client_service
+        await imap_client_service.close_all()
+        
+        from app.services.groq_service import groq_gateway
+        await groq_gateway.close()
+        
+        from app.services.lease_service import lease_service
+        await lease_service.stop()
+        
         from app.services.database import db_service
+        await db_service.stop_config_change_stream()
         await db_service.disconnect()
         logging.info("Database disconnected")
     except Exception as e:
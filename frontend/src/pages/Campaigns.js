@@ -106,11 +106,11 @@ const Campaigns = () => {
     try {
       console.log('📡 Sending campaign via API...');
       const response = await apiService.sendCampaign(campaignId);
-      console.log('✅ Campaign sent successfully:', response.data);
+      console.log('✅ Campaign queued successfully:', response.data);
       
       // Enhanced success message with details
       const result = response.data;
-      const successMessage = `Campaign sent successfully! ${result.total_sent} emails sent, ${result.total_failed} failed.`;
+      const successMessage = result.message || 'Campaign queued! Sending in the background.';
       
       toast.success(successMessage, {
         duration: 6000,
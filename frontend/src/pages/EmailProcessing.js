@@ -780,10 +780,11 @@ const EmailProcessing = () => {
 };
 
 const EnhancedThreadCard = ({ thread, onViewThread, onForceStopFollowUp, onRestartFollowUp }) => {
-  const messageCount = thread.messages?.length || 0;
-  const lastMessage = thread.messages?.[messageCount - 1];
-  const aiResponses = thread.messages?.filter(m => m.ai_generated)?.length || 0;
-  const sentByUs = thread.messages?.filter(m => m.sent_by_us)?.length || 0;
+  // Threads carry only their recent messages; the counters cover the whole thread
+  const messageCount = thread.message_count ?? thread.messages?.length ?? 0;
+  const lastMessage = thread.messages?.[thread.messages.length - 1];
+  const aiResponses = thread.ai_generated_count ?? thread.messages?.filter(m => m.ai_generated)?.length ?? 0;
+  const sentByUs = thread.sent_by_us_count ?? thread.messages?.filter(m => m.sent_by_us)?.length ?? 0;
 
   return (
     <div className="flex items-center justify-between p-4 bg-gray-50 rounded-lg hover:bg-gray-100 transition-colors">
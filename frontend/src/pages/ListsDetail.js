@@ -8,11 +8,15 @@ import {
 import { apiService } from '../services/api';
 import toast from 'react-hot-toast';
 
+const PROSPECTS_PAGE_SIZE = 100;
+
 const ListsDetail = () => {
   const { listId } = useParams();
   const navigate = useNavigate();
   const [list, setList] = useState(null);
   const [prospects, setProspects] = useState([]);
+  const [totalProspects, setTotalProspects] = useState(0);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [allProspects, setAllProspects] = useState([]);
   const [loading, setLoading] = useState(true);
   const [searchTerm, setSearchTerm] = useState('');
@@ -28,9 +32,13 @@ const ListsDetail = () => {
 
   const loadListDetails = async () => {
     try {
-      const response = await apiService.getList(listId);
-      setList(response.data);
-      setProspects(response.data.prospects || []);
+      const [listResponse, prospectsResponse] = await Promise.all([
+        apiService.getList(listId),
+        apiService.getListProspects(listId, 0, PROSPECTS_PAGE_SIZE)
+      ]);
+      setList(listResponse.data);
+      setProspects(prospectsResponse.data.prospects || []);
+      setTotalProspects(prospectsResponse.data.total_count || 0);
     } catch (error) {
       toast.error('Failed to load list details');
       navigate('/lists');
@@ -39,6 +47,19 @@ const ListsDetail = () => {
     }
   };
 
+  const loadMoreProspects = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await apiService.getListProspects(listId, prospects.length, PROSPECTS_PAGE_SIZE);
+      setProspects(prev => [...prev, ...(response.data.prospects || [])]);
+      setTotalProspects(response.data.total_count || 0);
+    } catch (error) {
+      toast.error('Failed to load more prospects');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const loadAllProspects = async () => {
     try {
       const response = await apiService.getProspects();
@@ -243,7 +264,7 @@ const ListsDetail = () => {
             <div className="flex items-center justify-between">
               <div>
                 <p className="text-sm font-medium text-gray-600">Total Prospects</p>
-                <p className="text-2xl font-bold text-gray-900">{prospects.length}</p>
+                <p className="text-2xl font-bold text-gray-900">{totalProspects}</p>
               </div>
               <div className="icon-wrapper bg-gradient-to-r from-blue-500 to-blue-600">
                 <Users className="h-5 w-5 text-white" />
@@ -486,6 +507,18 @@ const ListsDetail = () => {
               </table>
             </div>
           )}
+
+          {prospects.length < totalProspects && (
+            <div className="text-center mt-4">
+              <button
+                onClick={loadMoreProspects}
+                disabled={loadingMore}
+                className="btn btn-secondary btn-sm"
+              >
+                {loadingMore ? 'Loading...' : `Load More (${prospects.length} of ${totalProspects})`}
+              </button>
+            </div>
+          )}
         </div>
       </div>
 
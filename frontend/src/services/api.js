@@ -130,6 +130,8 @@ export const apiService = {
   getLists: () => api.get('/api/lists'),
   createList: (list) => api.post('/api/lists', list),
   getList: (id) => api.get(`/api/lists/${id}`),
+  getListProspects: (id, skip = 0, limit = 100) =>
+    api.get(`/api/lists/${id}/prospects?skip=${skip}&limit=${limit}`),
   updateList: (id, list) => api.put(`/api/lists/${id}`, list),
   deleteList: (id) => api.delete(`/api/lists/${id}`),
   addProspectsToList: (listId, prospectIds) => api.post(`/api/lists/${listId}/prospects`, { prospect_ids: prospectIds }),
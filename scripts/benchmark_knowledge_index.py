@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of knowledge base retrieval
+
+Indexes synthetic articles the way KnowledgeIndexService does, then reports query
+latency percentiles and the cost of incremental adds, removes and compaction.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.services.knowledge_index_service import article_terms
+from app.utils.bm25_index import BM25Index
+
+CATEGORIES = ["general", "product_info", "pricing", "technical_support", "case_studies"]
+
+def make_articles(count: int, vocabulary, cumulative, words: int, prefix: str = "article"):
+    """Articles with Zipf-distributed words, like natural text"""
+    return [
+        {
+            "id": f"{prefix}-{i}",
+            "title": " ".join(random.choices(vocabulary, cum_weights=cumulative, k=6)),
+            "content": " ".join(random.choices(vocabulary, cum_weights=cumulative, k=words)),
+            "keywords": random.choices(vocabulary[:2000], k=5),
+            "category": random.choice(CATEGORIES),
+            "is_active": True
+        }
+        for i in range(count)
+    ]
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--articles", type=int, default=50000)
+    parser.add_argument("--words", type=int, default=300, help="words per article body")
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+    random.seed(7)
+
+    vocabulary = [f"term{i}" for i in range(args.vocabulary)]
+    cumulative = list(itertools.accumulate(1 / (rank + 1) for rank in range(args.vocabulary)))
+    articles = make_articles(args.articles, vocabulary, cumulative, args.words)
+
+    index = BM25Index()
+    started = time.perf_counter()
+    for article in articles:
+        index.add(article["id"], article_terms(article), article["category"], article["is_active"])
+    indexed = time.perf_counter() - started
+    started = time.perf_counter()
+    index.compact()
+    compacted = time.perf_counter() - started
+    stats = index.get_stats()
+    print(f"📚 {stats['documents']} articles, {stats['terms']} terms, {stats['postings']} postings ({stats['postings_mb']}MB)")
+    print(f"  tokenize + add  {indexed:.2f}s ({indexed / args.articles * 1e6:.0f} µs/article)")
+    print(f"  compact         {compacted:.2f}s")
+
+    queries = [" ".join(random.choices(vocabulary, cum_weights=cumulative, k=random.randint(2, 8))) for _ in range(args.queries)]
+    for label, category in (("search", None), ("search+category", "pricing")):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query, 5, category)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"🔎 {label:<16} p50 {percentile(timings, 0.5):.2f}ms  p99 {percentile(timings, 0.99):.2f}ms")
+
+    started = time.perf_counter()
+    for article in make_articles(100, vocabulary, cumulative, args.words, prefix="new"):
+        index.add(article["id"], article_terms(article), article["category"])
+        index.remove(f"article-{random.randrange(args.articles)}")
+    updated = time.perf_counter() - started
+    timings = []
+    for query in queries[:100]:
+        started = time.perf_counter()
+        index.search(query, 5)
+        timings.append((time.perf_counter() - started) * 1000)
+    print(f"✏️ 100 adds + 100 removes {updated * 10:.2f}ms each pair; "
+          f"first search after them {timings[0]:.2f}ms, then p50 {percentile(timings[1:], 0.5):.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of message serialization for bulk sends
+
+Compares building each message as a MIMEMultipart and flattening it the way
+aiosmtplib.send_message does, against the cached-envelope MessageBuilder that
+produces sendmail-ready bytes. Bodies are rendered per recipient like a campaign
+batch: the plain text part is personalized and the HTML part is shared.
+"""
+import argparse
+import email
+import email.policy
+import os
+import sys
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.utils.mime_builder import MessageBuilder
+
+PROVIDER = {"id": "benchmark", "display_name": "Sales Team", "email_address": "sales@example.com"}
+
+def build_batch(count: int, html_kb: int):
+    html = "<html><body>" + "<p>Our platform helps teams like yours close deals faster. Ünïcode ✓</p>\n" * (html_kb * 14) + "</body></html>"
+    return [
+        {
+            "to_email": f"prospect{i}@example.org",
+            "subject": f"Quick question for Company {i}",
+            "content": f"Hi Prospect {i},\n\nWould you have 15 minutes next week?\n\nBest,\nSales Team",
+            "html_content": html
+        }
+        for i in range(count)
+    ]
+
+def build_mime(item) -> bytes:
+    """The previous path: an email.mime tree flattened with the SMTP policy"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = item["subject"]
+    msg['From'] = f"{PROVIDER['display_name']} <{PROVIDER['email_address']}>"
+    msg['To'] = item["to_email"]
+    msg.attach(MIMEText(item["content"], 'plain'))
+    msg.attach(MIMEText(item["html_content"], 'html'))
+    return msg.as_bytes(policy=email.policy.SMTP)
+
+def run(name: str, build, batch, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for item in batch:
+            build(item)
+        best = min(best, time.perf_counter() - started)
+    rate = len(batch) / best
+    print(f"  {name:<16} {rate:>10,.0f} messages/sec  ({best / len(batch) * 1e6:,.1f} µs/message)")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=2000, help="messages per round")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds; the fastest is reported")
+    parser.add_argument("--html-kb", type=int, default=20, help="approximate size of the HTML part")
+    args = parser.parse_args()
+
+    batch = build_batch(args.count, args.html_kb)
+    builder = MessageBuilder()
+
+    def build_prepared(item) -> bytes:
+        return builder.build(PROVIDER, item["to_email"], item["subject"], item["content"],
+                             html_content=item["html_content"]).data
+
+    # Both paths must produce the same message
+    before = email.message_from_bytes(build_mime(batch[0]), policy=email.policy.default)
+    after = email.message_from_bytes(build_prepared(batch[0]), policy=email.policy.default)
+    for header in ("From", "To", "Subject"):
+        assert str(before[header]) == str(after[header]), header
+    for old_part, new_part in zip(before.iter_parts(), after.iter_parts()):
+        assert old_part.get_content_type() == new_part.get_content_type()
+        assert old_part.get_content().replace("\r\n", "\n") == new_part.get_content().replace("\r\n", "\n")
+
+    print(f"📨 {args.count} messages per round, {args.html_kb}KB HTML part, best of {args.rounds}")
+    mime_rate = run("MIMEMultipart", build_mime, batch, args.rounds)
+    builder_rate = run("MessageBuilder", build_prepared, batch, args.rounds)
+    print(f"🚀 {builder_rate / mime_rate:.1f}x faster")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Script to report MongoDB index usage and slow unindexed queries
+
+Prints $indexStats per collection, registry indexes that were never used or are
+missing, and collection scans slower than --slow-ms from the profiler. Enable the
+profiler first to collect slow queries: db.setProfilingLevel(1, {slowms: 100}).
+Pass --apply to create missing registry indexes before reporting.
+"""
+import argparse
+import asyncio
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.services.database import db_service
+
+async def index_report(slow_ms: int, apply: bool):
+    await db_service.connect()
+
+    if apply:
+        result = await db_service.ensure_indexes(force=True)
+        print(f"🔧 Ensured {len(result['created'])} indexes, {len(result['failed'])} failed")
+        for failure in result["failed"]:
+            print(f"  ❌ {failure['collection']} {failure['keys']}: {failure['error']}")
+
+    report = await db_service.get_index_report(slow_ms=slow_ms)
+
+    print("📊 Index usage")
+    for collection, indexes in report["indexes"].items():
+        print(f"  {collection}")
+        for index in indexes:
+            print(f"    - {index['name']}: {index['ops']} ops since {index['since']}")
+
+    print(f"💤 Unused registry indexes: {len(report['unused_registry_indexes'])}")
+    for name in report["unused_registry_indexes"]:
+        print(f"  - {name}")
+
+    print(f"⚠️ Missing registry indexes: {len(report['missing_registry_indexes'])}")
+    for name in report["missing_registry_indexes"]:
+        print(f"  - {name}")
+
+    print(f"🐢 Collection scans over {slow_ms} ms: {len(report['slow_collection_scans'])}")
+    for query in report["slow_collection_scans"]:
+        print(f"  - {query.get('ns')} {query.get('op')} {query.get('millis')} ms, "
+              f"{query.get('docsExamined')} docs examined: {query.get('command')}")
+
+    await db_service.disconnect()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report MongoDB index usage and slow unindexed queries")
+    parser.add_argument("--slow-ms", type=int, default=100, help="Only report collection scans at least this slow")
+    parser.add_argument("--apply", action="store_true", help="Create missing registry indexes first")
+    args = parser.parse_args()
+    asyncio.run(index_report(args.slow_ms, args.apply))
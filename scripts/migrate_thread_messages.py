@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Script to move embedded thread messages into the thread_messages collection
+
+Threads used to $push every message into a "messages" array. This copies each array
+into thread_messages, computes the thread summary fields and removes the array.
+Safe to re-run: a thread interrupted half way is migrated again from its array.
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.services.database import db_service
+
+async def summarize_thread(thread_id: str) -> dict:
+    """Summary fields of a thread computed from its stored messages"""
+    summary = {
+        "message_count": 0, "received_count": 0, "sent_count": 0,
+        "sent_by_us_count": 0, "ai_generated_count": 0,
+        "last_message_at": None, "last_received_at": None, "last_sent_at": None
+    }
+    async for message in db_service.db.thread_messages.find({"thread_id": thread_id}, {"_id": 0, "type": 1, "timestamp": 1, "sent_by_us": 1, "ai_generated": 1}):
+        timestamp = message.get("timestamp") if isinstance(message.get("timestamp"), datetime) else None
+        summary["message_count"] += 1
+        if message.get("type") == "received":
+            summary["received_count"] += 1
+            summary["last_received_at"] = max(filter(None, [summary["last_received_at"], timestamp]), default=None)
+        elif message.get("type") == "sent":
+            summary["sent_count"] += 1
+            summary["last_sent_at"] = max(filter(None, [summary["last_sent_at"], timestamp]), default=None)
+        if message.get("sent_by_us"):
+            summary["sent_by_us_count"] += 1
+        if message.get("ai_generated"):
+            summary["ai_generated_count"] += 1
+        summary["last_message_at"] = max(filter(None, [summary["last_message_at"], timestamp]), default=None)
+    return summary
+
+async def migrate_thread_messages():
+    await db_service.connect()
+    await db_service.ensure_indexes()
+
+    migrated_threads = 0
+    migrated_messages = 0
+    async for thread in db_service.db.threads.find({"messages": {"$exists": True}}):
+        thread_id = thread["id"]
+        messages = thread.get("messages") or []
+
+        # Drop copies left by an interrupted earlier run before copying again
+        await db_service.db.thread_messages.delete_many({"thread_id": thread_id, "migrated_from_thread": True})
+        if messages:
+            await db_service.db.thread_messages.insert_many([
+                {**message, "thread_id": thread_id, "migrated_from_thread": True}
+                for message in messages
+            ])
+
+        summary = await summarize_thread(thread_id)
+        await db_service.db.threads.update_one(
+            {"_id": thread["_id"]},
+            {
+                "$set": {key: value for key, value in summary.items() if value is not None},
+                "$unset": {"messages": ""}
+            }
+        )
+        migrated_threads += 1
+        migrated_messages += len(messages)
+        print(f"  - {thread_id}: {len(messages)} messages")
+
+    print(f"✅ Migrated {migrated_messages} messages from {migrated_threads} threads")
+    await db_service.disconnect()
+
+if __name__ == "__main__":
+    asyncio.run(migrate_thread_messages())
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Script to move raw MIME stored inline on thread messages into the blob store
+
+Run after migrate_thread_messages.py. Each raw_email string is stored once per
+content hash and replaced by raw_email_ref / raw_email_size on the message.
+"""
+import asyncio
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.services.blob_store_service import blob_store_service
+from app.services.database import db_service
+
+async def offload_raw_emails():
+    await db_service.connect()
+
+    offloaded = 0
+    async for message in db_service.db.thread_messages.find(
+        {"raw_email": {"$type": "string"}}, {"_id": 1, "raw_email": 1}
+    ):
+        blob = await blob_store_service.put(message["raw_email"].encode("utf-8", errors="replace"))
+        await db_service.db.thread_messages.update_one(
+            {"_id": message["_id"]},
+            {"$set": {"raw_email_ref": blob["ref"], "raw_email_size": blob["size"]}, "$unset": {"raw_email": ""}}
+        )
+        offloaded += 1
+
+    stats = blob_store_service.get_stats()
+    print(f"✅ Offloaded {offloaded} raw emails: {stats['stored']} blobs stored, {stats['deduplicated']} deduplicated, "
+          f"{stats['bytes_in']} bytes in, {stats['bytes_stored']} bytes stored")
+    await db_service.disconnect()
+
+if __name__ == "__main__":
+    asyncio.run(offload_raw_emails())